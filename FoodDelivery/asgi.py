@@ -12,5 +12,17 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'FoodDelivery.settings')
+# До загрузки настроек: под ASGI постоянные соединения с БД выключены, см. settings
+os.environ['SERVER'] = 'asgi'
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from main.chat import chat_application, lifespan  # noqa: E402 (нужен настроенный Django)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await chat_application(scope, receive, send)
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+    return await django_application(scope, receive, send)
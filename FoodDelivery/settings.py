@@ -38,15 +38,22 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
+    'django_filters',
     'main',
     'drf_spectacular',
     'drf_extra_fields',
     'corsheaders',
 ]
 
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+
 REST_FRAMEWORK = {
-    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema'
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_PAGINATION_CLASS': 'main.pagination.CursorPagination',
+    'PAGE_SIZE': PAGE_SIZE,
 }
 
 SPECTACULAR_SETTINGS = {
@@ -55,8 +62,12 @@ SPECTACULAR_SETTINGS = {
     'VERSION': '1.0.0',  # Версия API
     'SERVE_INCLUDE_SCHEMA': True,  # Отключение схемы в ответах API
 }
+# Собранная схема (manage.py build_schema), её отдаёт main.schema.SchemaView
+SCHEMA_ARTIFACT_DIR = os.environ.get('SCHEMA_ARTIFACT_DIR', BASE_DIR / 'schema')
 
 MIDDLEWARE = [
+    # Первым, чтобы время запроса включало остальные middleware
+    'main.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -90,6 +101,29 @@ WSGI_APPLICATION = 'FoodDelivery.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+#
+# DB_POOL=1 включает пул соединений psycopg 3 на процесс — рекомендуемый способ
+# переиспользовать соединения и режим по умолчанию под ASGI. С пулом постоянные
+# соединения не нужны, CONN_MAX_AGE должен быть 0. Статистика — /health/db/.
+#
+# Под ASGI (SERVER=asgi, его выставляет FoodDelivery.asgi) у каждого запроса
+# свой контекст соединений: постоянное соединение не переиспользуется
+# следующими запросами, а остаётся открытым, пока не кончится max_connections.
+# Поэтому там CONN_MAX_AGE всегда 0.
+#
+# Под WSGI без пула соединение живёт DB_CONN_MAX_AGE секунд и переиспользуется
+# между запросами (none — без ограничения, 0 — новое соединение на каждый запрос),
+# перед переиспользованием проверяется (DB_CONN_HEALTH_CHECKS).
+
+SERVER = os.environ.get('SERVER', 'wsgi')
+DB_POOL = os.environ.get('DB_POOL', '1' if SERVER == 'asgi' else '0') == '1'
+if DB_POOL or SERVER == 'asgi':
+    DB_CONN_MAX_AGE = 0
+elif os.environ.get('DB_CONN_MAX_AGE', '60') == 'none':
+    DB_CONN_MAX_AGE = None
+else:
+    DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -98,9 +132,88 @@ DATABASES = {
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
         'HOST': os.environ.get('POSTGRES_HOST'),
         'PORT': os.environ.get('POSTGRES_PORT'),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                # Сколько секунд запрос ждёт свободное соединение, прежде чем упасть
+                'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', 600)),
+                'max_lifetime': float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),
+            },
+        } if DB_POOL else {},
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+#
+# Кэш меню (main.cache) инвалидируется счётчиком версии, поэтому TIMEOUT не нужен.
+# locmem хранит счётчик внутри процесса и подходит только для одного воркера,
+# при нескольких воркерах нужен file или redis (пакет redis, REDIS_URL).
+
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
+
+MENU_CACHE_BACKEND = os.environ.get('MENU_CACHE_BACKEND', 'locmem')
+MENU_CACHE_MAX_ENTRIES = int(os.environ.get('MENU_CACHE_MAX_ENTRIES', 1000))
+
+MENU_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'menu',
+        'OPTIONS': {'MAX_ENTRIES': MENU_CACHE_MAX_ENTRIES},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('MENU_CACHE_LOCATION', BASE_DIR / 'cache' / 'menu'),
+        'OPTIONS': {'MAX_ENTRIES': MENU_CACHE_MAX_ENTRIES},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        # Вытеснение задаётся на стороне сервера: maxmemory-policy allkeys-lru
+        'KEY_PREFIX': 'menu',
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'menu': {
+        **MENU_CACHE_BACKENDS[MENU_CACHE_BACKEND],
+        'TIMEOUT': None,
+    },
+}
+
+# Чат по WebSocket (main.chat)
+#
+# memory рассылает события внутри процесса и подходит только для одного воркера,
+# при нескольких нужен redis: pub/sub любого Redis-совместимого сервера (пакет redis).
+
+CHAT_FANOUT_BACKEND = os.environ.get('CHAT_FANOUT_BACKEND', 'memory')
+
+CHAT_FANOUT_BACKENDS = {
+    'memory': {
+        'BACKEND': 'main.chat.InMemoryFanout',
+    },
+    'redis': {
+        'BACKEND': 'main.chat.RedisFanout',
+        'LOCATION': os.environ.get('CHAT_FANOUT_LOCATION', REDIS_URL),
+        'PREFIX': 'chat:',
+    },
+}
+
+CHAT_FANOUT = CHAT_FANOUT_BACKENDS[CHAT_FANOUT_BACKEND]
+# Сообщения пишутся пачками: не реже раза в CHAT_FLUSH_INTERVAL секунд
+CHAT_FLUSH_INTERVAL = float(os.environ.get('CHAT_FLUSH_INTERVAL', 0.05))
+CHAT_BATCH_SIZE = int(os.environ.get('CHAT_BATCH_SIZE', 500))
+# Сколько событий ждут отправки одному клиенту, прежде чем его отключат
+CHAT_QUEUE_SIZE = int(os.environ.get('CHAT_QUEUE_SIZE', 256))
+CHAT_MAX_MESSAGE_LENGTH = int(os.environ.get('CHAT_MAX_MESSAGE_LENGTH', 4000))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -140,6 +253,23 @@ STATIC_ROOT = BASE_DIR / 'static'
 
 MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
+# Медиа через Django (main.images.serve_media), файлы без хэша в имени кэшируются на MEDIA_MAX_AGE
+SERVE_MEDIA = True
+MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE', 3600))
+
+# Фоновая обработка изображений (main.images), 0 — без пула, сразу после коммита
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+IMAGE_MAX_UPLOAD_SIZE = int(os.environ.get('IMAGE_MAX_UPLOAD_SIZE', 10 * 1024 * 1024))
+# Тело запроса с изображением: base64 длиннее файла на треть, плюс остальные поля
+IMAGE_MAX_REQUEST_SIZE = IMAGE_MAX_UPLOAD_SIZE * 4 // 3 + 256 * 1024
+FILE_UPLOAD_TEMP_DIR = os.environ.get('FILE_UPLOAD_TEMP_DIR')
+
+# Метрики запросов (main.metrics): заголовок Server-Timing и /metrics для Prometheus
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+# Если задан, /metrics требует Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Превышение query_budgets вьюсета: False — предупреждение в лог, True — ошибка (тесты)
+QUERY_BUDGETS_ENFORCE = False
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
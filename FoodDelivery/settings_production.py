@@ -0,0 +1,66 @@
+"""
+Профиль для продакшена: DJANGO_SETTINGS_MODULE=FoodDelivery.settings_production.
+
+Без DEBUG Django не копит каждый SQL-запрос в памяти, статика отдаётся
+WhiteNoise из собранных collectstatic файлов: имена с хэшем содержимого
+кэшируются навсегда (immutable), рядом лежат сжатые gzip и brotli версии.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from FoodDelivery.settings import *  # noqa: F401,F403
+from FoodDelivery.settings import MIDDLEWARE, CACHES, MENU_CACHE_BACKENDS, MENU_CACHE_BACKEND, \
+    CHAT_FANOUT_BACKEND, SERVER
+
+DEBUG = False
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+# Без явного списка кэш меню и ленты акций (ключи с хостом) растёт от любых Host
+ALLOWED_HOSTS = os.environ['DJANGO_ALLOWED_HOSTS'].split(',')
+
+# Итоговое число воркеров gunicorn.conf.py кладёт в WEB_CONCURRENCY.
+# Версии меню, ETag и акций живут в кэше меню без TIMEOUT: с locmem правка,
+# сделанная одним воркером, никогда не дойдёт до остальных, поэтому при
+# нескольких воркерах кэш по умолчанию файловый, а locmem — ошибка запуска.
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+if WORKERS > 1:
+    if 'MENU_CACHE_BACKEND' not in os.environ:
+        MENU_CACHE_BACKEND = 'file'
+        CACHES = {**CACHES, 'menu': {**MENU_CACHE_BACKENDS['file'], 'TIMEOUT': None}}
+    elif MENU_CACHE_BACKEND == 'locmem':
+        raise ImproperlyConfigured(f"MENU_CACHE_BACKEND=locmem with {WORKERS} workers: "
+                                   "use MENU_CACHE_BACKEND=file or redis")
+    if SERVER == 'asgi' and CHAT_FANOUT_BACKEND == 'memory':
+        raise ImproperlyConfigured(f"CHAT_FANOUT_BACKEND=memory with {WORKERS} workers: chat events would "
+                                   "stay in one worker, use CHAT_FANOUT_BACKEND=redis (REDIS_URL) "
+                                   "or WEB_CONCURRENCY=1")
+
+# WhiteNoise сразу после SecurityMiddleware, чтобы статика не проходила остальные слои
+_security = MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1
+MIDDLEWARE = [*MIDDLEWARE[:_security], 'whitenoise.middleware.WhiteNoiseMiddleware', *MIDDLEWARE[_security:]]
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Медиа отдаёт main.images.serve_media (FileResponse с Cache-Control);
+# за nginx/CDN выключить и отдавать MEDIA_ROOT оттуда
+SERVE_MEDIA = os.environ.get('SERVE_MEDIA', '1') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.environ.get('LOG_LEVEL', 'INFO'),
+    },
+}
@@ -1,16 +1,22 @@
-from django.conf.urls.static import static
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path
-from drf_spectacular.views import SpectacularRedocView, SpectacularAPIView, SpectacularSwaggerView
+from django.urls import path, re_path
+from drf_spectacular.views import SpectacularRedocView, SpectacularSwaggerView
 
-from FoodDelivery import settings
 from main import urls as main_urls
+from main.images import serve_media
+from main.metrics import metrics_view
+from main.schema import SchemaView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
+    path('api/schema/', SchemaView.as_view(), name='schema'),
     path('api/docs/swagger/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
-    path('api/docs/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc')
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('api/docs/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    path('metrics', metrics_view, name='metrics'),
+]
+
+if settings.SERVE_MEDIA:
+    urlpatterns.append(re_path(rf'^{settings.MEDIA_URL.lstrip("/")}(?P<path>.*)$', serve_media))
 
 urlpatterns = urlpatterns + main_urls.urlpatterns
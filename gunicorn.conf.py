@@ -0,0 +1,51 @@
+"""
+Настройки gunicorn для продакшена: gunicorn -c gunicorn.conf.py
+
+SERVER=asgi (по умолчанию) — uvicorn-воркеры, нужны для WebSocket-чата;
+соединения с БД там переиспользует только пул (DB_POOL, по умолчанию включён),
+постоянные соединения выключены, см. FoodDelivery.settings.
+SERVER=wsgi — gthread-воркеры, только HTTP.
+
+При нескольких воркерах кэш меню и рассылка чата должны быть общими:
+MENU_CACHE_BACKEND=redis (по умолчанию file) и CHAT_FANOUT_BACKEND=redis
+(сервер в REDIS_URL), иначе FoodDelivery.settings_production не даст
+запуститься. Поэтому под ASGI без CHAT_FANOUT_BACKEND=redis воркер по
+умолчанию один, с ним — по одному на ядро.
+"""
+import multiprocessing
+import os
+
+SERVER = os.environ.get('SERVER', 'asgi')
+CPU_COUNT = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+
+if SERVER == 'asgi':
+    wsgi_app = 'FoodDelivery.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    # Асинхронный воркер не блокируется на ожидании, хватает процесса на ядро,
+    # но рассылка чата в памяти работает только внутри одного процесса
+    shared_fanout = os.environ.get('CHAT_FANOUT_BACKEND', 'memory') != 'memory'
+    workers = int(os.environ.get('WEB_CONCURRENCY', CPU_COUNT if shared_fanout else 1))
+else:
+    wsgi_app = 'FoodDelivery.wsgi:application'
+    worker_class = 'gthread'
+    workers = int(os.environ.get('WEB_CONCURRENCY', CPU_COUNT * 2 + 1))
+    threads = int(os.environ.get('WEB_THREADS', 4))
+
+# Keep-alive должен быть дольше idle timeout балансировщика перед нами,
+# иначе он будет ловить закрытые соединения
+keepalive = int(os.environ.get('KEEPALIVE', 75))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+# Перезапуск воркеров против утечек памяти; для WebSocket рвёт соединения, поэтому по умолчанию выключен
+max_requests = int(os.environ.get('MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# Воркеры наследуют окружение: по нему settings_production проверяет общие кэши
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+accesslog = os.environ.get('ACCESS_LOG', '-') or None
+# Пул потоков обработки изображений и asyncio-состояние не переживают fork
+preload_app = False
+
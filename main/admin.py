@@ -18,9 +18,20 @@ class FoodAdmin(admin.ModelAdmin):
 
 @admin.register(FoodCategory)
 class FoodCategoryAdmin(admin.ModelAdmin):
-    list_display = ["title", "id", "description", 'get_food_in_count']
+    list_display = ["title", "id", "description", 'food_count', 'active_food_count']
     list_display_links = ["id", "title"]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_food_count()
+
+    @admin.display(description="Блюд", ordering='food_in_count')
+    def food_count(self, obj):
+        return obj.food_in_count
+
+    @admin.display(description="Активных блюд", ordering='active_food_in_count')
+    def active_food_count(self, obj):
+        return obj.active_food_in_count
+
 @admin.register(SizeAndPrice)
 class SizeAndPriceAdmin(admin.ModelAdmin):
     pass
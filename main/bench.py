@@ -0,0 +1,326 @@
+"""
+Синтетические данные и замеры для сравнения производительности между
+коммитами: manage.py seed_bench заполняет пустую БД, manage.py run_bench
+прогоняет эндпоинты роутера main.urls и расчёт стоимости заказов и пишет
+результат в JSON.
+
+Данные генерируются Faker и random с одним seed, поэтому при тех же
+параметрах на пустой БД получается тот же набор строк.
+"""
+import itertools
+import random
+import resource
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction, connection, reset_queries
+from django.utils import timezone
+from faker import Faker
+
+from main.cache import bump_menu_version, bump_version, DISCOUNTS_VERSION_KEY
+from main.metrics import RequestMetrics
+from main.models import User, FoodCategory, Food, SizeAndPrice, Addition, FoodFeedback, Order, Ordering, \
+    AdditionEnrollment, Chat, Message, Discount, DiscountCondition
+from main.search import update_search_vectors
+
+BENCH_PASSWORD = 'bench'
+SIZES = (('S', 25, 400), ('M', 30, 550), ('L', 35, 700), ('XL', 40, 900))
+
+
+@dataclass
+class SeedVolumes:
+    users: int = 200
+    categories: int = 20
+    foods_per_category: int = 50
+    sizes_per_food: int = 3
+    additions: int = 30
+    additions_per_food: int = 5
+    feedback_per_food: int = 5
+    orders: int = 2000
+    items_per_order: int = 3
+    chats: int = 300
+    messages_per_chat: int = 20
+    discounts: int = 30
+
+
+def seed(volumes, random_seed=0, batch_size=2000):
+    """
+    Создаёт строки пачками через bulk_create, денормализованные поля
+    (оценки, минимальные цены, поисковые векторы, последние сообщения
+    чатов) пересчитывает одним UPDATE на таблицу. Возвращает число
+    созданных строк по моделям.
+    """
+    fake = Faker('ru_RU')
+    fake.seed_instance(random_seed)
+    rnd = random.Random(random_seed)
+    now = timezone.now()
+
+    def create(model, objects):
+        return model.objects.bulk_create(objects, batch_size=batch_size)
+
+    with transaction.atomic():
+        password = make_password(BENCH_PASSWORD)
+        users = []
+        for i in range(volumes.users):
+            user = User(first_name=fake.first_name(), last_name=fake.last_name(), password=password,
+                        phone=fake.numerify('79#########'), birthday=fake.date_of_birth(minimum_age=16),
+                        has_discount_card=rnd.random() < 0.3, status=1, is_staff=i == 0)
+            # User.__init__ строит username из имени, а он должен быть уникальным
+            user.username = f'bench{i}'
+            users.append(user)
+        users = create(User, users)
+
+        categories = create(FoodCategory, [
+            FoodCategory(title=f"{fake.word().capitalize()} {i}", description=fake.sentence())
+            for i in range(volumes.categories)])
+        additions = create(Addition, [
+            Addition(title=f"{fake.word().capitalize()} {i}", description=fake.sentence(),
+                     price=Decimal(rnd.randrange(20, 200, 5)))
+            for i in range(volumes.additions)])
+        foods = create(Food, [
+            Food(title=f"{fake.word().capitalize()} {fake.word()}", description=fake.paragraph(),
+                 category=category, cooking_time=rnd.randrange(5, 60), active=rnd.random() < 0.95)
+            for category in categories for _ in range(volumes.foods_per_category)])
+
+        sizes_per_food = min(volumes.sizes_per_food, len(SIZES))
+        sizes = create(SizeAndPrice, [
+            SizeAndPrice(title=title, size=size, weight=weight, price=Decimal(rnd.randrange(150, 400, 10) + 100 * j))
+            for _ in foods for j, (title, size, weight) in enumerate(SIZES[:sizes_per_food])])
+        food_sizes = {food.id: sizes[i * sizes_per_food:(i + 1) * sizes_per_food] for i, food in enumerate(foods)}
+        create(Food.sizes_and_prices.through, [
+            Food.sizes_and_prices.through(food_id=food_id, sizeandprice_id=size.id)
+            for food_id, food_size_list in food_sizes.items() for size in food_size_list])
+        food_additions = {food.id: rnd.sample(additions, min(volumes.additions_per_food, len(additions)))
+                          for food in foods}
+        create(Food.accepted_additions.through, [
+            Food.accepted_additions.through(food_id=food_id, addition_id=addition.id)
+            for food_id, addition_list in food_additions.items() for addition in addition_list])
+
+        create(FoodFeedback, [
+            FoodFeedback(text=fake.sentence(), rate=rnd.randint(1, 5), created_by=rnd.choice(users), food=food)
+            for food in foods for _ in range(volumes.feedback_per_food)])
+
+        # bulk_create не шлёт сигналы: то, что они поддерживают, пересчитываем сами
+        food_ids = Food.objects.filter(id__in=[food.id for food in foods])
+        food_ids.rebuild_ratings()
+        food_ids.refresh_min_price()
+        update_search_vectors(food_ids)
+
+        orders = create(Order, [Order() for _ in range(volumes.orders)])
+        orderings = create(Ordering, [
+            Ordering(main_order=order, food=food, size=rnd.choice(food_sizes[food.id]), count=rnd.randint(1, 3))
+            for order in orders for food in rnd.sample(foods, min(volumes.items_per_order, len(foods)))])
+        create(Order.order_items.through, [
+            Order.order_items.through(order_id=ordering.main_order_id, ordering_id=ordering.id)
+            for ordering in orderings])
+        create(AdditionEnrollment, [
+            AdditionEnrollment(ordering=ordering, addition=rnd.choice(food_additions[ordering.food_id]),
+                               count=rnd.randint(1, 2))
+            for ordering in orderings if food_additions[ordering.food_id] and rnd.random() < 0.5])
+
+        chats = []
+        if len(users) > 1:
+            # Первый пользователь (is_staff, под ним работает run_bench) участвует в части чатов
+            for i in range(min(volumes.chats, len(orders))):
+                owner = users[i % len(users)]
+                other = users[(i + rnd.randrange(1, len(users))) % len(users)]
+                chats.append(Chat(order=orders[i], owner=owner, dialogue_with=other))
+        chats = create(Chat, chats)
+        messages = []
+        for chat in chats:
+            for i in range(volumes.messages_per_chat):
+                messages.append(Message(chat=chat, sender=chat.owner if i % 2 else chat.dialogue_with,
+                                        message=fake.sentence(), is_read=rnd.random() < 0.7))
+        create(Message, messages)
+        Chat.objects.filter(id__in=[chat.id for chat in chats]).refresh_last_message()
+
+        conditions = create(DiscountCondition, [
+            DiscountCondition(
+                title=fake.catch_phrase()[:100],
+                min_order_price=rnd.choice([None, 500, 1000, 2000]),
+                min_order_weight=rnd.choice([None, None, 1000, 2000]),
+                food_size=rnd.choice([None, None, None, 35]),
+                discount_card=rnd.random() < 0.2,
+                birthday=rnd.random() < 0.1,
+            ) for _ in range(volumes.discounts)])
+        create(DiscountCondition.food_categories.through, [
+            DiscountCondition.food_categories.through(discountcondition_id=condition.id, foodcategory_id=category.id)
+            for condition in conditions if categories and rnd.random() < 0.5
+            for category in rnd.sample(categories, min(2, len(categories)))])
+        discounts = create(Discount, [
+            Discount(title=fake.catch_phrase()[:100], description=fake.sentence(), condition=condition,
+                     status=rnd.choice([1, 1, 1, 0, 2]), discount_value=Decimal(rnd.randint(100, 999)) / 100,
+                     created_at=now - timedelta(days=rnd.randint(0, 30)),
+                     expires_at=rnd.choice([None, now + timedelta(days=rnd.randint(1, 60))]))
+            for condition in conditions])
+
+        transaction.on_commit(bump_menu_version)
+        transaction.on_commit(lambda: bump_version(DISCOUNTS_VERSION_KEY))
+
+    return {
+        'users': len(users), 'categories': len(categories), 'additions': len(additions), 'foods': len(foods),
+        'sizes': len(sizes), 'orders': len(orders), 'orderings': len(orderings), 'chats': len(chats),
+        'messages': len(messages), 'discounts': len(discounts),
+    }
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса: ru_maxrss в килобайтах на Linux и в байтах на macOS."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else (values or [0])[0]
+
+
+@dataclass
+class Case:
+    """Один замеряемый путь: run() выполняет его и возвращает размер ответа в байтах или None."""
+    name: str
+    run: callable
+    before: callable = None
+    info: dict = field(default_factory=dict)
+
+
+def measure(case, iterations, warmup):
+    """
+    Последовательные вызовы в текущем процессе: пропускная способность,
+    перцентили длительности, SQL-запросов на вызов и пиковый RSS процесса
+    после прогона (он только растёт, для изолированного значения
+    запускайте один кейс на процесс).
+    """
+    for _ in range(warmup):
+        if case.before:
+            case.before()
+        case.run()
+
+    durations, queries, size = [], 0, None
+    for _ in range(iterations):
+        if case.before:
+            case.before()
+        reset_queries()
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            started = time.perf_counter()
+            size = case.run()
+            durations.append(time.perf_counter() - started)
+        queries += metrics.queries
+
+    total = sum(durations)
+    return {
+        'name': case.name,
+        **case.info,
+        'iterations': iterations,
+        'rps': round(iterations / total, 1) if total else None,
+        'avg_ms': round(statistics.fmean(durations) * 1000, 3),
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p99_ms': round(percentile(durations, 99) * 1000, 3),
+        'queries_per_request': round(queries / iterations, 2),
+        'response_bytes': size,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def response_size(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def sample_carts(orders, user=None):
+    """Корзины в формате CartSerializer.validated_data из позиций заказов."""
+    carts = {order.id: {'items': []} for order in orders}
+    orderings = Ordering.objects.filter(main_order__in=orders).prefetch_related('additionenrollment_set')
+    for ordering in orderings:
+        carts[ordering.main_order_id]['items'].append({
+            'food': ordering.food_id, 'size': ordering.size_id, 'count': ordering.count,
+            'additions': [{'addition': enrollment.addition_id, 'count': enrollment.count}
+                          for enrollment in ordering.additionenrollment_set.all()],
+        })
+    return [cart for cart in carts.values() if cart['items']]
+
+
+def router_cases(client, user, carts, menu_cache):
+    """
+    GET-эндпоинты роутера main.urls (список, объект, дополнительные
+    действия) и расчёт корзин через POST /order/quote/. Изменяющие данные
+    действия (импорт меню, загрузка изображений) не замеряются.
+    """
+    from django.urls import reverse, NoReverseMatch
+
+    from main.cache import get_menu_cache
+    from main.urls import router
+
+    first_food = Food.objects.order_by('id').first()
+    params = {'food-search': {'q': first_food.title.split()[0] if first_food else 'пицца'}}
+    detail_objects = {'chat': Chat.objects.inbox(user)}
+    before = get_menu_cache().clear if menu_cache == 'cold' else None
+
+    def get(url, data):
+        return lambda: response_size(client.get(url, data))
+
+    cases = []
+    for prefix, viewset, basename in router.registry:
+        queryset = detail_objects.get(prefix, getattr(viewset, 'queryset', None))
+        pk = queryset.order_by('pk').values_list('pk', flat=True).first() if queryset is not None else None
+        routes = [('list', False), ('detail', True)] + [
+            (extra.url_name, extra.detail) for extra in viewset.get_extra_actions() if 'get' in extra.mapping]
+        for url_name, detail in routes:
+            if url_name == 'list' and not hasattr(viewset, 'list') or \
+                    url_name == 'detail' and not hasattr(viewset, 'retrieve'):
+                continue
+            name = f'{basename}-{url_name}'
+            try:
+                url = reverse(name, kwargs={'pk': pk} if detail else None)
+            except NoReverseMatch:
+                continue
+            data = params.get(name, {})
+            cases.append(Case(name, get(url, data), before, {'method': 'GET', 'url': url, 'params': data}))
+
+    quote_url = reverse('order-quote')
+
+    def quote():
+        return response_size(client.post(quote_url, carts, content_type='application/json'))
+
+    cases.append(Case('order-quote', quote, info={'method': 'POST', 'url': quote_url, 'carts': len(carts)}))
+    return cases
+
+
+def pricing_cases(user, orders, carts):
+    """Расчёт стоимости и акций без HTTP: то, на что опираются заказ и /order/quote/."""
+    from main.discounts import DiscountEngine, get_discount_engine
+    from main.pricing import OrderPricing, quote_carts
+
+    order_ids = [order.id for order in orders]
+    next_order_id = itertools.cycle(order_ids).__next__
+
+    def order_discount_price():
+        # Новый объект на каждый вызов, чтобы не попадать в закэшированный Order.pricing
+        Order(pk=next_order_id()).get_discount_price(user)
+
+    pricings = [OrderPricing.from_orderings(Order(pk=order_id).order_items.all()) for order_id in order_ids]
+    engine = get_discount_engine()
+
+    def quote():
+        quote_carts(carts, user)
+
+    def evaluate_all():
+        for pricing in pricings:
+            engine.evaluate(pricing, user)
+
+    def load():
+        DiscountEngine.load()
+
+    return [
+        Case('pricing-order-discount-price', order_discount_price, info={'orders': len(order_ids)}),
+        Case('pricing-quote-carts', quote, info={'carts': len(carts)}),
+        Case('discounts-evaluate', evaluate_all,
+             info={'pricings': len(pricings), 'discounts': len(engine.discounts)}),
+        Case('discounts-load', load, info={'discounts': len(engine.discounts)}),
+    ]
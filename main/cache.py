@@ -0,0 +1,131 @@
+"""
+Кэш меню.
+
+В кэше лежит уже отрендеренный JSON списков /food/ и /category/. Вместо
+TTL используется счётчик версии меню: сигналы из main.signals увеличивают
+его при любом изменении блюд, категорий, размеров и добавок, после чего
+все старые ключи перестают читаться и со временем вытесняются из кэша.
+
+Здесь же хранятся версии акций и баннеров: по первой main.discounts
+понимает, что скомпилированные условия устарели, обе входят в ключ
+ленты main.promo.
+"""
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+MENU_CACHE_ALIAS = 'menu'
+MENU_VERSION_KEY = 'menu:version'
+MENU_MODIFIED_KEY = 'menu:modified'
+DISCOUNTS_VERSION_KEY = 'discounts:version'
+BANNERS_VERSION_KEY = 'banners:version'
+
+
+def get_menu_cache():
+    return caches[MENU_CACHE_ALIAS]
+
+
+def initial_version():
+    # Версия стартует со времени в миллисекундах, а не с единицы: после
+    # очистки кэша ETag, выданные раньше, не совпадут с новыми
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    return get_menu_cache().get_or_set(key, initial_version, timeout=None)
+
+
+def bump_version(key):
+    cache = get_menu_cache()
+    cache.add(key, initial_version(), timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Ключ успели вытеснить между add и incr
+        version = initial_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def get_menu_version():
+    return get_version(MENU_VERSION_KEY)
+
+
+def get_menu_modified():
+    return get_menu_cache().get_or_set(MENU_MODIFIED_KEY, timezone.now, timeout=None)
+
+
+def bump_menu_version():
+    get_menu_cache().set(MENU_MODIFIED_KEY, timezone.now(), timeout=None)
+    return bump_version(MENU_VERSION_KEY)
+
+
+class MenuConditionalGetMixin:
+    """
+    ETag и Last-Modified для list() и retrieve() по версии меню.
+    Валидаторы считаются без БД и сериализации, поэтому If-None-Match
+    и If-Modified-Since отвечают 304 до запуска сериализатора.
+    """
+    menu_cache_prefix = None
+
+    def get_menu_etag(self, request, *args, **kwargs):
+        # Хост, как и в ключе MenuCacheMixin: в ответе абсолютные ссылки на изображения
+        variant = "|".join([self.action, request.get_host(), request.accepted_renderer.format or '',
+                            request.META.get('QUERY_STRING', ''), str(kwargs.get(self.lookup_field, ''))])
+        digest = hashlib.md5(variant.encode()).hexdigest()[:16]
+        return f"{self.menu_cache_prefix}-{get_menu_version()}-{digest}"
+
+    def get_menu_last_modified(self, request, *args, **kwargs):
+        return get_menu_modified()
+
+    def conditional(self, handler):
+        return condition(etag_func=self.get_menu_etag, last_modified_func=self.get_menu_last_modified)(handler)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list)(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve)(request, *args, **kwargs)
+
+
+class MenuCacheMixin:
+    """
+    Отдаёт list() из кэша меню. Ключ строится из menu_cache_prefix и
+    значений menu_cache_params; запросы с любыми другими параметрами
+    и с не-JSON рендерером идут мимо кэша.
+    """
+    menu_cache_prefix = None
+    menu_cache_params = ()
+
+    def get_menu_cache_key(self, request):
+        if request.accepted_renderer.format != 'json':
+            return None
+        params = request.query_params
+        if any(name not in self.menu_cache_params for name in params):
+            return None
+        values = "&".join(f"{name}={params.get(name, '')}" for name in self.menu_cache_params)
+        # Ссылки next/previous абсолютные, поэтому хост входит в ключ
+        return f"{self.menu_cache_prefix}:list:{request.get_host()}:{values}"
+
+    def list(self, request, *args, **kwargs):
+        key = self.get_menu_cache_key(request)
+        if key is None:
+            return super().list(request, *args, **kwargs)
+
+        cache = get_menu_cache()
+        # Версию читаем до обращения к БД: если меню поменяется во время
+        # сериализации, результат уйдёт под старую версию и не будет прочитан
+        version = get_menu_version()
+        content = cache.get(key, version=version)
+        if content is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = request.accepted_renderer.render(response.data, request.accepted_media_type,
+                                                       self.get_renderer_context())
+            cache.set(key, content, timeout=None, version=version)
+        return HttpResponse(content, content_type=request.accepted_media_type)
@@ -0,0 +1,451 @@
+"""
+Чат по заказу поверх WebSocket: ws/chat/<id>/ для владельца чата и его
+собеседника.
+
+Клиент шлёт {"type": "message", "message": "..."} и
+{"type": "read", "up_to": <id сообщения>}, получает те же события от
+всех участников. Сообщения и отметки о прочтении копятся в ChatWriter и
+пишутся пачками: на пачку один INSERT сообщений, один UPDATE последних
+сообщений чатов и один UPDATE отметок о прочтении. После записи события
+рассылаются через fan-out (CHAT_FANOUT): в памяти процесса или через
+pub/sub Redis-совместимого сервера, если воркеров несколько.
+
+Подключение принимается только со страниц своих хостов (Origin, см.
+origin_allowed) и по сессионной куке участника чата.
+
+На соединение приходятся одна очередь и одна задача-отправитель, к БД
+соединение обращается только при подключении, поэтому воркер держит
+тысячи подключений.
+"""
+import asyncio
+import json
+import logging
+import re
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import transaction, close_old_connections, DatabaseError
+from django.db.models import Q
+from django.http.request import validate_host
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+
+from main.models import Chat, Message
+from main.serializers import MessageSerializer
+
+logger = logging.getLogger(__name__)
+
+CHAT_PATH = re.compile(r'^/ws/chat/(?P<chat_id>\d+)/$')
+
+# Коды закрытия WebSocket из диапазона приложений
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+# Клиент не успевает читать: переподключится и догрузит историю через API
+CLOSE_TOO_SLOW = 4008
+
+OVERFLOW = object()
+
+
+def chat_group(chat_id):
+    return f'chat.{chat_id}'
+
+
+def database(func):
+    """
+    sync_to_async для ORM вне запроса: как Django между запросами,
+    закрывает соединения, которые пора закрыть.
+    """
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=True)
+
+
+class InMemoryFanout:
+    """Рассылка событий подписчикам внутри одного процесса."""
+
+    def __init__(self, **options):
+        self.groups = defaultdict(set)
+
+    async def subscribe(self, group, queue):
+        self.groups[group].add(queue)
+
+    async def unsubscribe(self, group, queue):
+        queues = self.groups.get(group)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.groups[group]
+
+    async def publish(self, events):
+        """events — пары (группа, событие)."""
+        for group, event in events:
+            self.deliver(group, event)
+
+    def deliver(self, group, event):
+        for queue in self.groups.get(group, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Переполненная очередь не должна тормозить остальных
+                queue.get_nowait()
+                queue.put_nowait(OVERFLOW)
+
+    async def close(self):
+        self.groups.clear()
+
+
+class RedisFanout(InMemoryFanout):
+    """
+    Рассылка через pub/sub Redis-совместимого сервера (нужен пакет redis).
+    На процесс одно соединение-подписчик, события из него раздаются
+    локальным подписчикам как в InMemoryFanout.
+    """
+
+    def __init__(self, location, prefix='chat:', **options):
+        super().__init__()
+        self.location = location
+        self.prefix = prefix
+        self.redis = None
+        self.pubsub = None
+        self.reader = None
+
+    async def connect(self):
+        if self.redis is None:
+            from redis import asyncio as aioredis
+
+            self.redis = aioredis.from_url(self.location)
+            self.pubsub = self.redis.pubsub()
+
+    async def subscribe(self, group, queue):
+        await self.connect()
+        if group not in self.groups:
+            await self.pubsub.subscribe(self.prefix + group)
+        await super().subscribe(group, queue)
+        if self.reader is None:
+            self.reader = asyncio.create_task(self.read())
+
+    async def unsubscribe(self, group, queue):
+        await super().unsubscribe(group, queue)
+        if group not in self.groups and self.pubsub is not None:
+            await self.pubsub.unsubscribe(self.prefix + group)
+
+    async def publish(self, events):
+        await self.connect()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for group, event in events:
+                pipe.publish(self.prefix + group, json.dumps(event))
+            await pipe.execute()
+
+    async def read(self):
+        while True:
+            try:
+                # Пока подписок нет, get_message ждёт их не дольше timeout
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Chat fan-out subscriber failed, reconnecting")
+                await asyncio.sleep(1)
+                continue
+            if message is not None and message['type'] == 'message':
+                group = message['channel'].decode()[len(self.prefix):]
+                self.deliver(group, json.loads(message['data']))
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        if self.redis is not None:
+            await self.pubsub.aclose()
+            await self.redis.aclose()
+        await super().close()
+
+
+def message_event(message):
+    return {
+        'type': 'message',
+        'id': message.id,
+        'chat': message.chat_id,
+        'sender': message.sender_id,
+        'message': message.message,
+        'created_at': serializers.DateTimeField().to_representation(message.created_at),
+        'is_read': message.is_read,
+    }
+
+
+def read_event(chat_id, user_id, up_to):
+    return {'type': 'read', 'chat': chat_id, 'user': user_id, 'up_to': up_to}
+
+
+@database
+def save_messages(messages):
+    try:
+        with transaction.atomic():
+            messages = Message.objects.bulk_create(messages)
+            # bulk_create не шлёт post_save, последнее сообщение чатов обновляем сами
+            latest = {message.chat_id: message for message in messages}
+            Chat.objects.bulk_update([Chat(pk=chat_id, last_message=message, last_activity_at=message.created_at)
+                                      for chat_id, message in latest.items()], ['last_message', 'last_activity_at'])
+            return messages
+    except DatabaseError:
+        # Одно битое сообщение (например, чат удалён) не должно терять всю пачку
+        logger.exception("Chat batch insert failed, saving messages one by one")
+    saved = []
+    for message in messages:
+        try:
+            with transaction.atomic():
+                message.save()
+        except DatabaseError:
+            logger.exception("Chat message to chat %s was not saved", message.chat_id)
+        else:
+            saved.append(message)
+    return saved
+
+
+@database
+def save_reads(reads):
+    """Все отметки пачки одним UPDATE: чужие сообщения чата до up_to включительно."""
+    condition = Q()
+    for (chat_id, user_id), up_to in reads.items():
+        condition |= Q(chat_id=chat_id, id__lte=up_to) & ~Q(sender_id=user_id)
+    return Message.objects.filter(condition, is_read=False).update(is_read=True)
+
+
+class ChatWriter:
+    """
+    Копит сообщения и отметки о прочтении и раз в CHAT_FLUSH_INTERVAL
+    (или как только набралось CHAT_BATCH_SIZE сообщений) пишет их пачкой,
+    после чего рассылает события.
+    """
+
+    def __init__(self, fanout, interval, batch_size):
+        self.fanout = fanout
+        self.interval = interval
+        self.batch_size = batch_size
+        self.messages = []
+        self.reads = {}
+        self.pending = asyncio.Event()
+        self.full = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def add_message(self, message):
+        self.messages.append(message)
+        if len(self.messages) >= self.batch_size:
+            self.full.set()
+        self.wake()
+
+    def mark_read(self, chat_id, user_id, up_to):
+        key = (chat_id, user_id)
+        self.reads[key] = max(up_to, self.reads.get(key, 0))
+        self.wake()
+
+    def wake(self):
+        self.pending.set()
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await self.pending.wait()
+            try:
+                await asyncio.wait_for(self.full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Chat flush failed")
+
+    async def flush(self):
+        async with self.lock:
+            messages, self.messages = self.messages, []
+            reads, self.reads = self.reads, {}
+            self.pending.clear()
+            self.full.clear()
+            events = []
+            if messages:
+                events += [(chat_group(message.chat_id), message_event(message))
+                           for message in await save_messages(messages)]
+            if reads:
+                await save_reads(reads)
+                events += [(chat_group(chat_id), read_event(chat_id, user_id, up_to))
+                           for (chat_id, user_id), up_to in reads.items()]
+            if events:
+                await self.fanout.publish(events)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+
+_state = {}
+
+
+def get_chat():
+    """Fan-out и writer процесса, привязанные к текущему циклу событий."""
+    loop = asyncio.get_running_loop()
+    if _state.get('loop') is not loop:
+        config = settings.CHAT_FANOUT
+        fanout = import_string(config['BACKEND'])(**{key.lower(): value for key, value in config.items()
+                                                    if key != 'BACKEND'})
+        writer = ChatWriter(fanout, settings.CHAT_FLUSH_INTERVAL, settings.CHAT_BATCH_SIZE)
+        _state.update(loop=loop, fanout=fanout, writer=writer)
+    return _state['fanout'], _state['writer']
+
+
+async def close_chat():
+    """Дописывает накопленное и закрывает fan-out; вызывается при остановке воркера."""
+    if _state.get('loop') is asyncio.get_running_loop():
+        await _state['writer'].close()
+        await _state['fanout'].close()
+    _state.clear()
+
+
+def origin_allowed(scope):
+    """
+    Защита от cross-site WebSocket hijacking: браузер отправляет сессионную
+    куку с рукопожатием с любой страницы, поэтому Origin должен быть хостом
+    из ALLOWED_HOSTS или одним из CORS_ALLOWED_ORIGINS. Без Origin
+    подключаются только не браузерные клиенты, их это не касается.
+    """
+    origin = next((value for name, value in scope.get('headers', ()) if name == b'origin'), None)
+    if origin is None:
+        return True
+    origin = origin.decode('latin-1')
+    if origin in getattr(settings, 'CORS_ALLOWED_ORIGINS', ()):
+        return True
+    try:
+        hostname = urlsplit(origin).hostname
+    except ValueError:
+        return False
+    return hostname is not None and validate_host(hostname, settings.ALLOWED_HOSTS)
+
+
+@database
+def authorize(scope, chat_id):
+    """id пользователя из сессионной куки, если он участник чата, иначе None."""
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', ()):
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+
+    session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user = get_user(SimpleNamespace(session=session))
+    if not user.is_authenticated:
+        return None
+    is_member = Chat.objects.filter(Q(owner=user) | Q(dialogue_with=user), pk=chat_id).exists()
+    return user.pk if is_member else None
+
+
+async def send_events(queue, send):
+    while True:
+        event = await queue.get()
+        if event is OVERFLOW:
+            await send({'type': 'websocket.close', 'code': CLOSE_TOO_SLOW})
+            return
+        await send({'type': 'websocket.send', 'text': json.dumps(event, ensure_ascii=False)})
+
+
+def parse_event(text):
+    try:
+        event = json.loads(text)
+    except (TypeError, ValueError):
+        return None, "Некорректный JSON"
+    if not isinstance(event, dict):
+        return None, "Ожидается объект"
+    if event.get('type') == 'message':
+        message = event.get('message')
+        if not isinstance(message, str) or not message.strip():
+            return None, "Пустое сообщение"
+        if len(message) > settings.CHAT_MAX_MESSAGE_LENGTH:
+            return None, f"Сообщение длиннее {settings.CHAT_MAX_MESSAGE_LENGTH} символов"
+        return event, None
+    if event.get('type') == 'read':
+        if not isinstance(event.get('up_to'), int) or isinstance(event.get('up_to'), bool):
+            return None, "up_to должен быть id сообщения"
+        return event, None
+    return None, "Неизвестный тип события"
+
+
+async def chat_application(scope, receive, send):
+    """ASGI-приложение для scope['type'] == 'websocket'."""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    match = CHAT_PATH.match(scope['path'])
+    if match is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    if not origin_allowed(scope):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+    chat_id = int(match['chat_id'])
+    user_id = await authorize(scope, chat_id)
+    if user_id is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    fanout, writer = get_chat()
+    queue = asyncio.Queue(settings.CHAT_QUEUE_SIZE)
+    await fanout.subscribe(chat_group(chat_id), queue)
+    await send({'type': 'websocket.accept'})
+    sender = asyncio.create_task(send_events(queue, send))
+    try:
+        while not sender.done():
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                break
+            if event['type'] != 'websocket.receive':
+                continue
+            data, error = parse_event(event.get('text'))
+            if error:
+                try:
+                    queue.put_nowait({'type': 'error', 'detail': error})
+                except asyncio.QueueFull:
+                    pass
+            elif data['type'] == 'message':
+                writer.add_message(Message(chat_id=chat_id, sender_id=user_id, message=data['message']))
+            else:
+                writer.mark_read(chat_id, user_id, data['up_to'])
+    finally:
+        await fanout.unsubscribe(chat_group(chat_id), queue)
+        sender.cancel()
+
+
+def export_messages(chat, request=None, chunk_size=1000):
+    """
+    NDJSON-выгрузка истории чата от старых к новым. Строки читаются
+    серверным курсором пачками по chunk_size, вложения догружаются
+    одним запросом на пачку, так что память не растёт с длиной чата.
+    """
+    messages = chat.message_set.order_by('created_at', 'id').prefetch_related('attachments')
+    for message in messages.iterator(chunk_size=chunk_size):
+        data = MessageSerializer(message, context={'request': request}).data
+        yield json.dumps(data, ensure_ascii=False) + '\n'
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan: при остановке дописывает накопленные сообщения."""
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            await close_chat()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
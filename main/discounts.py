@@ -0,0 +1,167 @@
+"""
+Движок акций.
+
+Все активные акции с условиями загружаются одним набором запросов и
+компилируются в простые структуры (множества id, размеры, окна времени).
+Дальше снимок стоимости заказа (main.pricing.OrderPricing, order.pricing)
+проверяется в чистом Python без обращений к БД. Скомпилированный
+вид живёт в процессе до тех пор, пока сигналы из main.signals не увеличат
+версию акций.
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from main.cache import get_version, DISCOUNTS_VERSION_KEY
+from main.models import Discount, DiscountCondition, FoodCategory, Food, User
+
+
+@dataclass(frozen=True)
+class CompiledCondition:
+    min_order_price: float = None
+    min_order_weight: float = None
+    category_ids: frozenset = frozenset()
+    food_ids: frozenset = frozenset()
+    food_size: int = None
+    user_ids: frozenset = frozenset()
+    discount_card: bool = False
+    birthday: bool = False
+    time_start: object = None
+    time_end: object = None
+
+    @classmethod
+    def compile(cls, condition):
+        return cls(
+            min_order_price=condition.min_order_price,
+            min_order_weight=condition.min_order_weight,
+            category_ids=frozenset(category.id for category in condition.food_categories.all()),
+            food_ids=frozenset(food.id for food in condition.foods.all()),
+            food_size=condition.food_size,
+            user_ids=frozenset(user.id for user in condition.user_role.all()),
+            discount_card=bool(condition.discount_card),
+            birthday=bool(condition.birthday),
+            time_start=condition.ordering_time_start,
+            time_end=condition.ordering_time_end,
+        )
+
+    def rejections(self, pricing, user, now):
+        """Список причин, по которым условие не выполнено; пустой, если выполнено."""
+        reasons = []
+        if self.min_order_price is not None and pricing.subtotal < Decimal(str(self.min_order_price)):
+            reasons.append('min_order_price')
+        if self.min_order_weight is not None and pricing.weight < self.min_order_weight:
+            reasons.append('min_order_weight')
+        # Категории, блюда и размер: достаточно хотя бы одного совпадения
+        if self.category_ids and self.category_ids.isdisjoint(pricing.category_ids):
+            reasons.append('food_categories')
+        if self.food_ids and self.food_ids.isdisjoint(pricing.food_ids):
+            reasons.append('foods')
+        if self.food_size is not None and self.food_size not in pricing.sizes:
+            reasons.append('food_size')
+
+        authenticated = user is not None and user.is_authenticated
+        if self.user_ids and not (authenticated and user.id in self.user_ids):
+            reasons.append('user_role')
+        if self.discount_card and not (authenticated and user.has_discount_card):
+            reasons.append('discount_card')
+        if self.birthday:
+            today = timezone.localdate(now)
+            birthday = user.birthday if authenticated else None
+            if not birthday or (birthday.month, birthday.day) != (today.month, today.day):
+                reasons.append('birthday')
+
+        if self.time_start or self.time_end:
+            time = timezone.localtime(now).time()
+            start, end = self.time_start, self.time_end
+            if start and end and start > end:
+                # Окно через полночь, например 22:00-02:00
+                inside = time >= start or time <= end
+            else:
+                inside = (not start or time >= start) and (not end or time <= end)
+            if not inside:
+                reasons.append('ordering_time')
+        return reasons
+
+
+@dataclass(frozen=True)
+class CompiledDiscount:
+    id: int
+    title: str
+    value: Decimal
+    starts_at: object = None
+    expires_at: object = None
+    condition: CompiledCondition = None
+
+    def rejections(self, pricing, user, now):
+        if self.starts_at and now < self.starts_at:
+            return ['not_started']
+        if self.expires_at and now > self.expires_at:
+            return ['expired']
+        if self.condition is None:
+            return []
+        return self.condition.rejections(pricing, user, now)
+
+    def amount(self, pricing):
+        return (pricing.subtotal * self.value / 100).quantize(Decimal('0.01'))
+
+
+@dataclass
+class DiscountResult:
+    best: CompiledDiscount = None
+    amount: Decimal = Decimal('0')
+    applicable: list = field(default_factory=list)
+    rejected: dict = field(default_factory=dict)
+
+
+class DiscountEngine:
+    def __init__(self, discounts, version=None):
+        self.discounts = discounts
+        self.version = version
+
+    @classmethod
+    def load(cls, version=None):
+        only_id = {
+            'food_categories': FoodCategory.objects.only('id'),
+            'foods': Food.objects.only('id'),
+            'user_role': User.objects.only('id'),
+        }
+        conditions = DiscountCondition.objects.prefetch_related(
+            *(Prefetch(name, queryset=queryset) for name, queryset in only_id.items()))
+        discounts = Discount.objects.filter(status=1).prefetch_related(Prefetch('condition', queryset=conditions))
+        compiled = [
+            CompiledDiscount(
+                id=discount.id, title=discount.title, value=discount.discount_value or Decimal('0'),
+                starts_at=discount.created_at, expires_at=discount.expires_at,
+                condition=CompiledCondition.compile(discount.condition) if discount.condition else None,
+            )
+            for discount in discounts
+        ]
+        return cls(compiled, version)
+
+    def evaluate(self, pricing, user=None, now=None):
+        now = now or timezone.now()
+        result = DiscountResult()
+        for discount in self.discounts:
+            reasons = discount.rejections(pricing, user, now)
+            if reasons:
+                result.rejected[discount.id] = reasons
+                continue
+            result.applicable.append(discount)
+            amount = discount.amount(pricing)
+            if result.best is None or amount > result.amount:
+                result.best, result.amount = discount, amount
+        return result
+
+
+_engine = None
+
+
+def get_discount_engine():
+    """Скомпилированные акции текущего процесса, пересобираются при смене версии."""
+    global _engine
+    version = get_version(DISCOUNTS_VERSION_KEY)
+    if _engine is None or _engine.version != version:
+        _engine = DiscountEngine.load(version)
+    return _engine
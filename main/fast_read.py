@@ -0,0 +1,186 @@
+"""
+Быстрый путь чтения для list() и retrieve() меню.
+
+ModelSerializer на каждый объект заново проходит по полям: get_attribute,
+проверки SkipField и PKOnlyObject, to_representation каждого поля, а
+FoodSerializer ещё создаёт вложенные сериализаторы категории и добавок.
+Здесь по классу сериализатора один раз строится план — список полей с
+функциями чтения и преобразования, — и объекты превращаются в обычные
+dict за один проход. Простые поля (int, str, bool, float) читаются прямо
+из атрибута модели, остальные (DecimalField, DateTimeField и т. п.)
+преобразуются тем же field.to_representation, что и в DRF, поэтому ответ
+побайтно совпадает с обычным. Рендерит его тот же JSONRenderer.
+
+План повторяет Serializer.to_representation и NestedRepresentationMixin;
+сериализатор с другим переопределённым to_representation план не строит.
+Методы SerializerMethodField вызываются у экземпляра без context.
+Создание и изменение по-прежнему идут через serializer_class.
+"""
+import functools
+from operator import attrgetter
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db.models.manager import BaseManager
+from rest_framework import fields, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from main.metrics import serializer_timer
+from main.serializers import NestedRepresentationMixin
+
+# Для модельных значений to_representation этих полей сводится к приведению типа
+DIRECT_FIELDS = {
+    fields.IntegerField: int,
+    fields.CharField: str,
+    fields.FloatField: float,
+    fields.BooleanField: bool,
+}
+SUPPORTED_REPRESENTATIONS = (serializers.Serializer.to_representation,
+                             NestedRepresentationMixin.to_representation)
+
+
+def file_url_converter(request):
+    # FileField.to_representation с use_url
+    def convert(value):
+        if not value:
+            return None
+        try:
+            url = value.url
+        except AttributeError:
+            return None
+        return request.build_absolute_uri(url) if request is not None else url
+    return convert
+
+
+class ReadPlan:
+    """
+    Поля сериализатора в виде (имя, чтение, фабрика преобразования).
+    Чтение получает объект и возвращает атрибут, фабрика по request
+    (он нужен только для абсолютных ссылок на файлы) даёт функцию
+    преобразования; None вместо фабрики значит, что чтение уже вернуло
+    готовое значение.
+    """
+
+    def __init__(self, serializer):
+        if type(serializer).to_representation not in SUPPORTED_REPRESENTATIONS:
+            raise ImproperlyConfigured(f"{type(serializer).__name__} переопределяет to_representation, "
+                                       "для main.fast_read поля нужно описать декларативно")
+        model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+        nested = getattr(serializer, 'nested_representation', {})
+        self.entries = []
+        for field in serializer._readable_fields:
+            if field.field_name in nested:
+                entry = self.nested_entry(field.field_name, nested[field.field_name])
+            else:
+                entry = self.field_entry(field, model)
+            self.entries.append(entry)
+
+    @staticmethod
+    def field_entry(field, model):
+        name = field.field_name
+        if isinstance(field, serializers.SerializerMethodField):
+            return name, getattr(field.parent, field.method_name), None
+
+        if field.source == '*':
+            get = lambda instance: instance  # noqa: E731
+        elif len(field.source_attrs) == 1 and is_plain_model_field(model, field.source):
+            get = attrgetter(field.source)
+        else:
+            get = field.get_attribute
+
+        if isinstance(field, serializers.ListSerializer):
+            child = get_plan(type(field.child), field.child)
+
+            def nested_many(request):
+                represent = child.bind(request)
+                return lambda value: [represent(item) for item in (
+                    value.all() if isinstance(value, BaseManager) else value)]
+            return name, get, nested_many
+        if isinstance(field, serializers.BaseSerializer):
+            return name, get, get_plan(type(field), field).bind
+        if type(field) in DIRECT_FIELDS:
+            convert = DIRECT_FIELDS[type(field)]
+            return name, get, lambda request: convert
+        if isinstance(field, fields.FileField) and getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return name, get, file_url_converter
+        convert = field.to_representation
+        return name, get, lambda request: convert
+
+    @staticmethod
+    def nested_entry(name, serializer_class):
+        # Как NestedRepresentationMixin: вложенные сериализаторы без request
+        plan = get_plan(serializer_class)
+        represent = plan.bind(None)
+
+        def get(instance):
+            value = getattr(instance, name)
+            if isinstance(value, BaseManager):
+                return [represent(item) for item in value.all()]
+            if value is None:
+                return serializer_class(None).data
+            return represent(value)
+        return name, get, None
+
+    def bind(self, request):
+        """Функция объект -> dict для запроса request."""
+        entries = [(name, get, factory and factory(request)) for name, get, factory in self.entries]
+
+        def represent(instance):
+            data = {}
+            for name, get, convert in entries:
+                value = get(instance)
+                if convert is not None and value is not None:
+                    value = convert(value)
+                data[name] = value
+            return data
+        return represent
+
+
+def is_plain_model_field(model, name):
+    if model is None:
+        return False
+    try:
+        model_field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return model_field.concrete and not model_field.is_relation
+
+
+@functools.cache
+def _compile(serializer_class):
+    return ReadPlan(serializer_class())
+
+
+def get_plan(serializer_class, instance=None):
+    """
+    План для serializer_class, кэшируется на процесс. Вложенные поля с
+    аргументами (many=True, source) передают свой экземпляр instance.
+    """
+    if instance is not None and (instance._args or instance._kwargs):
+        return ReadPlan(instance)
+    return _compile(serializer_class)
+
+
+class FastReadMixin:
+    """
+    list() и retrieve() для ModelViewSet через план serializer_class.
+    Ставится после миксинов кэша меню: они работают с его Response как
+    с обычным.
+    """
+
+    def represent(self, instances, many=False):
+        represent = get_plan(self.get_serializer_class()).bind(self.request)
+        with serializer_timer():
+            if many:
+                return [represent(instance) for instance in instances]
+            return represent(instances)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.represent(page, many=True))
+        return Response(self.represent(queryset, many=True))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.represent(self.get_object()))
@@ -0,0 +1,78 @@
+from django.db.models import Exists, OuterRef
+from django_filters import rest_framework as filters
+
+from main.models import Food, SizeAndPrice, RATING_ORDER
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
+
+class FoodOrderingFilter(filters.OrderingFilter):
+    def filter(self, qs, value):
+        if value:
+            qs = qs.annotate(rating_order=RATING_ORDER)
+        return super().filter(qs, value)
+
+
+class FoodFilterSet(filters.FilterSet):
+    """
+    Фильтры списка блюд. Под каждый путь есть индекс в Meta.indexes
+    Food и SizeAndPrice.
+
+    ?category=1,2 — блюда из любой из категорий,
+    ?price_min=&price_max= — есть размер с ценой в диапазоне,
+    ?cooking_time_min=&cooking_time_max=, ?addition=1,2 — принимает
+    любую из добавок, ?ordering=price|rating|created_at (с «-» по убыванию).
+    """
+    category = NumberInFilter(field_name='category')
+    active = filters.BooleanFilter()
+    price = filters.RangeFilter(field_name='sizes_and_prices__price', method='filter_price')
+    cooking_time = filters.RangeFilter()
+    addition = NumberInFilter(method='filter_addition')
+    ordering = FoodOrderingFilter(fields=(('min_price', 'price'), ('rating_order', 'rating'),
+                                          ('created_at', 'created_at')))
+
+    class Meta:
+        model = Food
+        fields = ['category', 'active', 'price', 'cooking_time', 'addition']
+
+    def get_ordering(self):
+        """Порядок из ?ordering, добитый id до уникального, или None."""
+        ordering = self.form.cleaned_data.get('ordering') if self.is_valid() else None
+        if not ordering:
+            return None
+        ordering = [self.filters['ordering'].get_ordering_value(param) for param in ordering]
+        return (*ordering, '-id' if ordering[0].startswith('-') else 'id')
+
+    def filter_price(self, queryset, name, value):
+        sizes = SizeAndPrice.objects.filter(food=OuterRef('pk'))
+        if value.start is not None:
+            sizes = sizes.filter(price__gte=value.start)
+        if value.stop is not None:
+            sizes = sizes.filter(price__lte=value.stop)
+        return queryset.filter(Exists(sizes))
+
+    def filter_addition(self, queryset, name, value):
+        # Exists вместо join, чтобы блюдо не дублировалось при нескольких добавках
+        return queryset.filter(Exists(Food.accepted_additions.through.objects.filter(
+            food=OuterRef('pk'), addition__in=value)))
+
+
+class FoodFilterBackend(filters.DjangoFilterBackend):
+    """
+    Отдаёт сортировку из ?ordering курсорной пагинации: CursorPagination
+    сама переупорядочивает queryset и берёт порядок у бэкенда с get_ordering.
+    Берётся filterset, уже проверенный в filter_queryset того же запроса.
+    """
+
+    def get_filterset(self, request, queryset, view):
+        filterset = super().get_filterset(request, queryset, view)
+        request._food_filterset = filterset
+        return filterset
+
+    def get_ordering(self, request, queryset, view):
+        filterset = getattr(request, '_food_filterset', None)
+        if filterset is None:
+            filterset = self.get_filterset(request, queryset, view)
+        return (filterset and filterset.get_ordering()) or view.pagination_class.ordering
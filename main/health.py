@@ -0,0 +1,57 @@
+"""
+Проверка БД и статистика соединений текущего процесса.
+
+При нескольких воркерах у каждого свой пул: /health/db/ показывает
+пул того воркера, который ответил на запрос.
+"""
+import time
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+def check_database(alias=DEFAULT_DB_ALIAS):
+    """Время SELECT 1 в миллисекундах, включая получение соединения."""
+    started = time.perf_counter()
+    with connections[alias].cursor() as cursor:
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+    return (time.perf_counter() - started) * 1000
+
+
+def pool_stats(alias=DEFAULT_DB_ALIAS):
+    """Состояние пула psycopg или None, если пул не включён."""
+    pool = getattr(connections[alias], 'pool', None)
+    if pool is None:
+        return None
+    stats = pool.get_stats()
+    # Пул открывается при первом запросе, до этого pool_size уже равен min_size
+    size = 0 if pool.closed else stats.get('pool_size', 0)
+    idle = stats.get('pool_available', 0)
+    requests = stats.get('requests_num', 0)
+    wait_ms = stats.get('requests_wait_ms', 0)
+    return {
+        'min_size': stats.get('pool_min', 0),
+        'max_size': stats.get('pool_max', 0),
+        'size': size,
+        'in_use': size - idle,
+        'idle': idle,
+        'waiting': stats.get('requests_waiting', 0),
+        'requests': requests,
+        'queued': stats.get('requests_queued', 0),
+        'wait_ms_total': wait_ms,
+        'wait_ms_avg': round(wait_ms / requests, 3) if requests else 0,
+        'timeouts': stats.get('requests_errors', 0),
+        'connections_opened': stats.get('connections_num', 0),
+        'connect_ms_total': stats.get('connections_ms', 0),
+        'connections_lost': stats.get('connections_lost', 0),
+    }
+
+
+def connection_stats(alias=DEFAULT_DB_ALIAS):
+    connection = connections[alias]
+    return {
+        'vendor': connection.vendor,
+        'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+        'health_checks': connection.settings_dict['CONN_HEALTH_CHECKS'],
+        'pool': pool_stats(alias),
+    }
@@ -0,0 +1,418 @@
+"""
+Фоновая обработка изображений блюд и категорий.
+
+Запрос только проверяет заголовок файла и ставит задачу в пул потоков.
+Воркер декодирует картинку, сохраняет оригинал под именем из хэша
+содержимого и готовит рендишены (thumb/card/full в WebP и JPEG), после
+чего записывает image и image_hash в строку модели. Пока image_hash пуст,
+сериализаторы отдают images = null. Хэш хранится в поле <поле>_hash.
+Если обработка не удалась, причина попадает в <поле>_error (image_error
+в ответах API); новая загрузка его сбрасывает.
+
+Кроме base64 изображение можно прислать файлом: multipart или сырым телом
+в PUT <объект>/image/. Тело пишется на диск кусками
+(LimitedTemporaryFileUploadHandler), размер проверяется по Content-Length
+до чтения тела и по ходу записи.
+
+IMAGE_WORKERS = 0 выполняет обработку сразу после коммита в том же потоке.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import itertools
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from stat import S_ISREG
+
+import filetype
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile, TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import close_old_connections, transaction
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from PIL import Image, ImageOps
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import MultiPartParser, FileUploadParser
+from rest_framework.response import Response
+
+from main.cache import bump_menu_version
+from main.metrics import serializer_timer
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'thumb': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+ALLOWED_IMAGE_TYPES = ('jpg', 'png', 'gif', 'webp')
+# Хватает для сигнатуры любого из ALLOWED_IMAGE_TYPES
+SNIFF_SIZE = 64
+SNIFF_BASE64_SIZE = (SNIFF_SIZE + 2) // 3 * 4
+# Границы и заголовки части multipart поверх самого файла
+MULTIPART_OVERHEAD = 16 * 1024
+PROCESSING_ERROR = "Не удалось обработать изображение."
+
+
+class PendingImage:
+    """Загруженное, но ещё не обработанное изображение."""
+    def detach(self):
+        """Вызывается после коммита перед постановкой в очередь: данные не должны зависеть от запроса."""
+
+    def open(self):
+        raise NotImplementedError
+
+    def discard(self):
+        pass
+
+
+class Base64PendingImage(PendingImage):
+    def __init__(self, data):
+        self.data = data
+
+    def open(self):
+        return io.BytesIO(base64.b64decode(self.data))
+
+
+class UploadedPendingImage(PendingImage):
+    """
+    Файл из multipart или сырого тела. Django удаляет временные файлы
+    загрузки в конце запроса, поэтому detach() после коммита забирает
+    файл себе.
+    """
+    def __init__(self, upload):
+        self.upload = upload
+        self.path = None
+
+    def detach(self):
+        fd, self.path = tempfile.mkstemp(prefix='image-', dir=settings.FILE_UPLOAD_TEMP_DIR)
+        if isinstance(self.upload, TemporaryUploadedFile):
+            os.close(fd)
+            os.replace(self.upload.temporary_file_path(), self.path)
+            # TemporaryUploadedFile.close() не падает, если файла уже нет
+            self.upload.close()
+        else:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in self.upload.chunks():
+                    file.write(chunk)
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def discard(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StoredPendingImage(PendingImage):
+    """Уже лежащий в хранилище файл, например загруженный до появления рендишенов."""
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+
+    def open(self):
+        return self.storage.open(self.name, 'rb')
+
+
+def sniff_image_type(header):
+    kind = filetype.guess_extension(header)
+    if kind == 'jpeg':
+        kind = 'jpg'
+    return kind if kind in ALLOWED_IMAGE_TYPES else None
+
+
+class DeferredImageField(serializers.ImageField):
+    """
+    Принимает base64 (как drf_extra_fields.Base64ImageField) или файл, но
+    изображение не декодирует: проверяются размер и сигнатура по первым
+    байтам, остальное делает воркер.
+    """
+    default_error_messages = {
+        'invalid_image': "Загрузите корректное изображение.",
+        'too_large': "Изображение больше {max_size} байт.",
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return self.upload_to_internal_value(data)
+        if not isinstance(data, str):
+            self.fail('invalid_image')
+        if ';base64,' in data:
+            data = data.split(';base64,', 1)[1]
+        if len(data) * 3 // 4 > settings.IMAGE_MAX_UPLOAD_SIZE:
+            self.fail('too_large', max_size=settings.IMAGE_MAX_UPLOAD_SIZE)
+        try:
+            header = base64.b64decode(data[:SNIFF_BASE64_SIZE])
+        except (binascii.Error, ValueError):
+            self.fail('invalid_image')
+        if sniff_image_type(header) is None:
+            self.fail('invalid_image')
+        return Base64PendingImage(data)
+
+    def upload_to_internal_value(self, upload):
+        if upload.size > settings.IMAGE_MAX_UPLOAD_SIZE:
+            self.fail('too_large', max_size=settings.IMAGE_MAX_UPLOAD_SIZE)
+        upload.seek(0)
+        header = upload.read(SNIFF_SIZE)
+        upload.seek(0)
+        if sniff_image_type(header) is None:
+            self.fail('invalid_image')
+        return UploadedPendingImage(upload)
+
+
+class RequestTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Слишком большой запрос."
+    default_code = 'request_too_large'
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Всегда пишет загрузку во временный файл и обрывает её с 413 после
+    IMAGE_MAX_UPLOAD_SIZE байт, в том числе для тела без Content-Length.
+    """
+    def new_file(self, *args, **kwargs):
+        self.received = 0
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_MAX_UPLOAD_SIZE:
+            # StopUpload парсер DRF не ловит (500), а multipart молча теряет файл
+            self.file.close()
+            raise RequestTooLarge(f"Изображение больше {settings.IMAGE_MAX_UPLOAD_SIZE} байт.")
+        return super().receive_data_chunk(raw_data, start)
+
+
+class ImageUploadMixin:
+    """
+    Для ModelViewSet с полем image: потоковая загрузка файлов и
+    PUT <pk>/image/ с файлом в multipart (поле image) или в теле запроса
+    (нужен Content-Disposition с filename).
+    """
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [LimitedTemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        # В image/ приходит только файл, остальные действия могут нести base64
+        if self.action == 'image':
+            limit = settings.IMAGE_MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD
+        else:
+            limit = settings.IMAGE_MAX_REQUEST_SIZE
+        if content_length > limit:
+            raise RequestTooLarge()
+
+    @action(detail=True, methods=['put'], parser_classes=[MultiPartParser, FileUploadParser])
+    def image(self, request, *args, **kwargs):
+        instance = self.get_object()
+        upload = request.data.get('image') or request.data.get('file')
+        source = DeferredImageField().run_validation(upload)
+        schedule_image(instance, 'image', source)
+        with serializer_timer():
+            data = self.get_serializer(instance).data
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+class DeferredImagesMixin:
+    """Для ModelSerializer: PendingImage из validated_data уходят в фоновую обработку после save()."""
+    def save(self, **kwargs):
+        pending = {name: value for name, value in self.validated_data.items() if isinstance(value, PendingImage)}
+        for name in pending:
+            self.validated_data.pop(name)
+        instance = super().save(**kwargs)
+        for name, source in pending.items():
+            schedule_image(instance, name, source)
+        return instance
+
+
+def rendition_name(image_hash, rendition, fmt):
+    return f"renditions/{image_hash[:2]}/{image_hash}-{rendition}.{fmt}"
+
+
+def rendition_urls(image_hash):
+    if not image_hash:
+        return None
+    return {
+        rendition: {fmt: default_storage.url(rendition_name(image_hash, rendition, fmt)) for fmt in RENDITION_FORMATS}
+        for rendition in RENDITIONS
+    }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_latest_jobs = {}
+_latest_jobs_lock = threading.Lock()
+_job_ids = itertools.count()
+
+
+# Оригиналы и рендишены называются хэшем содержимого и никогда не меняются
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{64}[.-][^/]*$')
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Отдаёт файл из MEDIA_ROOT через FileResponse: файл читается кусками и
+    не попадает в память целиком. Файлы с хэшем в имени кэшируются навсегда,
+    остальные (например, ещё не обработанные) — на MEDIA_MAX_AGE секунд,
+    If-Modified-Since отвечается 304.
+    """
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not S_ISREG(stat.st_mode):
+        raise Http404
+
+    response = get_conditional_response(request, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = FileResponse(open(fullpath, 'rb'))
+        response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable' if HASHED_NAME.search(path) \
+        else f'public, max-age={settings.MEDIA_MAX_AGE}'
+    return response
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='images')
+        return _executor
+
+
+def schedule_image(instance, field_name, source):
+    """
+    Поставить обработку изображения после коммита текущей транзакции.
+    Всё, что переживает запрос (свой временный файл, запись в _latest_jobs),
+    появляется только в колбэке: при откате его нет, а временный файл
+    загрузки Django удалит сам в конце запроса.
+    """
+    label, pk = instance._meta.label, instance.pk
+    error_field = f'{field_name}_error'
+    if getattr(instance, error_field):
+        # Ошибка прошлой загрузки больше не актуальна, откатится вместе с транзакцией
+        setattr(instance, error_field, '')
+        type(instance).objects.filter(pk=pk).update(**{error_field: ''})
+
+    def start():
+        source.detach()
+        job = next(_job_ids)
+        # Если до обработки придёт ещё одна загрузка, старая задача ничего не запишет
+        with _latest_jobs_lock:
+            _latest_jobs[(label, pk, field_name)] = job
+        args = (label, pk, field_name, source, job)
+        if settings.IMAGE_WORKERS:
+            get_executor().submit(run_image_job, *args)
+        else:
+            process_image(*args)
+
+    transaction.on_commit(start)
+
+
+def run_image_job(*args):
+    try:
+        process_image(*args)
+    except Exception:
+        logger.exception("Не удалось обработать изображение %s", args[:3])
+    finally:
+        close_old_connections()
+
+
+def file_hash(fileobj):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(64 * 1024), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def save_renditions(image, image_hash):
+    image = ImageOps.exif_transpose(image)
+    for rendition, size in RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        for fmt, (pil_format, options) in RENDITION_FORMATS.items():
+            name = rendition_name(image_hash, rendition, fmt)
+            if default_storage.exists(name):
+                continue
+            out = resized
+            if pil_format == 'JPEG' and out.mode not in ('RGB', 'L'):
+                out = out.convert('RGB')
+            buffer = io.BytesIO()
+            out.save(buffer, pil_format, **options)
+            default_storage.save(name, File(buffer))
+
+
+def is_latest_job(key, job):
+    return job is None or _latest_jobs.get(key) == job
+
+
+def finish_job(key, job):
+    """Убирает задачу из _latest_jobs, если её не сменила более поздняя загрузка."""
+    if job is None:
+        return
+    with _latest_jobs_lock:
+        if _latest_jobs.get(key) == job:
+            del _latest_jobs[key]
+
+
+def process_image(label, pk, field_name, source, job=None):
+    """job — номер из schedule_image; без него результат записывается всегда."""
+    model = apps.get_model(label)
+    field = model._meta.get_field(field_name)
+    key = (label, pk, field_name)
+    try:
+        with source.open() as fileobj:
+            image_hash = file_hash(fileobj)
+            extension = sniff_image_type(fileobj.read(SNIFF_SIZE))
+            fileobj.seek(0)
+            image = Image.open(fileobj)
+            image.load()
+            fileobj.seek(0)
+
+            name = field.generate_filename(None, f"{image_hash}.{extension}")
+            if not field.storage.exists(name):
+                name = field.storage.save(name, File(fileobj))
+            save_renditions(image, image_hash)
+    except Exception:
+        # Клиенту — причина в <поле>_error, подробности — в лог
+        logger.exception("Не удалось обработать изображение %s", key)
+        result = {f'{field_name}_error': PROCESSING_ERROR}
+    else:
+        result = {field_name: name, f'{field_name}_hash': image_hash, f'{field_name}_error': ''}
+    finally:
+        source.discard()
+
+    try:
+        if is_latest_job(key, job):
+            model.objects.filter(pk=pk).update(**result)
+            bump_menu_version()
+    finally:
+        finish_job(key, job)
@@ -0,0 +1,184 @@
+import asyncio
+import contextlib
+import gc
+import json
+import statistics
+import time
+
+import psycopg
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+
+from main.health import pool_stats
+
+MODES = {
+    # Как было: соединение закрывается после каждого запроса
+    'per-request': {'CONN_MAX_AGE': 0, 'OPTIONS': {}},
+    'persistent': {'CONN_MAX_AGE': 60, 'OPTIONS': {}},
+    'pool': {'CONN_MAX_AGE': 0, 'OPTIONS': {'pool': {'min_size': 1, 'max_size': 4}}},
+}
+
+
+def simulate_requests(connection, count, queries):
+    """
+    Цикл запроса Django под WSGI: close_old_connections() на request_started
+    и request_finished вокруг обращения к БД в одном потоке. Возвращает
+    длительности в мс.
+    """
+    durations = []
+    for _ in range(count):
+        started = time.perf_counter()
+        connection.close_if_unusable_or_obsolete()
+        with connection.cursor() as cursor:
+            for _ in range(queries):
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+        connection.close_if_unusable_or_obsolete()
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+async def asgi_get(handler, path):
+    """GET через ASGIHandler, как его вызывает uvicorn. Возвращает длительность в мс."""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+    }
+    body_sent = False
+    status = None
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Клиент не отключается, задачу ожидания отменит сам обработчик
+        await asyncio.Future()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    started = time.perf_counter()
+    await handler(scope, receive, send)
+    if status != 200:
+        raise CommandError(f"{path}: {status}")
+    return (time.perf_counter() - started) * 1000
+
+
+async def asgi_requests(count, concurrency, path):
+    handler = ASGIHandler()
+    durations = []
+    for offset in range(0, count, concurrency):
+        batch = [asgi_get(handler, path) for _ in range(min(concurrency, count - offset))]
+        durations += await asyncio.gather(*batch)
+    return durations
+
+
+def open_connections(settings_dict):
+    """Клиентские соединения с базой из настроек, кроме собственного."""
+    params = {'dbname': settings_dict['NAME'], 'user': settings_dict['USER'],
+              'password': settings_dict['PASSWORD'], 'host': settings_dict['HOST'],
+              'port': settings_dict['PORT'] or None}
+    with psycopg.connect(**{key: value for key, value in params.items() if value}) as connection:
+        return connection.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() "
+                                  "AND backend_type = 'client backend' AND pid <> pg_backend_pid()").fetchone()[0]
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает накладные расходы на соединение с БД за запрос: новое "
+            "соединение на каждый запрос, постоянное (CONN_MAX_AGE) и пул "
+            "psycopg. --server asgi гоняет запросы к /health/ через ASGIHandler "
+            "и считает открытые и оставшиеся открытыми соединения, --server wsgi "
+            "повторяет цикл соединений WSGI-воркера. Запускать против PostgreSQL "
+            "из настроек (POSTGRES_*).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=['asgi', 'wsgi'], default='asgi')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=10, help="Одновременных запросов для asgi")
+        parser.add_argument('--queries', type=int, default=1, help="Запросов к БД на один HTTP-запрос для wsgi")
+        parser.add_argument('--mode', choices=MODES, action='append', help="По умолчанию все")
+        parser.add_argument('--json', action='store_true', dest='as_json', help="Результат одной строкой JSON")
+
+    def handle(self, *args, server, requests, concurrency, queries, mode, as_json, **options):
+        base = connections[DEFAULT_DB_ALIAS]
+        if base.vendor != 'postgresql':
+            raise CommandError("Нужен PostgreSQL: на других БД соединение почти ничего не стоит")
+
+        results = []
+        for name in mode or MODES:
+            if server == 'asgi':
+                result = self.run_asgi(name, requests, concurrency)
+            else:
+                result = self.run_wsgi(name, requests, queries)
+            durations = result.pop('durations')
+            results.append({
+                'server': server,
+                'mode': name,
+                'requests': requests,
+                **result,
+                'avg_ms': round(statistics.fmean(durations), 3),
+                'p50_ms': round(statistics.median(durations), 3),
+                'p95_ms': round(statistics.quantiles(durations, n=20)[-1], 3),
+            })
+
+        if as_json:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(f"{'mode':<12} {'avg, ms':>9} {'p50, ms':>9} {'p95, ms':>9} {'opened':>7} {'left open':>10}")
+        for result in results:
+            self.stdout.write(f"{result['mode']:<12} {result['avg_ms']:>9} {result['p50_ms']:>9} "
+                              f"{result['p95_ms']:>9} {result.get('opened', '-'):>7} {result.get('left_open', '-'):>10}")
+
+    @contextlib.contextmanager
+    def mode_settings(self, name):
+        # Настройки подменяются у соединения по умолчанию до его открытия:
+        # обработчики connection_created (django.contrib.postgres) ищут
+        # соединение по алиасу, а под ASGI каждый запрос создаёт своё
+        # соединение из connections.settings
+        settings_dict = connections.settings[DEFAULT_DB_ALIAS]
+        original = {key: settings_dict[key] for key in MODES[name]}
+        connections[DEFAULT_DB_ALIAS].close()
+        settings_dict.update(MODES[name])
+        try:
+            yield settings_dict
+        finally:
+            connection = connections[DEFAULT_DB_ALIAS]
+            connection.close()
+            if connection.pool is not None:
+                connection.close_pool()
+            settings_dict.update(original)
+            # Брошенные соединения закрываются вместе с объектами
+            gc.collect()
+
+    def run_wsgi(self, name, requests, queries):
+        with self.mode_settings(name):
+            connection = connections[DEFAULT_DB_ALIAS]
+            simulate_requests(connection, 5, queries)  # прогрев, в том числе открытие пула
+            return {'durations': simulate_requests(connection, requests, queries)}
+
+    def run_asgi(self, name, requests, concurrency):
+        opened = 0
+
+        def count(**kwargs):
+            nonlocal opened
+            opened += 1
+
+        with self.mode_settings(name) as settings_dict:
+            before = open_connections(settings_dict)
+            connection_created.connect(count)
+            try:
+                durations = asyncio.run(asgi_requests(requests, concurrency, '/health/'))
+            finally:
+                connection_created.disconnect(count)
+            stats = pool_stats()
+            if stats is not None:
+                # connection_created приходит на каждую выдачу из пула, а не на новое соединение
+                opened = stats['connections_opened']
+            left_open = open_connections(settings_dict) - before
+        return {'durations': durations, 'opened': opened, 'left_open': left_open}
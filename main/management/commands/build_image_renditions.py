@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from main.images import StoredPendingImage, process_image
+from main.models import Food, FoodCategory, Addition
+
+
+class Command(BaseCommand):
+    help = "Готовит рендишены для изображений блюд, категорий и добавок, у которых их ещё нет"
+
+    def handle(self, *args, **options):
+        for model in (Food, FoodCategory, Addition):
+            pending = model.objects.exclude(image='').exclude(image__isnull=True).filter(image_hash='')
+            for instance in pending.only('id', 'image').iterator():
+                source = StoredPendingImage(instance.image.storage, instance.image.name)
+                try:
+                    process_image(model._meta.label, instance.pk, 'image', source)
+                except Exception as error:
+                    self.stderr.write(f"{model.__name__} {instance.pk}: {error}")
+                    continue
+                self.stdout.write(f"{model.__name__} {instance.pk}: готово")
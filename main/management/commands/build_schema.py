@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from drf_spectacular.drainage import GENERATOR_STATS
+
+from main.schema import build_artifact
+
+
+class Command(BaseCommand):
+    help = ("Генерирует OpenAPI-схему (YAML и JSON, сжатые gzip и brotli) в "
+            "SCHEMA_ARTIFACT_DIR, откуда её отдаёт /api/schema/. Запускать при сборке.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default=None, help="По умолчанию SCHEMA_ARTIFACT_DIR")
+        parser.add_argument('--fail-on-warn', action='store_true', help="Ошибка при предупреждениях генератора")
+
+    def handle(self, *args, output_dir, fail_on_warn, **options):
+        manifest = build_artifact(output_dir or settings.SCHEMA_ARTIFACT_DIR)
+        GENERATOR_STATS.emit_summary()
+        if fail_on_warn and GENERATOR_STATS:
+            raise CommandError("Генератор схемы выдал предупреждения")
+        for name, item in manifest['formats'].items():
+            self.stdout.write(f"{name}: {item['file']} ({item['size']} байт)")
+        self.stdout.write(self.style.SUCCESS(f"Схема {manifest['api_version']} собрана"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from main.menu_transfer import export_menu, FORMATS
+
+
+class Command(BaseCommand):
+    help = "Выгружает меню в CSV или JSONL в формате import_menu"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument('--output', default='-', help="Файл или - для stdout")
+
+    def handle(self, *args, format, output, **options):
+        if output == '-':
+            for chunk in export_menu(format):
+                self.stdout.write(chunk, ending='')
+            return
+        with open(output, 'w', encoding='utf-8', newline='') as file:
+            file.writelines(export_menu(format))
@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.menu_transfer import import_menu, parse, MenuImportError, FORMATS
+
+
+class Command(BaseCommand):
+    help = "Загружает меню (категории, добавки, блюда с размерами) из CSV или JSONL одной транзакцией"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл или - для stdin")
+        parser.add_argument('--format', choices=FORMATS, help="По умолчанию — по расширению файла")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, path, format, batch_size, **options):
+        file_format = format or ('csv' if path.endswith('.csv') else 'jsonl')
+        file = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        try:
+            stats = import_menu(parse(file, file_format), batch_size=batch_size)
+        except MenuImportError as error:
+            raise CommandError(str(error))
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        self.stdout.write(self.style.SUCCESS(
+            "Загружено: категорий {categories}, добавок {additions}, блюд {foods}, размеров {sizes}".format(**stats)))
@@ -0,0 +1,76 @@
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+from main.bench import percentile
+
+
+def worker(url, deadline, latencies, errors):
+    """Один клиент с keep-alive соединением, шлёт GET до deadline."""
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    connection = connection_class(parts.hostname, parts.port, timeout=30)
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            connection.request('GET', path, headers={'Accept': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            connection.close()
+            continue
+        if response.status >= 400:
+            errors.append(response.status)
+        else:
+            latencies.append(time.perf_counter() - started)
+        if response.getheader('Connection', '').lower() == 'close':
+            connection.close()
+    connection.close()
+
+
+class Command(BaseCommand):
+    help = ("Нагрузочный тест запущенного сервера: N клиентов с keep-alive "
+            "шлют GET на URL в течение заданного времени. Для сравнения "
+            "runserver и gunicorn -c gunicorn.conf.py запустите оба и "
+            "прогоните тест на одном и том же URL.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('url')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=10, help="Секунды")
+        parser.add_argument('--json', action='store_true', dest='as_json', help="Результат одной строкой JSON")
+
+    def handle(self, *args, url, concurrency, duration, as_json, **options):
+        latencies, errors = [], []
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=worker, args=(url, deadline, latencies, errors))
+                   for _ in range(concurrency)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        result = {
+            'url': url,
+            'concurrency': concurrency,
+            'requests': len(latencies),
+            'errors': len(errors),
+            'rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        }
+        if as_json:
+            self.stdout.write(json.dumps(result))
+            return
+        for key, value in result.items():
+            self.stdout.write(f"{key:>12}: {value}")
+
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from main.cache import bump_menu_version
+from main.models import Food
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает денормализованные оценки блюд (rating_sum, rating_count, rating) по отзывам"
+
+    def handle(self, *args, **options):
+        updated = Food.objects.rebuild_ratings()
+        bump_menu_version()
+        self.stdout.write(self.style.SUCCESS(f"Оценки пересчитаны для {updated} блюд"))
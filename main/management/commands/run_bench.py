@@ -0,0 +1,102 @@
+import json
+import platform
+import subprocess
+import sys
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from main.bench import measure, router_cases, pricing_cases, sample_carts
+from main.models import User, Order, Food, Chat, Message, Discount
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Замеряет эндпоинты роутера main.urls и расчёт стоимости/акций на данных "
+            "seed_bench: запросов в секунду, p50/p99, SQL-запросов на вызов и пиковый RSS. "
+            "Запросы выполняются в этом процессе через django.test.Client, без сети. "
+            "Результат — JSON для сравнения между коммитами (--compare).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--orders', type=int, default=20, help="Заказов в выборке для расчёта стоимости")
+        parser.add_argument('--menu-cache', choices=['cold', 'warm'], default='cold',
+                            help="cold — кэш меню сбрасывается перед каждым запросом (вне замера)")
+        parser.add_argument('--only', action='append', help="Только кейсы, в имени которых есть подстрока")
+        parser.add_argument('--output', default='bench.json', help="Файл для JSON или - для stdout")
+        parser.add_argument('--compare', help="JSON прошлого прогона для сравнения")
+
+    def handle(self, *args, iterations, warmup, orders, menu_cache, only, output, compare, **options):
+        user = User.objects.filter(username='bench0').first()
+        if user is None or not Food.objects.exists():
+            raise CommandError("Нет данных для замеров, сначала manage.py seed_bench")
+
+        client = Client()
+        client.force_login(user)
+        sample = list(Order.objects.filter(order_items__isnull=False).distinct().order_by('id')[:orders])
+        carts = sample_carts(sample)
+        cases = router_cases(client, user, carts, menu_cache) + pricing_cases(user, sample, carts)
+        if only:
+            cases = [case for case in cases if any(part in case.name for part in only)]
+
+        results = []
+        for case in cases:
+            result = measure(case, iterations, warmup)
+            results.append(result)
+            if output != '-':
+                self.stdout.write(f"{result['name']:<36} {result['rps'] or 0:>9} rps  p50 {result['p50_ms']:>9} ms  "
+                                  f"p99 {result['p99_ms']:>9} ms  {result['queries_per_request']:>6} q  "
+                                  f"{result['peak_rss_mb']:>7} MB")
+
+        report = {
+            'commit': git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'settings': settings.SETTINGS_MODULE,
+                'debug': settings.DEBUG,
+            },
+            'parameters': {'iterations': iterations, 'warmup': warmup, 'orders': len(sample),
+                           'menu_cache': menu_cache},
+            'rows': {model.__name__: model.objects.count() for model in (Food, Order, Chat, Message, Discount)},
+            'results': results,
+        }
+        if output == '-':
+            json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+            sys.stdout.write('\n')
+        else:
+            with open(output, 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результат записан в {output}"))
+
+        if compare:
+            # При --output - stdout занят JSON
+            self.compare(compare, results, self.stderr if output == '-' else self.stdout)
+
+    def compare(self, path, results, out):
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)
+        before = {result['name']: result for result in previous['results']}
+        out.write(f"Сравнение с {previous.get('commit') or path}:")
+        for result in results:
+            old = before.get(result['name'])
+            if old is None:
+                continue
+            change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0
+            out.write(f"{result['name']:<36} p50 {old['p50_ms']:>9} -> {result['p50_ms']:>9} ms "
+                      f"({change:+.1f}%)  queries {old['queries_per_request']} -> "
+                      f"{result['queries_per_request']}")
@@ -0,0 +1,26 @@
+from dataclasses import fields
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.bench import SeedVolumes, seed
+from main.models import Food
+
+
+class Command(BaseCommand):
+    help = ("Заполняет пустую БД синтетическими данными для run_bench: пользователи, "
+            "меню, отзывы, заказы, чаты и акции. С тем же --seed и объёмами данные "
+            "одинаковые, пользователь bench0 — администратор с паролем bench.")
+
+    def add_arguments(self, parser):
+        for volume in fields(SeedVolumes):
+            parser.add_argument(f"--{volume.name.replace('_', '-')}", type=int, default=volume.default)
+        parser.add_argument('--seed', type=int, default=0, dest='random_seed')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--append', action='store_true', help="Не проверять, что в БД нет блюд")
+
+    def handle(self, *args, random_seed, batch_size, append, **options):
+        if not append and Food.objects.exists():
+            raise CommandError("В БД уже есть меню, результаты не будут воспроизводимы. Нужна пустая БД или --append")
+        volumes = SeedVolumes(**{volume.name: options[volume.name] for volume in fields(SeedVolumes)})
+        counts = seed(volumes, random_seed=random_seed, batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(", ".join(f"{name}: {count}" for name, count in counts.items())))
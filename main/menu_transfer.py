@@ -0,0 +1,296 @@
+"""
+Импорт и экспорт меню в CSV и JSONL.
+
+JSONL — одна запись на строку:
+    {"type": "category", "code": "pizza", "title": "Пицца", "description": ""}
+    {"type": "addition", "code": "cheese", "title": "Сыр", "price": "50.00"}
+    {"type": "food", "code": "margarita", "title": "Маргарита", "category": "pizza",
+     "cooking_time": 15, "active": true, "additions": ["cheese"],
+     "sizes": [{"code": "margarita:25", "title": "25 см", "size": 25, "price": "450.00", "weight": 500}]}
+
+CSV — те же поля колонками (CSV_FIELDS), добавки через "|", у блюда по строке
+на размер (size_code, size_title, size, price, weight). Если у размера нет
+code, он получает "<code блюда>:<title размера>".
+
+Записи сопоставляются с существующими по code (у записей, созданных через
+API, он сгенерирован и попадает в экспорт), импорт только добавляет и
+обновляет: размеры и добавки, которых нет в файле, у блюда не удаляются.
+Вся загрузка идёт одной транзакцией через bulk_create(update_conflicts=True).
+Записи проверяются при разборе (parse), до записи в базу.
+"""
+import csv
+import io
+import json
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import Q
+
+from main.cache import bump_menu_version
+from main.models import FoodCategory, Food, SizeAndPrice, Addition
+from main.search import update_search_vectors
+
+CSV_FIELDS = ['type', 'code', 'title', 'description', 'category', 'cooking_time', 'active', 'additions',
+              'size_code', 'size_title', 'size', 'price', 'weight']
+FORMATS = ('jsonl', 'csv')
+RECORD_MODELS = {'category': FoodCategory, 'addition': Addition, 'food': Food}
+
+
+class MenuImportError(ValueError):
+    pass
+
+
+def as_decimal(value, name):
+    try:
+        number = Decimal(str(value))
+    except ArithmeticError:
+        raise MenuImportError(f"{name}: не число {value!r}")
+    if not number.is_finite():
+        raise MenuImportError(f"{name}: не число {value!r}")
+    return number
+
+
+def as_int(value, name):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        raise MenuImportError(f"{name}: не целое число {value!r}")
+
+
+def as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def check_lengths(record, model):
+    """Строки не длиннее max_length полей модели: иначе PostgreSQL упадёт с DataError на записи."""
+    for name, value in record.items():
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if getattr(field, 'max_length', None) and value is not None and len(str(value)) > field.max_length:
+            raise MenuImportError(f"{name} длиннее {field.max_length} символов")
+
+
+def clean_record(record, number):
+    """
+    Проверяет запись и приводит типы полей (цены — Decimal, размеры и
+    время — int). Ошибки — MenuImportError с номером строки файла.
+    """
+    try:
+        if not isinstance(record, dict):
+            raise MenuImportError(f"ожидался объект, а не {type(record).__name__}")
+        if not record.get('title'):
+            raise MenuImportError("нет title")
+        if record.get('type') in RECORD_MODELS:
+            check_lengths(record, RECORD_MODELS[record['type']])
+        if record.get('type') == 'addition':
+            record['price'] = as_decimal(record.get('price'), 'price')
+        if record.get('type') != 'food':
+            return record
+
+        record['cooking_time'] = as_int(record.get('cooking_time'), 'cooking_time')
+        if not isinstance(record.get('sizes', []), list) or not all(
+                isinstance(size, dict) for size in record.get('sizes', [])):
+            raise MenuImportError("sizes должен быть списком объектов")
+        if not isinstance(record.get('additions', []), list) or not all(
+                isinstance(code, str) for code in record.get('additions', [])):
+            raise MenuImportError("additions должен быть списком кодов")
+        for size in record.get('sizes', []):
+            if not size.get('code') and record.get('code'):
+                size['code'] = f"{record['code']}:{size.get('title', '')}"
+            check_lengths(size, SizeAndPrice)
+            size['price'] = as_decimal(size.get('price'), 'price')
+            size['size'] = as_int(size.get('size'), 'size')
+            size['weight'] = as_int(size.get('weight'), 'weight')
+        return record
+    except MenuImportError as error:
+        raise MenuImportError(f"Строка {number}: {error}") from None
+
+
+def parse_jsonl(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as error:
+            raise MenuImportError(f"Строка {number}: {error}")
+        yield clean_record(record, number)
+
+
+def parse_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        record = {key: value for key, value in row.items() if key and value not in (None, '')}
+        if record.get('type') == 'food':
+            if 'size' in record or 'size_title' in record:
+                record['sizes'] = [{
+                    'code': record.pop('size_code', None),
+                    'title': record.pop('size_title', ''),
+                    'size': record.pop('size', 0),
+                    'price': record.pop('price', 0),
+                    'weight': record.pop('weight', 0),
+                }]
+            if 'additions' in record:
+                record['additions'] = record['additions'].split('|')
+        yield clean_record(record, reader.line_num)
+
+
+def parse(lines, file_format):
+    """Записи файла, уже проверенные clean_record."""
+    return parse_csv(lines) if file_format == 'csv' else parse_jsonl(lines)
+
+
+def collect(records):
+    """Раскладывает записи по типам; строки одного блюда (CSV) склеиваются по code."""
+    categories, additions, foods = {}, {}, {}
+    for record in records:
+        kind, code = record.get('type'), record.get('code')
+        if not code:
+            raise MenuImportError(f"Запись без code: {record}")
+        if kind == 'category':
+            categories[code] = record
+        elif kind == 'addition':
+            additions[code] = record
+        elif kind == 'food':
+            if code in foods:
+                foods[code]['sizes'] = foods[code].get('sizes', []) + record.get('sizes', [])
+            else:
+                foods[code] = record
+        else:
+            raise MenuImportError(f"Неизвестный тип записи {kind!r} у {code}")
+    return categories, additions, foods
+
+
+def upsert(model, objects, update_fields, batch_size):
+    # PostgreSQL не даёт ON CONFLICT DO UPDATE задеть строку дважды за команду:
+    # из объектов с одним code (повтор строки CSV, размеры с одним title)
+    # остаётся последний
+    objects = list({obj.code: obj for obj in objects}.values())
+    model.objects.bulk_create(objects, batch_size=batch_size, update_conflicts=True,
+                              unique_fields=['code'], update_fields=update_fields)
+    return model.objects.in_bulk([obj.code for obj in objects], field_name='code')
+
+
+@transaction.atomic
+def import_menu(records, batch_size=1000):
+    categories, additions, foods = collect(records)
+
+    category_ids = upsert(FoodCategory, [
+        FoodCategory(code=code, title=record['title'], description=record.get('description', ''))
+        for code, record in categories.items()
+    ], ['title', 'description'], batch_size)
+
+    addition_ids = upsert(Addition, [
+        Addition(code=code, title=record['title'], description=record.get('description'),
+                 price=record['price'])
+        for code, record in additions.items()
+    ], ['title', 'description', 'price'], batch_size)
+
+    # Категории и добавки, на которые ссылаются блюда, но которых нет в файле
+    missing = {record['category'] for record in foods.values() if record.get('category')} - category_ids.keys()
+    category_ids.update(FoodCategory.objects.in_bulk(missing, field_name='code'))
+    missing = {code for record in foods.values() for code in record.get('additions', [])} - addition_ids.keys()
+    addition_ids.update(Addition.objects.in_bulk(missing, field_name='code'))
+
+    food_objects = []
+    for code, record in foods.items():
+        category = record.get('category')
+        if category and category not in category_ids:
+            raise MenuImportError(f"Блюдо {code}: нет категории {category}")
+        food_objects.append(Food(
+            code=code, title=record['title'], description=record.get('description'),
+            category=category_ids[category] if category else None,
+            cooking_time=record['cooking_time'], active=as_bool(record.get('active', True)),
+        ))
+    food_ids = upsert(Food, food_objects, ['title', 'description', 'category', 'cooking_time', 'active',
+                                           'updated_at'], batch_size)
+
+    size_objects, size_links, addition_links = [], [], []
+    for code, record in foods.items():
+        for size in record.get('sizes', []):
+            size_code = size.get('code') or f"{code}:{size.get('title', '')}"
+            size_objects.append(SizeAndPrice(
+                code=size_code, title=size.get('title', ''), size=size['size'], price=size['price'],
+                weight=size['weight'],
+            ))
+            size_links.append((food_ids[code].id, size_code))
+        for addition in record.get('additions', []):
+            if addition not in addition_ids:
+                raise MenuImportError(f"Блюдо {code}: нет добавки {addition}")
+            addition_links.append(Food.accepted_additions.through(food_id=food_ids[code].id,
+                                                                  addition_id=addition_ids[addition].id))
+    size_ids = upsert(SizeAndPrice, size_objects, ['title', 'size', 'price', 'weight'], batch_size)
+
+    Food.sizes_and_prices.through.objects.bulk_create(
+        [Food.sizes_and_prices.through(food_id=food_id, sizeandprice_id=size_ids[size_code].id)
+         for food_id, size_code in size_links],
+        batch_size=batch_size, ignore_conflicts=True)
+    Food.accepted_additions.through.objects.bulk_create(addition_links, batch_size=batch_size, ignore_conflicts=True)
+    update_search_vectors(Food.objects.filter(
+        Q(id__in=[food.id for food in food_ids.values()]) | Q(category__in=list(category_ids.values()))))
+    Food.objects.filter(id__in=[food.id for food in food_ids.values()]).refresh_min_price()
+
+    # bulk_create не шлёт сигналы, кэш меню сбрасываем сами
+    transaction.on_commit(bump_menu_version)
+    return {'categories': len(category_ids), 'additions': len(addition_ids), 'foods': len(food_ids),
+            'sizes': len(size_ids)}
+
+
+def export_records(chunk_size=1000):
+    for category in FoodCategory.objects.order_by('id').iterator(chunk_size=chunk_size):
+        yield {'type': 'category', 'code': category.code, 'title': category.title,
+               'description': category.description}
+    for addition in Addition.objects.order_by('id').iterator(chunk_size=chunk_size):
+        yield {'type': 'addition', 'code': addition.code, 'title': addition.title,
+               'description': addition.description, 'price': str(addition.price)}
+    foods = Food.objects.order_by('id').select_related('category').prefetch_related('sizes_and_prices',
+                                                                                    'accepted_additions')
+    for food in foods.iterator(chunk_size=chunk_size):
+        yield {
+            'type': 'food', 'code': food.code, 'title': food.title,
+            'description': food.description,
+            'category': food.category.code if food.category else None,
+            'cooking_time': food.cooking_time, 'active': food.active,
+            'additions': [addition.code for addition in food.accepted_additions.all()],
+            'sizes': [{'code': size.code, 'title': size.title, 'size': size.size, 'price': str(size.price),
+                       'weight': size.weight}
+                      for size in food.sizes_and_prices.all()],
+        }
+
+
+def export_menu(file_format, chunk_size=1000):
+    """Генератор строк файла; ничего не копит в памяти, кроме одной пачки блюд."""
+    if file_format == 'jsonl':
+        for record in export_records(chunk_size):
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writeheader()
+    yield flush()
+    for record in export_records(chunk_size):
+        if record['type'] != 'food':
+            writer.writerow(record)
+            yield flush()
+            continue
+        sizes = record.pop('sizes') or [{}]
+        record['additions'] = '|'.join(record['additions'])
+        record['active'] = int(record['active'])
+        for size in sizes:
+            writer.writerow({**record, 'size_code': size.get('code'), 'size_title': size.get('title'),
+                             'size': size.get('size'), 'price': size.get('price'), 'weight': size.get('weight')})
+        yield flush()
@@ -0,0 +1,230 @@
+"""
+Метрики запросов: число SQL-запросов, время в БД и в сериализаторах,
+полное время и размер ответа.
+
+MetricsMiddleware считает их для каждого запроса, отдаёт в заголовке
+Server-Timing и копит в гистограммах процесса, которые /metrics отдаёт
+в текстовом формате Prometheus (у каждого воркера свои, Prometheus
+опрашивает воркеры по отдельности или суммирует).
+
+Действие вьюсета может объявить бюджет запросов к БД:
+query_budgets = {'list': 5}. Превышение пишется в лог и в метрику
+http_query_budget_exceeded_total, а с QUERY_BUDGETS_ENFORCE (в тестах —
+декоратор enforce_query_budgets) запрос падает с QueryBudgetExceeded.
+
+Время сериализаторов учитывается там, где ответ собирает код приложения:
+FastReadMixin и блоки serializer_timer() вокруг .data во вьюсетах.
+Стандартные create и update DRF в него не входят.
+"""
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.test.utils import override_settings
+
+from main.health import pool_stats
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+# Декоратор для TestCase: превышение бюджета запросов валит тест
+enforce_query_budgets = override_settings(QUERY_BUDGETS_ENFORCE=True)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@dataclass
+class RequestMetrics:
+    started: float = field(default_factory=time.perf_counter)
+    queries: int = 0
+    db_time: float = 0.0
+    serializer_time: float = 0.0
+    serializer_depth: int = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """execute_wrapper: считает запросы и время в БД."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+
+@contextlib.contextmanager
+def serializer_timer():
+    """
+    Время сериализации текущего запроса. Учитывается только внешний блок,
+    вложенные (как .data в FoodSerializer.to_representation) уже входят в него.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    metrics.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_depth -= 1
+        if not metrics.serializer_depth:
+            metrics.serializer_time += time.perf_counter() - started
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+
+def format_labels(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name, self.help_text, self.buckets = name, help_text, buckets
+        self.series = defaultdict(lambda: [[0] * len(buckets), 0, 0.0])
+
+    def observe(self, labels, value):
+        counts, _, _ = series = self.series[labels]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        series[1] += 1
+        series[2] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, count, total) in sorted(self.series.items()):
+            prefix = format_labels(labels)
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket{{{prefix},le="{bound}"}} {bucket_count}'
+            yield f'{self.name}_bucket{{{prefix},le="+Inf"}} {count}'
+            yield f'{self.name}_count{{{prefix}}} {count}'
+            yield f'{self.name}_sum{{{prefix}}} {total}'
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name, self.help_text = name, help_text
+        self.series = defaultdict(int)
+
+    def inc(self, labels, value=1):
+        self.series[labels] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self.series.items()):
+            yield f'{self.name}{{{format_labels(labels)}}} {value}'
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter('http_requests_total', "Запросы по эндпоинтам и статусам")
+        self.budget_exceeded = Counter('http_query_budget_exceeded_total', "Превышения бюджета SQL-запросов")
+        self.duration = Histogram('http_request_duration_seconds', "Полное время запроса", DURATION_BUCKETS)
+        self.db_time = Histogram('http_request_db_seconds', "Время в БД за запрос", DURATION_BUCKETS)
+        self.serializer_time = Histogram('http_request_serializer_seconds', "Время в сериализаторах за запрос",
+                                         DURATION_BUCKETS)
+        self.queries = Histogram('http_request_queries', "SQL-запросов за запрос", QUERY_BUCKETS)
+        self.size = Histogram('http_response_size_bytes', "Размер ответа", SIZE_BUCKETS)
+
+    def observe(self, endpoint, method, status, metrics, duration, size):
+        labels = (('endpoint', endpoint), ('method', method))
+        with self.lock:
+            self.requests.inc((*labels, ('status', status)))
+            self.duration.observe(labels, duration)
+            self.db_time.observe(labels, metrics.db_time)
+            self.serializer_time.observe(labels, metrics.serializer_time)
+            self.queries.observe(labels, metrics.queries)
+            if size is not None:
+                self.size.observe(labels, size)
+
+    def render(self):
+        with self.lock:
+            lines = [line for metric in (self.requests, self.budget_exceeded, self.duration, self.db_time,
+                                         self.serializer_time, self.queries, self.size)
+                     for line in metric.render()]
+        stats = pool_stats()
+        if stats is not None:
+            for name, key in (('db_pool_size', 'size'), ('db_pool_in_use', 'in_use'), ('db_pool_idle', 'idle'),
+                              ('db_pool_waiting', 'waiting')):
+                lines += [f'# TYPE {name} gauge', f'{name} {stats[key]}']
+            lines += ['# TYPE db_pool_wait_seconds_total counter',
+                      f'db_pool_wait_seconds_total {stats["wait_ms_total"] / 1000}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def get_action(match, method):
+    """Вьюсет и действие DRF по resolver_match, если это вьюсет."""
+    cls = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None)
+    if cls is None or not actions:
+        return cls, None
+    return cls, actions.get(method.lower())
+
+
+def check_query_budget(request, endpoint, queries):
+    match = request.resolver_match
+    if match is None:
+        return
+    view_class, action = get_action(match, request.method)
+    budget = getattr(view_class, 'query_budgets', {}).get(action)
+    if budget is None or queries <= budget:
+        return
+    with registry.lock:
+        registry.budget_exceeded.inc((('endpoint', endpoint),))
+    message = f"{view_class.__name__}.{action}: {queries} SQL queries, budget {budget}"
+    if settings.QUERY_BUDGETS_ENFORCE:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with connections['default'].execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - metrics.started
+
+        match = request.resolver_match
+        endpoint = match.view_name if match is not None else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        registry.observe(endpoint, request.method, response.status_code, metrics, duration, size)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = (f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries", '
+                                         f'serialize;dur={metrics.serializer_time * 1000:.1f}, '
+                                         f'total;dur={duration * 1000:.1f}')
+            response['Timing-Allow-Origin'] = '*'
+        check_query_budget(request, endpoint, metrics.queries)
+        return response
+
+
+def metrics_view(request):
+    """Метрики в формате Prometheus; при METRICS_TOKEN нужен заголовок Authorization: Bearer <токен>."""
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
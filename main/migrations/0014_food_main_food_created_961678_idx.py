@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_alter_foodcategory_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='food',
+            index=models.Index(fields=['created_at', 'id'], name='main_food_created_961678_idx'),
+        ),
+    ]
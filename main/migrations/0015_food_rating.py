@@ -0,0 +1,41 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:30
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_ratings(apps, schema_editor):
+    Food = apps.get_model('main', 'Food')
+    FoodFeedback = apps.get_model('main', 'FoodFeedback')
+    feedback = FoodFeedback.objects.filter(food=models.OuterRef('pk'), rate__isnull=False).order_by().values('food')
+    Food.objects.update(
+        rating_sum=Coalesce(models.Subquery(feedback.annotate(value=models.Sum('rate')).values('value')), 0.0),
+        rating_count=Coalesce(models.Subquery(feedback.annotate(value=models.Count('id')).values('value')), 0),
+        rating=models.Subquery(feedback.annotate(value=models.Avg('rate')).values('value')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_food_main_food_created_961678_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='food',
+            name='rating',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='rating_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
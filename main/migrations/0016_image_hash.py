@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_food_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='food',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='foodcategory',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='addition',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
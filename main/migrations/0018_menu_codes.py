@@ -0,0 +1,38 @@
+import uuid
+
+from django.db import migrations, models
+
+import main.models
+
+MODELS = ['foodcategory', 'food', 'addition', 'sizeandprice']
+
+
+def fill_codes(apps, schema_editor):
+    for name in MODELS:
+        model = apps.get_model('main', name)
+        objects = list(model.objects.only('id'))
+        for obj in objects:
+            obj.code = uuid.uuid4().hex
+        model.objects.bulk_update(objects, ['code'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_addition_image_hash'),
+    ]
+
+    operations = [
+        *(migrations.AddField(
+            model_name=name,
+            name='code',
+            field=models.CharField(max_length=64, null=True, verbose_name='Код'),
+        ) for name in MODELS),
+        migrations.RunPython(fill_codes, migrations.RunPython.noop),
+        *(migrations.AlterField(
+            model_name=name,
+            name='code',
+            field=models.CharField(default=main.models.generate_code, max_length=64, unique=True,
+                                   verbose_name='Код'),
+        ) for name in MODELS),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:38
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# GIN-индексы есть только в PostgreSQL, поэтому они не описаны в Meta.indexes
+# и создаются здесь только для него
+CREATE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS main_food_search_vector_gin ON main_food USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS main_food_title_trgm ON main_food USING gin (title gin_trgm_ops)",
+]
+DROP_INDEXES = [
+    "DROP INDEX IF EXISTS main_food_search_vector_gin",
+    "DROP INDEX IF EXISTS main_food_title_trgm",
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in CREATE_INDEXES:
+        schema_editor.execute(sql)
+
+    from django.contrib.postgres.search import SearchVector
+    from django.db.models import OuterRef, Subquery, Value
+    from django.db.models.functions import Coalesce
+
+    Food = apps.get_model('main', 'Food')
+    FoodCategory = apps.get_model('main', 'FoodCategory')
+    category_title = Subquery(FoodCategory.objects.filter(pk=OuterRef('category_id')).values('title')[:1])
+    Food.objects.update(search_vector=(
+        SearchVector('title', weight='A', config='russian')
+        + SearchVector(Coalesce('description', Value('')), weight='B', config='russian')
+        + SearchVector(Coalesce(category_title, Value('')), weight='C', config='russian')
+    ))
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in DROP_INDEXES:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_menu_codes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='food',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
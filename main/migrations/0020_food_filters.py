@@ -0,0 +1,51 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:41
+
+import django.db.models.functions.comparison
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_min_prices(apps, schema_editor):
+    Food = apps.get_model('main', 'Food')
+    SizeAndPrice = apps.get_model('main', 'SizeAndPrice')
+    sizes = SizeAndPrice.objects.filter(food=models.OuterRef('pk')).order_by().values('food')
+    Food.objects.update(min_price=Coalesce(
+        models.Subquery(sizes.annotate(value=models.Min('price')).values('value')), Decimal(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_food_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='food',
+            name='min_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(fill_min_prices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='food',
+            index=models.Index(fields=['category', 'active', 'created_at', 'id'], name='food_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='food',
+            index=models.Index(fields=['min_price', 'id'], name='food_min_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='food',
+            index=models.Index(django.db.models.functions.comparison.Coalesce('rating', 'rating_sum'), models.F('id'), name='food_rating_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='food',
+            index=models.Index(fields=['cooking_time', 'id'], name='food_cooking_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sizeandprice',
+            index=models.Index(fields=['price', 'id'], name='size_price_idx'),
+        ),
+    ]
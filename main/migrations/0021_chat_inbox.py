@@ -0,0 +1,53 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_last_messages(apps, schema_editor):
+    Chat = apps.get_model('main', 'Chat')
+    Message = apps.get_model('main', 'Message')
+    latest = Message.objects.filter(chat=models.OuterRef('pk')).order_by('-created_at', '-id')
+    Chat.objects.update(
+        last_message=models.Subquery(latest.values('id')[:1]),
+        last_activity_at=Coalesce(models.Subquery(latest.values('created_at')[:1]), 'created_at'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_food_filters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.message'),
+        ),
+        migrations.RunPython(fill_last_messages, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['owner', 'last_activity_at', 'id'], name='chat_owner_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['dialogue_with', 'last_activity_at', 'id'], name='chat_dialogue_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'created_at'], name='message_chat_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['chat'], name='message_unread_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_chat_inbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='banner',
+            index=models.Index(fields=['status', 'show_date_start'], name='banner_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='banner',
+            index=models.Index(fields=['status', 'show_date_end'], name='banner_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['status', 'created_at'], name='discount_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['status', 'expires_at'], name='discount_end_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0022_promo_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='addition',
+            name='image_error',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='image_error',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='foodcategory',
+            name='image_error',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -1,10 +1,20 @@
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
 
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+from django.utils.functional import cached_property
 from pytils.translit import translify, slugify
 
 
+def generate_code():
+    return uuid.uuid4().hex
+
+
 class User(AbstractUser):
     photo = models.ImageField(upload_to="user_photo", null=True, blank=True)
     birthday = models.DateField(null=True, blank=True)
@@ -41,23 +51,95 @@ class Address(models.Model):
         verbose_name_plural = "Адреса"
 
 
+class FoodCategoryQuerySet(models.QuerySet):
+    def with_food_count(self):
+        """
+        Количество блюд в категории (всех и активных) в том же запросе,
+        см. get_food_in_count и get_active_food_in_count.
+        """
+        return self.annotate(food_in_count=models.Count('food'),
+                             active_food_in_count=models.Count('food', filter=models.Q(food__active=True)))
+
+
 class FoodCategory(models.Model):
     title = models.CharField(max_length=64)
     description = models.TextField()
     image = models.ImageField(upload_to='images/food_category', blank=True, null=True)
+    # Хэш содержимого image, по нему строятся адреса рендишенов (main.images)
+    image_hash = models.CharField(max_length=64, blank=True, default='')
+    # Почему не удалась фоновая обработка последней загрузки image
+    image_error = models.CharField(max_length=255, blank=True, default='')
+    # Внешний код для импорта/экспорта меню (main.menu_transfer)
+    code = models.CharField("Код", max_length=64, unique=True, default=generate_code)
+
+    objects = FoodCategoryQuerySet.as_manager()
 
     def __str__(self):
         return self.title
 
-
     def get_food_in_count(self):
+        # Если категория получена через with_food_count(), лишний запрос не нужен
+        if hasattr(self, 'food_in_count'):
+            return self.food_in_count
         return Food.objects.filter(category=self).count()
 
+    def get_active_food_in_count(self):
+        if hasattr(self, 'active_food_in_count'):
+            return self.active_food_in_count
+        return Food.objects.filter(category=self, active=True).count()
+
+
+class FoodQuerySet(models.QuerySet):
+    def for_menu(self):
+        """
+        Всё, что нужно FoodSerializer, за фиксированное число запросов
+        независимо от размера меню.
+        """
+        return self.select_related('created_by').prefetch_related(
+            models.Prefetch('category', queryset=FoodCategory.objects.with_food_count()),
+            models.Prefetch('accepted_additions', queryset=Addition.objects.all()),
+            models.Prefetch('sizes_and_prices', queryset=SizeAndPrice.objects.all()),
+        )
+
+    def change_rating(self, rate_delta, count_delta):
+        """
+        Атомарно сдвигает сумму и количество оценок, средняя пересчитывается
+        в том же UPDATE (в SET справа стоят значения до обновления).
+        """
+        rating_sum = models.F('rating_sum') + rate_delta
+        rating_count = models.F('rating_count') + count_delta
+        return self.update(rating_sum=rating_sum, rating_count=rating_count,
+                           rating=models.ExpressionWrapper(rating_sum / NullIf(rating_count, 0),
+                                                           output_field=models.FloatField()))
+
+    def rebuild_ratings(self):
+        """Пересчёт оценок с нуля одним UPDATE по таблице отзывов."""
+        feedback = FoodFeedback.objects.filter(food=models.OuterRef('pk'), rate__isnull=False) \
+            .order_by().values('food')
+        return self.update(
+            rating_sum=Coalesce(models.Subquery(feedback.annotate(value=models.Sum('rate')).values('value')), 0.0),
+            rating_count=Coalesce(models.Subquery(feedback.annotate(value=models.Count('id')).values('value')), 0),
+            rating=models.Subquery(feedback.annotate(value=models.Avg('rate')).values('value')),
+        )
+
+    def refresh_min_price(self):
+        """Пересчёт минимальной цены по размерам одним UPDATE."""
+        sizes = SizeAndPrice.objects.filter(food=models.OuterRef('pk')).order_by().values('food')
+        return self.update(min_price=Coalesce(
+            models.Subquery(sizes.annotate(value=models.Min('price')).values('value')), Decimal(0)))
+
+
+# Ключ сортировки по оценке: у блюд без оценок rating IS NULL, а rating_sum = 0.
+# Без констант, чтобы выражение в запросе совпадало с выражением индекса
+RATING_ORDER = Coalesce('rating', 'rating_sum')
+
 
 class Food(models.Model):
     title = models.CharField(max_length=96)
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to="images/food", blank=True, null=True)
+    image_hash = models.CharField(max_length=64, blank=True, default='')
+    image_error = models.CharField(max_length=255, blank=True, default='')
     category = models.ForeignKey("FoodCategory", on_delete=models.CASCADE, null=True)
     cooking_time = models.IntegerField(blank=True, null=True, default=0)
     accepted_additions = models.ManyToManyField("Addition", blank=True)
@@ -69,11 +151,33 @@ class Food(models.Model):
 
     sizes_and_prices = models.ManyToManyField("SizeAndPrice")
 
+    # Денормализованные оценки, поддерживаются сигналами FoodFeedback
+    rating_sum = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating = models.FloatField(null=True, blank=True)
+    # Минимальная цена по размерам для сортировки, поддерживается сигналами
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    # Поддерживается main.search на PostgreSQL, индексы — в миграции
+    search_vector = SearchVectorField(null=True, editable=False)
+    code = models.CharField("Код", max_length=64, unique=True, default=generate_code)
+
+    objects = FoodQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            # Под фильтры и сортировки FoodFilterSet
+            models.Index(fields=['category', 'active', 'created_at', 'id'], name='food_category_created_idx'),
+            models.Index(fields=['min_price', 'id'], name='food_min_price_idx'),
+            models.Index(RATING_ORDER, models.F('id'), name='food_rating_order_idx'),
+            models.Index(fields=['cooking_time', 'id'], name='food_cooking_time_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
     def get_rate(self):
-        return FoodFeedback.objects.filter(food=self).aggregate(models.Avg('rating'))['rating__avg']
+        return self.rating
 
 
 class Addition(models.Model):
@@ -81,6 +185,9 @@ class Addition(models.Model):
     description = models.TextField(null=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='images/food_addition', null=True, blank=True)
+    image_hash = models.CharField(max_length=64, blank=True, default='')
+    image_error = models.CharField(max_length=255, blank=True, default='')
+    code = models.CharField("Код", max_length=64, unique=True, default=generate_code)
 
     def __str__(self):
         return self.title
@@ -103,15 +210,28 @@ class Order(models.Model):
     order_items = models.ManyToManyField("Ordering")
     address = models.ForeignKey(Address, on_delete=models.CASCADE, null=True)
 
+    @cached_property
+    def pricing(self):
+        """
+        Снимок стоимости заказа (main.pricing.OrderPricing), считается одним
+        запросом и живёт, пока живёт объект заказа. После изменения позиций
+        сбросить: del order.pricing.
+        """
+        from main.pricing import OrderPricing
+
+        return OrderPricing.from_orderings(self.order_items.all())
+
     def get_order_weight(self):
-        return self.order_items.aggregate(models.Sum('weight'))['weight__sum']
+        return self.pricing.weight
 
     def get_pre_discount_price(self):
-        return self.order_items.all().aggregate(models.Sum('price'))['price__sum'] + \
-            self.order_items.model.additions.all().aggregate(models.Sum('price'))['price__sum']
+        return self.pricing.subtotal
+
+    def get_discount_price(self, user=None):
+        """Стоимость заказа с учётом самой выгодной из применимых акций."""
+        from main.discounts import get_discount_engine
 
-    def get_discount_price(self):
-        pass
+        return self.pricing.subtotal - get_discount_engine().evaluate(self.pricing, user).amount
 
 
 class Ordering(models.Model):
@@ -128,6 +248,42 @@ class AdditionEnrollment(models.Model):
     count = models.IntegerField(default=1)
 
 
+class ScheduleQuerySet(models.QuerySet):
+    """
+    Записи со статусом ACTIVE и окном показа [start_field, end_field],
+    пустая граница окна означает «без ограничения».
+    """
+    start_field = end_field = None
+
+    def active(self, now):
+        return self.filter(
+            models.Q(**{f'{self.start_field}__isnull': True}) | models.Q(**{f'{self.start_field}__lte': now}),
+            models.Q(**{f'{self.end_field}__isnull': True}) | models.Q(**{f'{self.end_field}__gte': now}),
+            status=1)
+
+    def next_change(self, now):
+        """
+        Ближайший после now момент, когда набор active() изменится: начало
+        окна или момент сразу после его конца (конец входит в окно).
+        """
+        # Отдельные MIN по диапазону — поиск по индексу (status, поле), а не перебор всех активных
+        scheduled = self.filter(status=1)
+        start = scheduled.filter(**{f'{self.start_field}__gt': now}) \
+            .aggregate(value=models.Min(self.start_field))['value']
+        end = scheduled.filter(**{f'{self.end_field}__gte': now}).aggregate(value=models.Min(self.end_field))['value']
+        if end is not None:
+            end += timedelta(microseconds=1)
+        return min((moment for moment in (start, end) if moment is not None), default=None)
+
+
+class BannerQuerySet(ScheduleQuerySet):
+    start_field, end_field = 'show_date_start', 'show_date_end'
+
+
+class DiscountQuerySet(ScheduleQuerySet):
+    start_field, end_field = 'created_at', 'expires_at'
+
+
 class Banner(models.Model):
     title = models.CharField("Название", max_length=100)
     image = models.ImageField("Изображение", upload_to='banner_images')
@@ -135,12 +291,19 @@ class Banner(models.Model):
     show_date_start = models.DateTimeField("Дата начала отображения", null=True, blank=True)
     show_date_end = models.DateTimeField("Дата окончания отображения", null=True, blank=True)
 
+    objects = BannerQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
     class Meta:
         verbose_name = "Баннер"
         verbose_name_plural = "Баннеры"
+        # Под BannerQuerySet.active и next_change
+        indexes = [
+            models.Index(fields=['status', 'show_date_start'], name='banner_start_idx'),
+            models.Index(fields=['status', 'show_date_end'], name='banner_end_idx'),
+        ]
 
 
 class SizeAndPrice(models.Model):
@@ -148,6 +311,7 @@ class SizeAndPrice(models.Model):
     size = models.IntegerField("Размер", default=0)
     price = models.DecimalField("Цена", max_digits=10, decimal_places=2)
     weight = models.IntegerField("Вес", default=0)
+    code = models.CharField("Код", max_length=64, unique=True, default=generate_code)
 
     def __str__(self):
         return f"{self.size} - {self.price}"
@@ -155,6 +319,7 @@ class SizeAndPrice(models.Model):
     class Meta:
         verbose_name = "Размер и цена"
         verbose_name_plural = "Размеры и цены"
+        indexes = [models.Index(fields=['price', 'id'], name='size_price_idx')]
 
 
 class Discount(models.Model):
@@ -173,6 +338,8 @@ class Discount(models.Model):
     created_at = models.DateTimeField("Дата начала акции", null=True, blank=True)
     expires_at = models.DateTimeField("Дата окончания акции", null=True, blank=True)
 
+    objects = DiscountQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
@@ -180,10 +347,13 @@ class Discount(models.Model):
         ordering = ['status', '-created_at']
         verbose_name = "Акция"
         verbose_name_plural = "Акции"
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='discount_start_idx'),
+            models.Index(fields=['status', 'expires_at'], name='discount_end_idx'),
+        ]
 
     def is_active_now(self):
-        import datetime
-        now = datetime.datetime.now()
+        now = timezone.now()
 
         if self.status != 1:
             return False
@@ -200,24 +370,21 @@ class Discount(models.Model):
         Проверяем, применима ли данная скидка к заказу:
          1. Акция активна.
          2. Условие (discount condition) выполнено.
+        Проверка идёт через скомпилированные акции из main.discounts.
         """
-        if not self.is_active_now():
-            return False
+        from main.discounts import get_discount_engine
 
-        if self.condition:
-            if not self.condition.is_applicable(order, user=user):
-                return False
-
-        return True
+        result = get_discount_engine().evaluate(order.pricing, user)
+        return any(discount.id == self.id for discount in result.applicable)
 
     def get_discount_amount(self, order):
         """
         Возвращает абсолютное значение скидки в деньгах (рублях и т.д.),
-        исходя из discount_value и order.total_price (пример).
+        исходя из discount_value и стоимости заказа до скидки.
         """
         if not self.discount_value:
-            return 0.0
-        return (order.get_pre_discount_price() * self.discount_value) / 100.0
+            return Decimal('0')
+        return order.get_pre_discount_price() * self.discount_value / 100
 
 
 class DiscountCondition(models.Model):
@@ -243,65 +410,11 @@ class DiscountCondition(models.Model):
     def is_applicable(self, order, user):
         """
         Логика проверки, применимо ли данное условие к конкретному заказу и пользователю.
-        Возвращает True/False.
+        Возвращает True/False. Сами проверки описаны в main.discounts.CompiledCondition.
         """
-        # 1. Проверяем минимальную стоимость заказа
-        if self.min_order_price is not None:
-            if order.get_pre_discount_price() < self.min_order_price:
-                return False
-
-        # 2. Проверяем минимальный вес
-        if self.min_order_weight is not None:
-            if order.get_order_weight() < self.min_order_weight:
-                return False
-
-        # 3. Проверяем категории блюд (если указаны),
-        #    должны ли ВСЕ блюда входить в эти категории или хотя бы одно?
-        #    Это зависит от вашей бизнес-логики.
-        #    Ниже пример, если "хотя бы одно" блюдо из указанных категорий:
-        if self.food_categories.exists():
-            # Получаем все категории, которые есть в заказе
-            categories_in_order = {item.food.category for item in order.order_items}
-            # Смотрим пересечение
-            valid_categories = set(self.food_categories.all())
-            if categories_in_order.isdisjoint(valid_categories):
-                return False
-
-        # 4. Проверяем конкретные блюда (order_items)
-        if self.foods.exists():
-            # Аналогично, проверяем, что в заказе присутствует хотя бы одно блюдо из self.order_items
-            foods_in_order = {item.food for item in order.order_items}
-            valid_foods = set(self.foods.all())
-            if foods_in_order.isdisjoint(valid_foods):
-                return False
-
-        # 5. Проверяем размер (food_size)
-        if self.food_size is not None:
-            # Если хотя бы одно блюдо в заказе с нужным размером — пускаем
-            sizes_in_order = {item.size for item in order.order_items}
-            if self.food_size not in sizes_in_order:
-                return False
-
-        # 6. Проверяем роль пользователя (user_role)
-        #    Если user_role указаны, значит текущий user должен быть среди них
-        if self.user_role.exists():
-            if user.groups not in self.user_role.all():
-                return False
-
-        # 7. Проверяем наличие discount_card
-        #    Допустим, в профиле пользователя или где-то хранится флаг `has_discount_card`
-        if self.discount_card:
-            if not user.has_discount_card:
-                return False
-
-        # 8. Проверяем день рождения
-        #    Допустим, логика: если user.profile.birthday == сегодня -> True
-        #    Реализуйте, как именно вы определяете "день рождения".
-        if self.birthday:
-            if not user.is_birthday_today():
-                return False
+        from main.discounts import CompiledCondition
 
-        return True
+        return not CompiledCondition.compile(self).rejections(order.pricing, user, timezone.now())
 
 
 class Attachment(models.Model):
@@ -318,15 +431,50 @@ class Attachment(models.Model):
         verbose_name_plural = "Вложения"
 
 
+class ChatQuerySet(models.QuerySet):
+    def inbox(self, user):
+        """
+        Чаты пользователя с последним сообщением и числом непрочитанных
+        (чужих) сообщений одним запросом, свежие сверху.
+        """
+        unread = Message.objects.filter(chat=models.OuterRef('pk'), is_read=False) \
+            .exclude(sender=user).order_by().values('chat')
+        return self.filter(models.Q(owner=user) | models.Q(dialogue_with=user)) \
+            .select_related('last_message') \
+            .annotate(unread_count=Coalesce(
+                models.Subquery(unread.annotate(value=models.Count('id')).values('value')), 0)) \
+            .order_by('-last_activity_at', '-id')
+
+    def refresh_last_message(self):
+        """Пересчёт последнего сообщения по таблице сообщений одним UPDATE."""
+        latest = Message.objects.filter(chat=models.OuterRef('pk')).order_by('-created_at', '-id')
+        return self.update(
+            last_message=models.Subquery(latest.values('id')[:1]),
+            last_activity_at=Coalesce(models.Subquery(latest.values('created_at')[:1]), 'created_at'),
+        )
+
+
 class Chat(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="owner")
     dialogue_with = models.ForeignKey(User, on_delete=models.CASCADE, related_name="dialogue_with")
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # Денормализованы для списка чатов, поддерживаются main.chat и сигналами Message
+    last_message = models.ForeignKey("Message", on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='+', editable=False)
+    last_activity_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = ChatQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'last_activity_at', 'id'], name='chat_owner_activity_idx'),
+            models.Index(fields=['dialogue_with', 'last_activity_at', 'id'], name='chat_dialogue_activity_idx'),
+        ]
 
     def get_last_message(self):
-        return Message.objects.filter(chat=self).order_by('-created_at').first()
+        return self.last_message
 
     def __str__(self):
         return f'{self.owner} {self.dialogue_with}'
@@ -341,5 +489,11 @@ class Message(models.Model):
     is_read = models.BooleanField(default=False)
     attachments = models.ManyToManyField(Attachment, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat', 'created_at'], name='message_chat_created_idx'),
+            models.Index(fields=['chat'], condition=models.Q(is_read=False), name='message_unread_idx'),
+        ]
+
     def __str__(self):
         return f'{self.sender} {self.message}'
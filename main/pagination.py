@@ -0,0 +1,35 @@
+from django.conf import settings
+from rest_framework import pagination
+
+
+class CursorPagination(pagination.CursorPagination):
+    """
+    Курсорная пагинация по индексированному ключу: страница в глубине
+    списка стоит столько же, сколько первая.
+
+    ?page_size=N меняет размер страницы (не больше MAX_PAGE_SIZE),
+    ?paginate=false отдаёт весь список без пагинации (для админки).
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+    unpaginated_query_param = 'paginate'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.unpaginated_query_param, '').lower() in ('false', '0'):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class FoodCursorPagination(CursorPagination):
+    ordering = ('created_at', 'id')
+
+
+class ChatCursorPagination(CursorPagination):
+    ordering = ('-last_activity_at', '-id')
+
+
+class MessageCursorPagination(CursorPagination):
+    """История чата страницами от новых к старым; целиком — только выгрузкой."""
+    ordering = ('-created_at', '-id')
+    unpaginated_query_param = None
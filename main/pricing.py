@@ -0,0 +1,147 @@
+"""
+Расчёт стоимости заказа.
+
+OrderPricing собирается одним SQL-запросом по позициям заказа вместе с
+размерами и добавками и дальше используется как неизменяемый снимок:
+для подсчёта сумм, проверки акций и в сериализаторах.
+
+quote_carts считает корзины без сохранения Order/Ordering: все блюда,
+размеры и добавки всех корзин загружаются одним in_bulk на модель.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+from functools import cached_property
+
+from django.db import models
+from django.db.models.functions import Coalesce
+from rest_framework.exceptions import ValidationError
+
+from main.discounts import get_discount_engine
+from main.models import Food, SizeAndPrice, Addition
+
+CENT = Decimal('0.01')
+
+
+@dataclass(frozen=True)
+class PricingLine:
+    ordering_id: int
+    food_id: int
+    category_id: int
+    size: int
+    count: int
+    unit_price: Decimal
+    additions_price: Decimal
+    weight: int
+
+    @property
+    def total(self):
+        return (self.unit_price + self.additions_price) * self.count
+
+
+@dataclass(frozen=True)
+class OrderPricing:
+    lines: tuple = ()
+
+    @classmethod
+    def from_orderings(cls, orderings):
+        """orderings — queryset позиций (Ordering), например order.order_items.all()."""
+        additions_price = models.ExpressionWrapper(
+            models.F('additionenrollment__addition__price') * models.F('additionenrollment__count'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2))
+        rows = orderings.values(
+            'id', 'food_id', 'food__category_id', 'size__size', 'size__price', 'size__weight', 'count',
+        ).annotate(additions_price=Coalesce(models.Sum(additions_price), Decimal('0'),
+                                            output_field=models.DecimalField(max_digits=12, decimal_places=2)))
+        return cls(tuple(
+            PricingLine(
+                ordering_id=row['id'],
+                food_id=row['food_id'],
+                category_id=row['food__category_id'],
+                size=row['size__size'],
+                count=row['count'],
+                unit_price=Decimal(row['size__price'] or 0).quantize(CENT),
+                additions_price=Decimal(row['additions_price']).quantize(CENT),
+                weight=row['size__weight'] or 0,
+            )
+            for row in rows.order_by('id')
+        ))
+
+    @cached_property
+    def subtotal(self):
+        return sum((line.total for line in self.lines), Decimal('0'))
+
+    @cached_property
+    def weight(self):
+        return sum(line.weight * line.count for line in self.lines)
+
+    @cached_property
+    def food_ids(self):
+        return frozenset(line.food_id for line in self.lines if line.food_id)
+
+    @cached_property
+    def category_ids(self):
+        return frozenset(line.category_id for line in self.lines if line.category_id)
+
+    @cached_property
+    def sizes(self):
+        return frozenset(line.size for line in self.lines if line.size is not None)
+
+
+@dataclass(frozen=True)
+class CartQuote:
+    pricing: OrderPricing
+    discount: object = None
+    discount_amount: Decimal = Decimal('0')
+
+    @property
+    def total(self):
+        return self.pricing.subtotal - self.discount_amount
+
+
+def quote_carts(carts, user=None):
+    """
+    carts — провалидированные CartSerializer корзины:
+    [{'items': [{'food': id, 'size': id, 'count': n, 'additions': [{'addition': id, 'count': n}]}]}]
+    Возвращает CartQuote с суммами и применённой акцией для каждой корзины.
+    """
+    items = [item for cart in carts for item in cart['items']]
+    foods = Food.objects.in_bulk({item['food'] for item in items})
+    sizes = SizeAndPrice.objects.in_bulk({item['size'] for item in items})
+    additions = Addition.objects.in_bulk({addition['addition'] for item in items for addition in item['additions']})
+    food_sizes = set(Food.sizes_and_prices.through.objects.filter(
+        food_id__in=foods, sizeandprice_id__in=sizes).values_list('food_id', 'sizeandprice_id'))
+    food_additions = set(Food.accepted_additions.through.objects.filter(
+        food_id__in=foods, addition_id__in=additions).values_list('food_id', 'addition_id'))
+
+    errors = []
+    for item in items:
+        if item['food'] not in foods:
+            errors.append(f"Блюдо {item['food']} не найдено")
+        elif (item['food'], item['size']) not in food_sizes:
+            errors.append(f"Размер {item['size']} не относится к блюду {item['food']}")
+        for addition in item['additions']:
+            if (item['food'], addition['addition']) not in food_additions:
+                errors.append(f"Добавка {addition['addition']} недоступна для блюда {item['food']}")
+    if errors:
+        raise ValidationError(errors)
+
+    engine = get_discount_engine()
+    quotes = []
+    for cart in carts:
+        pricing = OrderPricing(tuple(
+            PricingLine(
+                ordering_id=None,
+                food_id=item['food'],
+                category_id=foods[item['food']].category_id,
+                size=sizes[item['size']].size,
+                count=item['count'],
+                unit_price=sizes[item['size']].price,
+                additions_price=sum((additions[addition['addition']].price * addition['count']
+                                     for addition in item['additions']), Decimal('0')),
+                weight=sizes[item['size']].weight,
+            )
+            for item in cart['items']
+        ))
+        result = engine.evaluate(pricing, user)
+        quotes.append(CartQuote(pricing, result.best, result.amount))
+    return quotes
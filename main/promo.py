@@ -0,0 +1,44 @@
+"""
+Лента /promo/: баннеры и акции, которые видны прямо сейчас.
+
+Набор видимых записей меняется только на границах окон показа, поэтому
+лента кэшируется до ближайшей такой границы (next_change), а не на
+фиксированный TTL. Правки баннеров и акций меняют их версии в кэше
+(main.signals), и старая запись перестаёт читаться сразу.
+"""
+import math
+
+from django.utils import timezone
+
+from main.cache import get_menu_cache, get_version, DISCOUNTS_VERSION_KEY, BANNERS_VERSION_KEY
+from main.metrics import serializer_timer
+from main.models import Banner, Discount
+from main.serializers import PromoSerializer
+
+
+def build_feed(request, now):
+    """Лента на момент now и момент, до которого она верна (None — до следующей правки)."""
+    feed = {
+        'banners': Banner.objects.active(now).order_by('show_date_start', 'id'),
+        'discounts': Discount.objects.active(now).order_by('-created_at', '-id'),
+    }
+    with serializer_timer():
+        data = PromoSerializer(feed, context={'request': request}).data
+    changes = [Banner.objects.next_change(now), Discount.objects.next_change(now)]
+    return data, min((moment for moment in changes if moment is not None), default=None)
+
+
+def get_feed(request):
+    cache = get_menu_cache()
+    now = timezone.now()
+    # Версии читаем до запросов к БД, как в MenuCacheMixin; хост — из-за абсолютных адресов изображений
+    key = f"promo:{get_version(BANNERS_VERSION_KEY)}:{get_version(DISCOUNTS_VERSION_KEY)}:{request.get_host()}"
+    cached = cache.get(key)
+    # Таймаут кэша в целых секундах, точную границу проверяем сами
+    if cached is not None and (cached['valid_until'] is None or now < cached['valid_until']):
+        return cached['data']
+
+    data, valid_until = build_feed(request, now)
+    timeout = None if valid_until is None else math.ceil((valid_until - now).total_seconds())
+    cache.set(key, {'data': data, 'valid_until': valid_until}, timeout=timeout)
+    return data
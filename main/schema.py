@@ -0,0 +1,175 @@
+"""
+OpenAPI-схема как артефакт сборки.
+
+manage.py build_schema один раз генерирует схему drf-spectacular и кладёт
+в SCHEMA_ARTIFACT_DIR YAML и JSON (имена с хэшем содержимого) вместе со
+сжатыми gzip и brotli копиями и manifest.json. SchemaView отдаёт их из
+памяти с сильным ETag и Content-Encoding по Accept-Encoding, генератор
+при этом не вызывается. Без артефакта схема генерируется на каждый запрос,
+но только при DEBUG.
+"""
+import gzip
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import brotli
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views import View
+from drf_spectacular.renderers import OpenApiYamlRenderer, OpenApiJsonRenderer
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.views import SpectacularAPIView
+
+MANIFEST_NAME = 'manifest.json'
+FORMATS = {
+    'yaml': (OpenApiYamlRenderer, 'application/vnd.oai.openapi'),
+    'json': (OpenApiJsonRenderer, 'application/vnd.oai.openapi+json'),
+}
+# В порядке предпочтения; mtime=0, чтобы сборка из той же схемы давала те же байты
+ENCODINGS = {
+    'br': ('.br', lambda content: brotli.compress(content, quality=11)),
+    'gzip': ('.gz', lambda content: gzip.compress(content, compresslevel=9, mtime=0)),
+}
+
+
+def generate_schema():
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    return generator.get_schema(request=None, public=True)
+
+
+def write_file(path, content):
+    # Через временный файл: работающий процесс не прочитает файл наполовину
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+
+
+def build_artifact(directory):
+    """Генерирует схему и записывает артефакт, возвращает manifest."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    schema = generate_schema()
+    manifest = {
+        'api_version': spectacular_settings.VERSION,
+        'generated_at': timezone.now().isoformat(),
+        'formats': {},
+    }
+    for name, (renderer_class, media_type) in FORMATS.items():
+        content = renderer_class().render(schema, renderer_context={})
+        digest = hashlib.sha256(content).hexdigest()
+        file_name = f'openapi.{digest[:12]}.{name}'
+        write_file(directory / file_name, content)
+        for suffix, compress in ENCODINGS.values():
+            write_file(directory / f'{file_name}{suffix}', compress(content))
+        manifest['formats'][name] = {'file': file_name, 'sha256': digest, 'media_type': media_type,
+                                     'size': len(content)}
+    # manifest последним: до его замены читается предыдущая версия целиком
+    write_file(directory / MANIFEST_NAME, json.dumps(manifest, indent=2).encode())
+
+    current = {MANIFEST_NAME} | {f"{item['file']}{suffix}" for item in manifest['formats'].values()
+                                 for suffix in ('', *(suffix for suffix, _ in ENCODINGS.values()))}
+    for path in directory.glob('openapi.*'):
+        if path.name not in current:
+            path.unlink()
+    return manifest
+
+
+@dataclass(frozen=True)
+class Representation:
+    media_type: str
+    sha256: str
+    bodies: dict  # кодировка ('identity', 'br', 'gzip') -> байты
+
+
+_artifact = None
+_artifact_key = None
+
+
+def load_artifact():
+    """
+    Артефакт из SCHEMA_ARTIFACT_DIR в памяти процесса или None, если он не
+    собран. Перечитывается, когда меняется manifest.json.
+    """
+    global _artifact, _artifact_key
+    directory = Path(settings.SCHEMA_ARTIFACT_DIR)
+    try:
+        stat = (directory / MANIFEST_NAME).stat()
+    except FileNotFoundError:
+        return None
+    key = (str(directory), stat.st_mtime_ns, stat.st_size)
+    if key != _artifact_key:
+        manifest = json.loads((directory / MANIFEST_NAME).read_bytes())
+        artifact = {}
+        for name, item in manifest['formats'].items():
+            path = directory / item['file']
+            bodies = {'identity': path.read_bytes()}
+            for encoding, (suffix, _) in ENCODINGS.items():
+                bodies[encoding] = path.with_name(path.name + suffix).read_bytes()
+            artifact[name] = Representation(item['media_type'], item['sha256'], bodies)
+        _artifact, _artifact_key = artifact, key
+    return _artifact
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding с ненулевым q, * раскрывается в ENCODINGS."""
+    encodings = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        try:
+            q = float(params.strip().removeprefix('q=')) if params else 1
+        except ValueError:
+            q = 0
+        if q > 0:
+            encodings.add(name.strip().lower())
+    if '*' in encodings:
+        encodings |= set(ENCODINGS)
+    return encodings
+
+
+class SchemaView(View):
+    """
+    /api/schema/: YAML по умолчанию, JSON — ?format=json или Accept с json,
+    как у SpectacularAPIView.
+    """
+
+    def get_format(self, request):
+        requested = request.GET.get('format')
+        if requested in FORMATS:
+            return requested
+        return 'json' if 'json' in request.headers.get('Accept', '') else 'yaml'
+
+    def get(self, request, *args, **kwargs):
+        artifact = load_artifact()
+        if artifact is None:
+            if settings.DEBUG:
+                return SpectacularAPIView.as_view()(request, *args, **kwargs)
+            return HttpResponse("Схема не собрана: manage.py build_schema", status=503,
+                                content_type='text/plain; charset=utf-8')
+
+        representation = artifact[self.get_format(request)]
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        encoding = next((encoding for encoding in ENCODINGS if encoding in accepted), 'identity')
+        # Сильный ETag относится к конкретным байтам, поэтому у сжатых копий свой
+        etag = f'"{representation.sha256}"' if encoding == 'identity' \
+            else f'"{representation.sha256}-{encoding}"'
+
+        # If-None-Match сравнивается слабо (RFC 9110), W/ мог добавить прокси
+        if_none_match = {tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(representation.bodies[encoding],
+                                    content_type=f'{representation.media_type}; charset=utf-8')
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        # Кэшировать можно, но перед использованием сверять ETag: схема меняется с деплоем
+        response['Cache-Control'] = 'public, no-cache'
+        return response
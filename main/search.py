@@ -0,0 +1,157 @@
+"""
+Поиск по меню.
+
+На PostgreSQL у блюда есть поддерживаемый search_vector (название — вес A,
+описание — B, название категории — C, конфигурация russian) с GIN-индексом
+и триграммный GIN-индекс по названию для опечаток. Запрос ищется по словам
+с префиксами, результаты сортируются по ts_rank и похожести названия.
+
+На других базах (SQLite в разработке и тестах) строится инвертированный
+индекс в памяти процесса с тем же весом полей, упрощённым русским
+стеммингом, префиксами и триграммной похожестью для опечаток. Индекс
+пересобирается при смене версии меню (main.cache).
+"""
+import bisect
+import math
+import re
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F, Q, Subquery, OuterRef, Value
+from django.db.models.functions import Coalesce
+
+from main.cache import get_menu_version
+from main.models import Food, FoodCategory
+
+SEARCH_CONFIG = 'russian'
+TRIGRAM_THRESHOLD = 0.3
+FIELD_WEIGHTS = {'title': 1.0, 'description': 0.4, 'category': 0.2}
+WORD_RE = re.compile(r'\w+')
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def food_search_vector():
+    category_title = Subquery(FoodCategory.objects.filter(pk=OuterRef('category_id')).values('title')[:1])
+    return (SearchVector('title', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(Coalesce('description', Value('')), weight='B', config=SEARCH_CONFIG)
+            + SearchVector(Coalesce(category_title, Value('')), weight='C', config=SEARCH_CONFIG))
+
+
+def update_search_vectors(foods):
+    """Пересчитать search_vector у блюд из queryset одним UPDATE (только PostgreSQL)."""
+    if uses_postgres():
+        foods.update(search_vector=food_search_vector())
+
+
+def search_food_ids(text, limit=20):
+    """id блюд по убыванию релевантности."""
+    words = WORD_RE.findall(text.lower())
+    if not words:
+        return []
+    if uses_postgres():
+        return postgres_search(text, words, limit)
+    return get_search_index().search(words, limit)
+
+
+def postgres_search(text, words, limit):
+    # Слова состоят только из \w, поэтому их можно подставлять в raw tsquery
+    query = SearchQuery(' & '.join(f"{word}:*" for word in words), search_type='raw', config=SEARCH_CONFIG)
+    foods = Food.objects.annotate(
+        rank=SearchRank(F('search_vector'), query),
+        similarity=TrigramWordSimilarity(text, 'title'),
+    ).filter(
+        Q(search_vector=query) | Q(title__trigram_word_similar=text)
+    ).order_by('-rank', '-similarity', 'id')
+    return list(foods.values_list('id', flat=True)[:limit])
+
+
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ией', 'иях', 'ием', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее',
+    'ые', 'ие', 'ый', 'ий', 'ой', 'ей', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ую', 'юю', 'ию', 'ия',
+    'ь', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'й',
+), key=len, reverse=True)
+
+
+def stem(word):
+    """Очень грубый русский стемминг: отрезает самое длинное окончание, оставляя основу от 3 букв."""
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InvertedIndex:
+    def __init__(self, rows):
+        """rows — (id, title, description, category_title)."""
+        self.postings = defaultdict(lambda: defaultdict(float))  # основа -> id блюда -> вес
+        for food_id, *texts in rows:
+            for field, text in zip(FIELD_WEIGHTS, texts):
+                for word in WORD_RE.findall((text or '').lower()):
+                    postings = self.postings[stem(word)]
+                    postings[food_id] = max(postings[food_id], FIELD_WEIGHTS[field])
+        self.size = len(rows)
+        self.vocabulary = sorted(self.postings)
+        self.trigram_index = defaultdict(set)
+        for token in self.vocabulary:
+            for gram in trigrams(token):
+                self.trigram_index[gram].add(token)
+
+    def expand(self, word):
+        """Основы словаря, подходящие под слово запроса, с коэффициентом совпадения."""
+        token = stem(word)
+        matches = {}
+        if token in self.postings:
+            matches[token] = 1.0
+        start = bisect.bisect_left(self.vocabulary, token)
+        for candidate in self.vocabulary[start:]:
+            if not candidate.startswith(token):
+                break
+            matches.setdefault(candidate, 0.8)
+        if not matches:
+            grams = trigrams(token)
+            candidates = set().union(*(self.trigram_index.get(gram, ()) for gram in grams))
+            for candidate in candidates:
+                similarity = len(grams & trigrams(candidate)) / len(grams | trigrams(candidate))
+                if similarity >= TRIGRAM_THRESHOLD:
+                    matches[candidate] = similarity
+        return matches
+
+    def search(self, words, limit):
+        scores = None
+        for word in words:
+            word_scores = defaultdict(float)
+            for token, match in self.expand(word).items():
+                postings = self.postings[token]
+                idf = math.log(1 + self.size / len(postings))
+                for food_id, weight in postings.items():
+                    word_scores[food_id] = max(word_scores[food_id], match * weight * idf)
+            if scores is None:
+                scores = dict(word_scores)
+            else:
+                scores = {food_id: score + word_scores[food_id] for food_id, score in scores.items()
+                          if food_id in word_scores}
+            if not scores:
+                return []
+        return sorted(scores, key=lambda food_id: (-scores[food_id], food_id))[:limit]
+
+
+_index = None
+_index_version = None
+
+
+def get_search_index():
+    global _index, _index_version
+    version = get_menu_version()
+    if _index is None or _index_version != version:
+        rows = Food.objects.values_list('id', 'title', 'description', 'category__title')
+        _index, _index_version = InvertedIndex(list(rows.iterator(chunk_size=2000))), version
+    return _index
@@ -1,85 +1,179 @@
+from django.db import transaction
+from django.db.models.manager import BaseManager
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
-from drf_extra_fields.fields import Base64ImageField
 
-from main.models import Food, User, Address, FoodCategory, Addition, FoodFeedback, Order, SizeAndPrice
+from main.cache import bump_menu_version
+from main.images import DeferredImageField, DeferredImagesMixin, rendition_urls
+from main.models import Food, User, Address, FoodCategory, Addition, FoodFeedback, Order, SizeAndPrice, Ordering, \
+    Chat, Message, Attachment, Banner, Discount
 
 
-class FoodCategorySerializer(serializers.ModelSerializer):
-    image = Base64ImageField()
-
-    class Meta:
-        model = FoodCategory
-        fields = '__all__'
+class NestedRepresentationMixin:
+    """
+    На запись поля из nested_representation принимают id, а в ответе
+    разворачиваются сериализатором из словаря (без context, как и раньше).
+    """
+    nested_representation = {}
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        data['count_in'] = instance.get_food_in_count()
+        for name, serializer_class in self.nested_representation.items():
+            value = getattr(instance, name)
+            if isinstance(value, BaseManager):
+                data[name] = serializer_class(value.all(), many=True).data
+            else:
+                data[name] = serializer_class(value).data
         return data
 
 
-class AdditionSerializer(serializers.ModelSerializer):
+class FoodCategorySerializer(DeferredImagesMixin, serializers.ModelSerializer):
+    image = DeferredImageField()
+    images = serializers.SerializerMethodField()
+    count_in = serializers.IntegerField(source='get_food_in_count', read_only=True)
+    active_count_in = serializers.IntegerField(source='get_active_food_in_count', read_only=True)
+
+    class Meta:
+        model = FoodCategory
+        fields = ['id', 'image', 'images', 'image_error', 'title', 'description', 'count_in', 'active_count_in']
+        read_only_fields = ['image_error']
+
+    @extend_schema_field(OpenApiTypes.OBJECT)
+    def get_images(self, instance):
+        return rendition_urls(instance.image_hash)
+
+
+class AdditionSerializer(DeferredImagesMixin, serializers.ModelSerializer):
+    image = DeferredImageField(required=False, allow_null=True)
+    images = serializers.SerializerMethodField()
+
     class Meta:
         model = Addition
-        fields = '__all__'
+        exclude = ['image_hash', 'code']
+        read_only_fields = ['image_error']
+
+    @extend_schema_field(OpenApiTypes.OBJECT)
+    def get_images(self, instance):
+        return rendition_urls(instance.image_hash)
 
 
 class SizesAndPricesSerializer(serializers.ModelSerializer):
+    # Доступен на запись, чтобы FoodSerializer.update сопоставлял размеры по id
+    id = serializers.IntegerField(required=False)
+
     class Meta:
         model = SizeAndPrice
-        fields = '__all__'
+        exclude = ['code']
 
 
-class FoodSerializer(serializers.ModelSerializer):
+class FoodSerializer(NestedRepresentationMixin, DeferredImagesMixin, serializers.ModelSerializer):
     category = serializers.PrimaryKeyRelatedField(queryset=FoodCategory.objects.all())
     accepted_additions = serializers.PrimaryKeyRelatedField(many=True, queryset=Addition.objects.all())
     sizes_and_prices = SizesAndPricesSerializer(many=True)
-    image = Base64ImageField()
+    image = DeferredImageField()
+    images = serializers.SerializerMethodField()
+    created_by = serializers.SerializerMethodField()
 
     class Meta:
         model = Food
-        fields = '__all__'
+        # Порядок полей как у '__all__', created_by объявлен явно, чтобы не
+        # сериализовать вложенного пользователя целиком
+        fields = ['id', 'category', 'accepted_additions', 'sizes_and_prices', 'image', 'title', 'description',
+                  'cooking_time', 'active', 'created_at', 'updated_at', 'created_by', 'rating', 'rating_count',
+                  'images', 'image_error']
+        read_only_fields = ['rating', 'rating_count', 'image_error']
         depth = 1
 
+    nested_representation = {'category': FoodCategorySerializer, 'accepted_additions': AdditionSerializer}
+    food_update_fields = ['title', 'description', 'category', 'cooking_time', 'active']
+    size_update_fields = ['title', 'size', 'price', 'weight']
+
     def create(self, validated_data):
         food = Food.objects.create(title=validated_data['title'],
                                    cooking_time=validated_data['cooking_time'],
-                                   category=validated_data['category'], image=validated_data['image'],
+                                   category=validated_data['category'], image=validated_data.get('image'),
                                    description=validated_data['description'], active=validated_data['active'])
-        for size in validated_data['sizes_and_prices']:
-            food.sizes_and_prices.create(**size)
-        for addition in validated_data['accepted_additions']:
-            food.accepted_additions.add(addition)
-        food.save()
+        sizes = SizeAndPrice.objects.bulk_create([
+            SizeAndPrice(**{key: value for key, value in size.items() if key != 'id'})
+            for size in validated_data['sizes_and_prices']
+        ])
+        food.sizes_and_prices.add(*sizes)
+        food.accepted_additions.add(*validated_data['accepted_additions'])
         return food
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        print(validated_data)
         food = instance
-        food.category = validated_data['category']
-        food.description = validated_data['description']
-        food.active = validated_data['active']
-        try:
-            food.image = validated_data['image']
-        except KeyError:
-            pass
-        food.cooking_time = validated_data['cooking_time']
-        food.sizes_and_prices.all().delete()
-        for size in validated_data['sizes_and_prices']:
-            food.sizes_and_prices.create(**size)
-        food.accepted_additions.set(validated_data['accepted_additions'])
-        food.save()
+        changed = [name for name in self.food_update_fields
+                   if name in validated_data and getattr(food, name) != validated_data[name]]
+        for name in changed:
+            setattr(food, name, validated_data[name])
+
+        sizes_changed = False
+        if 'sizes_and_prices' in validated_data:
+            sizes_changed = self.update_sizes(food, validated_data['sizes_and_prices'])
+        if 'accepted_additions' in validated_data:
+            current = set(food.accepted_additions.all())
+            incoming = set(validated_data['accepted_additions'])
+            if current - incoming:
+                food.accepted_additions.remove(*(current - incoming))
+            if incoming - current:
+                food.accepted_additions.add(*(incoming - current))
+
+        if changed or sizes_changed:
+            food.save(update_fields=changed + ['updated_at'])
         return food
 
+    def update_sizes(self, food, sizes_data):
+        """
+        Сопоставляет пришедшие размеры с текущими по id, затем по (title, size),
+        и пишет только разницу. Удалённые из блюда размеры, на которые
+        ссылаются позиции заказов, только отвязываются, чтобы не потерять
+        историю заказов. Возвращает True, если что-то поменялось.
+        """
+        existing = {size.id: size for size in food.sizes_and_prices.all()}
+        by_key = {(size.title, size.size): size for size in existing.values()}
+        matched, to_update, to_create = set(), [], []
+        for data in sizes_data:
+            size = existing.get(data.get('id'))
+            if size is None or size.id in matched:
+                size = by_key.get((data.get('title'), data.get('size', 0)))
+            if size is None or size.id in matched:
+                to_create.append(SizeAndPrice(**{key: value for key, value in data.items() if key != 'id'}))
+                continue
+            matched.add(size.id)
+            dirty = [name for name in self.size_update_fields if name in data and getattr(size, name) != data[name]]
+            for name in dirty:
+                setattr(size, name, data[name])
+            if dirty:
+                to_update.append(size)
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        data['category'] = FoodCategorySerializer(instance.category).data
-        data['accepted_additions'] = AdditionSerializer(instance.accepted_additions.all(), many=True).data
-        try:
-            data['created_by'] = {"id": instance.created_by.id, 'username': instance.created_by.username}
-        except AttributeError:
-            data['created_by'] = "Anonymous"
-        return data
+        removed = existing.keys() - matched
+        if to_update:
+            SizeAndPrice.objects.bulk_update(to_update, self.size_update_fields)
+        if to_create:
+            food.sizes_and_prices.add(*SizeAndPrice.objects.bulk_create(to_create))
+        if removed:
+            food.sizes_and_prices.remove(*removed)
+            in_orders = Ordering.objects.filter(size__in=removed).values('size')
+            SizeAndPrice.objects.filter(id__in=removed).exclude(id__in=in_orders).delete()
+
+        if to_update:
+            # bulk_update не шлёт post_save
+            Food.objects.filter(pk=food.pk).refresh_min_price()
+            transaction.on_commit(bump_menu_version)
+        return bool(to_update or to_create or removed)
+
+    @extend_schema_field(OpenApiTypes.OBJECT)
+    def get_images(self, instance):
+        return rendition_urls(instance.image_hash)
+
+    @extend_schema_field(OpenApiTypes.OBJECT)
+    def get_created_by(self, instance):
+        if instance.created_by is None:
+            return "Anonymous"
+        return {"id": instance.created_by.id, 'username': instance.created_by.username}
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -101,7 +195,105 @@ class FoodFeedbackSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class PricingLineSerializer(serializers.Serializer):
+    ordering = serializers.IntegerField(source='ordering_id')
+    food = serializers.IntegerField(source='food_id')
+    count = serializers.IntegerField()
+    unit_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+    additions_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class PricingSerializer(serializers.Serializer):
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    weight = serializers.IntegerField()
+    lines = PricingLineSerializer(many=True)
+
+
 class OrderSerializer(serializers.ModelSerializer):
+    pricing = PricingSerializer(read_only=True)
+
     class Meta:
         model = Order
         fields = '__all__'
+
+
+class CartAdditionSerializer(serializers.Serializer):
+    addition = serializers.IntegerField()
+    count = serializers.IntegerField(min_value=1, default=1)
+
+
+class CartItemSerializer(serializers.Serializer):
+    # Обычные IntegerField вместо PrimaryKeyRelatedField: объекты
+    # подгружаются разом в main.pricing.quote_carts
+    food = serializers.IntegerField()
+    size = serializers.IntegerField()
+    count = serializers.IntegerField(min_value=1, default=1)
+    additions = CartAdditionSerializer(many=True, required=False, default=list)
+
+
+class CartSerializer(serializers.Serializer):
+    items = CartItemSerializer(many=True, allow_empty=False)
+
+
+class QuoteDiscountSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+
+
+class QuoteSerializer(serializers.Serializer):
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2, source='pricing.subtotal')
+    weight = serializers.IntegerField(source='pricing.weight')
+    lines = PricingLineSerializer(many=True, source='pricing.lines')
+    discount = QuoteDiscountSerializer(allow_null=True)
+    discount_amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class PromoBannerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Banner
+        fields = ['id', 'title', 'image', 'show_date_start', 'show_date_end']
+
+
+class PromoDiscountSerializer(serializers.ModelSerializer):
+    starts_at = serializers.DateTimeField(source='created_at')
+
+    class Meta:
+        model = Discount
+        fields = ['id', 'title', 'description', 'banner', 'discount_value', 'starts_at', 'expires_at']
+
+
+class PromoSerializer(serializers.Serializer):
+    banners = PromoBannerSerializer(many=True)
+    discounts = PromoDiscountSerializer(many=True)
+
+
+class MessagePreviewSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Message
+        fields = ['id', 'sender', 'message', 'created_at', 'is_read']
+
+
+class ChatSerializer(serializers.ModelSerializer):
+    last_message = MessagePreviewSerializer(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Chat
+        fields = ['id', 'order', 'owner', 'dialogue_with', 'created_at', 'last_activity_at', 'last_message',
+                  'unread_count']
+
+
+class AttachmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Attachment
+        fields = '__all__'
+
+
+class MessageSerializer(serializers.ModelSerializer):
+    attachments = AttachmentSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Message
+        fields = ['id', 'chat', 'sender', 'message', 'created_at', 'is_read', 'attachments']
@@ -0,0 +1,129 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed, post_init, pre_delete
+from django.dispatch import receiver
+
+from main.cache import bump_menu_version, bump_version, DISCOUNTS_VERSION_KEY, BANNERS_VERSION_KEY
+from main.search import update_search_vectors
+from main.models import Food, FoodCategory, SizeAndPrice, Addition, Discount, DiscountCondition, FoodFeedback, Chat, \
+    Message, Banner
+
+MENU_MODELS = (Food, FoodCategory, SizeAndPrice, Addition)
+DISCOUNT_MODELS = (Discount, DiscountCondition)
+
+
+def bump_discounts_version():
+    bump_version(DISCOUNTS_VERSION_KEY)
+
+
+def bump_banners_version():
+    bump_version(BANNERS_VERSION_KEY)
+
+
+# Версии увеличиваются только после коммита: иначе параллельный запрос
+# прочитает новую версию и ещё старые строки и закэширует их под новой
+# версией без TIMEOUT. Вне транзакции on_commit выполняется сразу.
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_caches_on_change(sender, **kwargs):
+    if sender in MENU_MODELS:
+        transaction.on_commit(bump_menu_version)
+    elif sender in DISCOUNT_MODELS:
+        transaction.on_commit(bump_discounts_version)
+    elif sender is Banner:
+        transaction.on_commit(bump_banners_version)
+
+
+@receiver(post_save, sender=Food)
+def update_food_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'title', 'description', 'category'} & set(update_fields):
+        update_search_vectors(Food.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=FoodCategory)
+def update_category_search_vectors(sender, instance, created, **kwargs):
+    if not created:
+        update_search_vectors(Food.objects.filter(category=instance))
+
+
+@receiver(m2m_changed, sender=Food.accepted_additions.through)
+@receiver(m2m_changed, sender=Food.sizes_and_prices.through)
+def invalidate_menu_on_m2m_change(sender, action, **kwargs):
+    if action.startswith('post_'):
+        transaction.on_commit(bump_menu_version)
+
+
+@receiver(m2m_changed, sender=Food.sizes_and_prices.through)
+def update_min_price_on_sizes_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        Food.objects.filter(pk=instance.pk).refresh_min_price()
+    elif pk_set:
+        Food.objects.filter(pk__in=pk_set).refresh_min_price()
+
+
+@receiver(post_save, sender=SizeAndPrice)
+def update_min_price_on_size_save(sender, instance, created, **kwargs):
+    if not created:
+        Food.objects.filter(sizes_and_prices=instance).refresh_min_price()
+
+
+@receiver(pre_delete, sender=SizeAndPrice)
+def remember_size_foods(sender, instance, **kwargs):
+    # После удаления связи уже каскадно удалены
+    instance._food_ids = list(Food.objects.filter(sizes_and_prices=instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=SizeAndPrice)
+def update_min_price_on_size_delete(sender, instance, **kwargs):
+    if instance._food_ids:
+        Food.objects.filter(pk__in=instance._food_ids).refresh_min_price()
+
+
+@receiver(m2m_changed, sender=DiscountCondition.food_categories.through)
+@receiver(m2m_changed, sender=DiscountCondition.foods.through)
+@receiver(m2m_changed, sender=DiscountCondition.user_role.through)
+def invalidate_discounts_on_m2m_change(sender, action, **kwargs):
+    if action.startswith('post_'):
+        transaction.on_commit(bump_discounts_version)
+
+
+def rating_contribution(food_id, rate):
+    if food_id is None or rate is None:
+        return None
+    return food_id, rate
+
+
+@receiver(post_init, sender=FoodFeedback)
+def remember_feedback_rating(sender, instance, **kwargs):
+    instance._rating_contribution = rating_contribution(instance.food_id, instance.rate)
+
+
+@receiver(post_save, sender=FoodFeedback)
+@receiver(post_delete, sender=FoodFeedback)
+def update_food_rating(sender, instance, signal, created=False, **kwargs):
+    # Оценка, уже учтённая в Food, и та, что должна быть учтена теперь
+    old = None if created else instance._rating_contribution
+    new = rating_contribution(instance.food_id, instance.rate) if signal is post_save else None
+    if old == new:
+        return
+    with transaction.atomic():
+        if old:
+            Food.objects.filter(pk=old[0]).change_rating(-old[1], -1)
+        if new:
+            Food.objects.filter(pk=new[0]).change_rating(new[1], 1)
+    instance._rating_contribution = new
+    transaction.on_commit(bump_menu_version)
+
+
+@receiver(post_save, sender=Message)
+def update_chat_last_message(sender, instance, created, **kwargs):
+    # Пачки из main.chat пишутся bulk_create и обновляют чаты там же
+    if created:
+        Chat.objects.filter(pk=instance.chat_id).update(last_message=instance, last_activity_at=instance.created_at)
+
+
+@receiver(post_delete, sender=Message)
+def refresh_chat_last_message(sender, instance, **kwargs):
+    # on_delete=SET_NULL уже обнулил ссылку, если удалено последнее сообщение
+    Chat.objects.filter(pk=instance.chat_id, last_message__isnull=True).refresh_last_message()
@@ -1,3 +1,1231 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import brotli
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO, BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from PIL import Image
+from rest_framework import mixins, serializers
+from rest_framework.test import APIClient
+
+from main.cache import get_menu_cache
+from main.chat import chat_application, close_chat, get_chat, CLOSE_FORBIDDEN
+from main.discounts import get_discount_engine
+from main.fast_read import FastReadMixin, get_plan
+from main.filters import FoodFilterSet
+from main.images import rendition_name, schedule_image, UploadedPendingImage, _latest_jobs
+from main.menu_transfer import import_menu, parse, MenuImportError
+from main.metrics import enforce_query_budgets, QueryBudgetExceeded
+from main.models import Food, FoodCategory, Addition, SizeAndPrice, Order, Ordering, Discount, DiscountCondition, \
+    AdditionEnrollment, User, FoodFeedback, Chat, Message, Attachment, Banner
+from main.pagination import FoodCursorPagination
+from main.serializers import AdditionSerializer
+from main.views import CategoryViewSet
+
+
+def create_menu(categories=2, foods_per_category=3):
+    addition = Addition.objects.create(title="Сыр", price=Decimal('50.00'))
+    for i in range(categories):
+        category = FoodCategory.objects.create(title=f"Категория {i}", description="")
+        for j in range(foods_per_category):
+            food = Food.objects.create(title=f"Блюдо {i}-{j}", category=category)
+            food.sizes_and_prices.create(title="S", size=25, price=Decimal('300.00'), weight=400)
+            food.sizes_and_prices.create(title="L", size=35, price=Decimal('500.00'), weight=700)
+            food.accepted_additions.add(addition)
+
+
+class FoodListQueriesTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_food_list_queries_do_not_grow_with_menu(self):
+        create_menu(categories=1, foods_per_category=2)
+        small = self.count_queries('/food/')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_menu(categories=5, foods_per_category=10)
+        self.assertEqual(self.count_queries('/food/'), small)
+
+    def test_food_list_payload(self):
+        create_menu(categories=1, foods_per_category=1)
+        food = self.client.get('/food/').json()['results'][0]
+        self.assertEqual(food['category']['count_in'], 1)
+        self.assertEqual(len(food['sizes_and_prices']), 2)
+        self.assertEqual(food['accepted_additions'][0]['title'], "Сыр")
+        self.assertEqual(food['created_by'], "Anonymous")
+
+
+class MenuCacheTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+        create_menu(categories=2, foods_per_category=2)
+
+    def test_cached_list_does_not_touch_db(self):
+        params = {'category': FoodCategory.objects.first().id}
+        first = self.client.get('/food/', params)
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get('/food/', params)
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(first.content, second.content)
+
+    def test_version_bumped_after_commit(self):
+        self.client.get('/category/')
+        with self.captureOnCommitCallbacks() as callbacks:
+            FoodCategory.objects.create(title="Новая", description="")
+            # До коммита версия прежняя, ответ берётся из кэша
+            self.assertEqual(len(self.client.get('/category/').json()['results']), 2)
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(self.client.get('/category/').json()['results']), 3)
+
+    def test_change_invalidates_cache(self):
+        self.assertEqual(len(self.client.get('/category/').json()['results']), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            FoodCategory.objects.create(title="Новая", description="")
+        self.assertEqual(len(self.client.get('/category/').json()['results']), 3)
+
+        food = Food.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            food.sizes_and_prices.create(title="XL", size=40, price=Decimal('700.00'))
+        data = {item['id']: item for item in self.client.get('/food/').json()['results']}
+        self.assertEqual(len(data[food.id]['sizes_and_prices']), 3)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+        create_menu(categories=1, foods_per_category=2)
+
+    def test_not_modified_before_serialization(self):
+        food = Food.objects.first()
+        for url in ('/food/', f'/food/{food.id}/', '/category/', '/addition/'):
+            etag = self.client.get(url)['ETag']
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_change_produces_new_etag(self):
+        etag = self.client.get('/addition/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Addition.objects.create(title="Бекон", price=Decimal('80.00'))
+        response = self.client.get('/addition/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Last-Modified', response)
+
+    @override_settings(ALLOWED_HOSTS=['a.example', 'b.example'])
+    def test_etag_depends_on_host(self):
+        etag = self.client.get('/category/', HTTP_HOST='a.example')['ETag']
+        response = self.client.get('/category/', HTTP_HOST='b.example', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+        create_menu(categories=2, foods_per_category=5)
+
+    def test_walks_all_pages(self):
+        ids = []
+        url = '/food/?page_size=3'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 3)
+            ids += [item['id'] for item in page['results']]
+            url = page['next']
+        self.assertEqual(ids, list(Food.objects.order_by('created_at', 'id').values_list('id', flat=True)))
+
+    def test_unpaginated_mode(self):
+        data = self.client.get('/food/', {'paginate': 'false'}).json()
+        self.assertEqual(len(data), 10)
+
+
+class DiscountEngineTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        create_menu(categories=2, foods_per_category=1)
+        self.pizza, self.soup = Food.objects.order_by('id')
+        self.order = Order.objects.create()
+        for food in (self.pizza, self.soup):
+            self.order.order_items.add(Ordering.objects.create(food=food, size=food.sizes_and_prices.get(size=35)))
+
+    def create_discount(self, title, value, **condition):
+        categories = condition.pop('food_categories', [])
+        discount_condition = DiscountCondition.objects.create(title=title, **condition)
+        discount_condition.food_categories.set(categories)
+        return Discount.objects.create(title=title, description="", condition=discount_condition,
+                                       status=1, discount_value=Decimal(value))
+
+    def test_best_discount_and_reasons(self):
+        small = self.create_discount("Малая", '3.00', min_order_price=500)
+        big = self.create_discount("Большая", '7.50', food_categories=[self.soup.category])
+        too_heavy = self.create_discount("Тяжёлая", '9.99', min_order_weight=5000, discount_card=True)
+
+        engine = get_discount_engine()
+        pricing = self.order.pricing
+        with CaptureQueriesContext(connection) as ctx:
+            result = engine.evaluate(pricing)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        self.assertEqual(pricing.subtotal, Decimal('1000.00'))
+        self.assertEqual(result.best.id, big.id)
+        self.assertEqual(result.amount, Decimal('75.00'))
+        self.assertEqual({discount.id for discount in result.applicable}, {small.id, big.id})
+        self.assertEqual(result.rejected, {too_heavy.id: ['min_order_weight', 'discount_card']})
+        self.assertEqual(self.order.get_discount_price(), Decimal('925.00'))
+
+    def test_engine_recompiled_after_change(self):
+        discount = self.create_discount("Малая", '3.00')
+        self.assertIs(get_discount_engine(), get_discount_engine())
+        discount.status = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            discount.save()
+        self.assertEqual(get_discount_engine().discounts, [])
+
+
+class PromoFeedTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.now = timezone.now()
+        hour = timedelta(hours=1)
+        self.always = self.banner("Всегда")
+        self.soon = self.banner("Скоро", start=self.now + hour)
+        self.ending = self.banner("До вечера", start=self.now - hour, end=self.now + 2 * hour)
+        self.banner("Прошёл", end=self.now - hour)
+        self.banner("Выключен", status=0)
+        condition = DiscountCondition.objects.create(title="Без условий")
+        self.discount = Discount.objects.create(title="Скидка", description="", condition=condition, status=1,
+                                                discount_value=Decimal('5.00'), created_at=self.now - hour,
+                                                expires_at=self.now + 3 * hour)
+        Discount.objects.create(title="Будущая", description="", condition=condition, status=1,
+                                discount_value=Decimal('5.00'), created_at=self.now + 5 * hour)
+
+    def banner(self, title, start=None, end=None, status=1):
+        return Banner.objects.create(title=title, image='banner_images/a.jpg', status=status,
+                                     show_date_start=start, show_date_end=end)
+
+    def feed_at(self, moment):
+        with mock.patch('main.promo.timezone.now', return_value=moment), \
+                CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/promo/').json()
+        return [banner['title'] for banner in data['banners']], \
+            [discount['title'] for discount in data['discounts']], len(ctx.captured_queries)
+
+    def test_cached_until_next_boundary(self):
+        banners, discounts, queries = self.feed_at(self.now)
+        self.assertEqual(banners, ["Всегда", "До вечера"])
+        self.assertEqual(discounts, ["Скидка"])
+        self.assertGreater(queries, 0)
+
+        # До начала показа «Скоро» набор тот же, лента из кэша
+        just_before = self.soon.show_date_start - timedelta(microseconds=1)
+        self.assertEqual(self.feed_at(just_before), (["Всегда", "До вечера"], ["Скидка"], 0))
+        banners, _, queries = self.feed_at(self.soon.show_date_start)
+        self.assertEqual(banners, ["Всегда", "До вечера", "Скоро"])
+        self.assertGreater(queries, 0)
+
+        # Конец окна входит в него
+        self.assertEqual(self.feed_at(self.ending.show_date_end)[:2], (["Всегда", "До вечера", "Скоро"], ["Скидка"]))
+        after_end = self.ending.show_date_end + timedelta(microseconds=1)
+        self.assertEqual(self.feed_at(after_end)[:2], (["Всегда", "Скоро"], ["Скидка"]))
+
+    def test_change_invalidates_feed(self):
+        self.feed_at(self.now)
+        self.always.status = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            self.always.save()
+        self.assertEqual(self.feed_at(self.now)[0], ["До вечера"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.discount.delete()
+        self.assertEqual(self.feed_at(self.now)[1], [])
+
+    def test_boundary_queries_use_indexes(self):
+        with CaptureQueriesContext(connection) as ctx:
+            Banner.objects.next_change(self.now)
+            Discount.objects.next_change(self.now)
+        indexes = ['banner_start_idx', 'banner_end_idx', 'discount_start_idx', 'discount_end_idx']
+        for query, index in zip(ctx.captured_queries, indexes):
+            with self.subTest(index=index), connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+                    cursor.execute(f"EXPLAIN {query['sql']}")
+                else:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                self.assertIn(index, str(cursor.fetchall()))
+
+    def test_is_active_now_uses_aware_time(self):
+        self.assertTrue(self.discount.is_active_now())
+        self.assertFalse(Discount.objects.get(title="Будущая").is_active_now())
+        self.assertEqual(list(Discount.objects.active(self.now)), [self.discount])
+
+
+class OrderPricingTest(TestCase):
+    def test_single_query_with_additions_and_counts(self):
+        create_menu(categories=1, foods_per_category=1)
+        food = Food.objects.get()
+        cheese = Addition.objects.get()
+        order = Order.objects.create()
+        line = Ordering.objects.create(food=food, size=food.sizes_and_prices.get(size=25), count=2)
+        AdditionEnrollment.objects.create(ordering=line, addition=cheese, count=3)
+        order.order_items.add(line, Ordering.objects.create(food=food, size=food.sizes_and_prices.get(size=35)))
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(order.get_pre_discount_price(), Decimal('1400.00'))  # (300 + 3*50)*2 + 500
+            self.assertEqual(order.get_order_weight(), 1500)
+            self.assertEqual(order.pricing.lines[0].total, Decimal('900.00'))
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+
+class QuoteTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+        create_menu(categories=1, foods_per_category=3)
+
+    def cart(self, food, count=1, additions=()):
+        size = food.sizes_and_prices.get(size=25)
+        return {'items': [{'food': food.id, 'size': size.id, 'count': count,
+                           'additions': [{'addition': addition.id, 'count': 1} for addition in additions]}]}
+
+    def test_quotes_many_carts_without_saving(self):
+        foods = list(Food.objects.all())
+        cheese = Addition.objects.get()
+        carts = [self.cart(food, count=i + 1, additions=[cheese]) for i, food in enumerate(foods)]
+        get_discount_engine()
+        with CaptureQueriesContext(connection) as small:
+            self.client.post('/order/quote/', carts[:1], format='json')
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post('/order/quote/', carts, format='json')
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+        self.assertEqual([quote['total'] for quote in response.json()], ['350.00', '700.00', '1050.00'])
+        self.assertFalse(Order.objects.exists() or Ordering.objects.exists())
+
+    def test_single_cart_and_validation(self):
+        food = Food.objects.first()
+        response = self.client.post('/order/quote/', self.cart(food), format='json')
+        self.assertEqual(response.json()['subtotal'], '300.00')
+
+        other_size = Food.objects.last().sizes_and_prices.first()
+        cart = {'items': [{'food': food.id, 'size': other_size.id}]}
+        self.assertEqual(self.client.post('/order/quote/', cart, format='json').status_code, 400)
+
+
+class FoodRatingTest(TestCase):
+    def setUp(self):
+        create_menu(categories=1, foods_per_category=2)
+        self.food, self.other = Food.objects.order_by('id')
+        self.user = User.objects.create(username="critic")
+
+    def assertRating(self, food, count, rating):
+        food.refresh_from_db()
+        self.assertEqual(food.rating_count, count)
+        self.assertEqual(food.get_rate(), rating)
+
+    def test_rating_follows_feedback(self):
+        first = FoodFeedback.objects.create(text="", rate=5, created_by=self.user, food=self.food)
+        FoodFeedback.objects.create(text="", rate=3, created_by=self.user, food=self.food)
+        self.assertRating(self.food, 2, 4)
+
+        first.rate = 1
+        first.save()
+        self.assertRating(self.food, 2, 2)
+
+        first.food = self.other
+        first.save()
+        self.assertRating(self.food, 1, 3)
+        self.assertRating(self.other, 1, 1)
+
+        first.delete()
+        self.assertRating(self.other, 0, None)
+
+    def test_rebuild_command(self):
+        FoodFeedback.objects.create(text="", rate=4, created_by=self.user, food=self.food)
+        Food.objects.update(rating_sum=0, rating_count=0, rating=None)
+        call_command('rebuild_food_ratings', stdout=StringIO())
+        self.assertRating(self.food, 1, 4)
+        self.assertRating(self.other, 0, None)
+
+
+class CategoryCountsTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+
+    def test_category_list_is_one_query(self):
+        create_menu(categories=3, foods_per_category=2)
+        Food.objects.filter(pk=Food.objects.first().pk).update(active=False)
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/category/', {'paginate': 'false'}).json()
+        self.assertEqual(len(ctx.captured_queries), 1)
+        counts = [(item['count_in'], item['active_count_in']) for item in sorted(data, key=lambda item: item['id'])]
+        self.assertEqual(counts, [(2, 1), (2, 2), (2, 2)])
+
+
+@override_settings(IMAGE_WORKERS=0, MEDIA_ROOT=tempfile.mkdtemp())
+class ImagePipelineTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+        buffer = BytesIO()
+        Image.new('RGB', (2000, 1000), 'red').save(buffer, 'PNG')
+        self.png = buffer.getvalue()
+
+    def test_base64_upload_builds_renditions(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/category/', {
+                'title': "Пицца", 'description': "Тесто и сыр",
+                'image': "data:image/png;base64," + base64.b64encode(self.png).decode(),
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIsNone(response.json()['images'])
+
+        category = FoodCategory.objects.get()
+        self.assertEqual(category.image_hash, hashlib.sha256(self.png).hexdigest())
+        self.assertEqual(category.image.name, f"images/food_category/{category.image_hash}.png")
+        with default_storage.open(rendition_name(category.image_hash, 'card', 'webp')) as file:
+            self.assertEqual(Image.open(file).size, (480, 240))
+
+        images = self.client.get(f'/category/{category.id}/').json()['images']
+        self.assertTrue(images['thumb']['jpeg'].endswith(f"{category.image_hash}-thumb.jpeg"))
+
+    def test_rejects_non_image(self):
+        response = self.client.post('/category/', {
+            'title': "Пицца", 'description': "Тесто и сыр", 'image': base64.b64encode(b"not an image" * 10).decode(),
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_failure_is_reported_and_job_forgotten(self):
+        category = FoodCategory.objects.create(title="Пицца", description="")
+        # Сигнатура PNG проходит проверку в запросе, а декодировать нечего
+        broken = "data:image/png;base64," + base64.b64encode(self.png[:100]).decode()
+        with self.assertLogs('main.images', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/category/{category.id}/', {'image': broken}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['image_error'], '')
+        self.assertEqual(_latest_jobs, {})
+        data = self.client.get(f'/category/{category.id}/').json()
+        self.assertEqual((data['images'], data['image_error']), (None, "Не удалось обработать изображение."))
+
+        upload = "data:image/png;base64," + base64.b64encode(self.png).decode()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/category/{category.id}/', {'image': upload}, format='json')
+        self.assertEqual(response.json()['image_error'], '')
+        data = self.client.get(f'/category/{category.id}/').json()
+        self.assertEqual(data['image_error'], '')
+        self.assertIsNotNone(data['images'])
+
+    @override_settings(IMAGE_MAX_UPLOAD_SIZE=1024, IMAGE_MAX_REQUEST_SIZE=1024)
+    def test_rejects_large_body_before_reading(self):
+        food = Food.objects.create(title="Пицца")
+        response = self.client.put(f'/food/{food.id}/image/', self.png + bytes(20 * 1024), content_type='image/png',
+                                   HTTP_CONTENT_DISPOSITION='attachment; filename=pizza.png')
+        self.assertEqual(response.status_code, 413)
+        response = self.client.post('/category/', {'title': "Пицца", 'description': "",
+                                                   'image': base64.b64encode(self.png).decode()}, format='json')
+        self.assertEqual(response.status_code, 413)
+
+    def test_oversize_file_within_request_limit(self):
+        addition = Addition.objects.create(title="Сыр", price=Decimal('50.00'))
+        with override_settings(IMAGE_MAX_UPLOAD_SIZE=len(self.png) // 2):
+            raw = self.client.put(f'/addition/{addition.id}/image/', self.png, content_type='image/png',
+                                  HTTP_CONTENT_DISPOSITION='attachment; filename=cheese.png')
+            upload = SimpleUploadedFile("cheese.png", self.png, content_type="image/png")
+            multipart = self.client.put(f'/addition/{addition.id}/image/', {'image': upload}, format='multipart')
+        self.assertEqual(raw.status_code, 413)
+        self.assertEqual(multipart.status_code, 413)
+        self.assertIn("Изображение больше", multipart.json()['detail'])
+
+
+@override_settings(IMAGE_WORKERS=0, MEDIA_ROOT=tempfile.mkdtemp())
+class ImageUploadCommitTest(TransactionTestCase):
+    """Файлы загрузки забираются только после настоящего коммита, пока запрос ещё идёт."""
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+        buffer = BytesIO()
+        Image.new('RGB', (200, 100), 'red').save(buffer, 'PNG')
+        self.png = buffer.getvalue()
+
+    def test_multipart_and_raw_uploads(self):
+        addition = Addition.objects.create(title="Сыр", price=Decimal('50.00'))
+        upload = SimpleUploadedFile("cheese.png", self.png, content_type="image/png")
+        response = self.client.put(f'/addition/{addition.id}/image/', {'image': upload}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        addition.refresh_from_db()
+        self.assertEqual(addition.image_hash, hashlib.sha256(self.png).hexdigest())
+
+        food = Food.objects.create(title="Пицца")
+        response = self.client.put(f'/food/{food.id}/image/', self.png, content_type='image/png',
+                                   HTTP_CONTENT_DISPOSITION='attachment; filename=pizza.png')
+        self.assertEqual(response.status_code, 202)
+        food.refresh_from_db()
+        self.assertTrue(default_storage.exists(food.image.name))
+
+    def test_rollback_leaves_upload_to_django(self):
+        food = Food.objects.create(title="Пицца")
+        upload = TemporaryUploadedFile("pizza.png", 'image/png', len(self.png), None)
+        upload.write(self.png)
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                schedule_image(food, 'image', UploadedPendingImage(upload))
+                raise RuntimeError
+        # Файл остался на месте и удалится вместе с загрузкой, задача не заведена
+        self.assertTrue(os.path.exists(upload.temporary_file_path()))
+        self.assertEqual(_latest_jobs, {})
+        upload.close()
+        self.assertFalse(os.path.exists(upload.temporary_file_path()))
+
+
+MENU_JSONL = """\
+{"type": "category", "code": "pizza", "title": "Пицца", "description": "Печь"}
+{"type": "addition", "code": "cheese", "title": "Сыр", "price": "50.00"}
+{"type": "food", "code": "margarita", "title": "Маргарита", "category": "pizza", "additions": ["cheese"], \
+"sizes": [{"title": "S", "size": 25, "price": "300.00", "weight": 400}, {"title": "L", "size": 35, "price": "500.00"}]}
+{"type": "food", "code": "pepperoni", "title": "Пепперони", "category": "pizza", "active": false, \
+"sizes": [{"title": "S", "size": 25, "price": "350.00"}]}
+"""
+
+MENU_CSV = """\
+type,code,title,description,category,cooking_time,active,additions,size_code,size_title,size,price,weight
+category,pizza,Пицца,Печь,,,,,,,,,
+food,margarita,Маргарита 2.0,,pizza,15,1,,,S,25,320.00,400
+food,margarita,Маргарита 2.0,,pizza,15,1,,,XL,40,700.00,900
+"""
+
+
+class MenuTransferTest(TestCase):
+    def test_import_upserts_by_code(self):
+        stats = import_menu(parse(MENU_JSONL.splitlines(), 'jsonl'))
+        self.assertEqual(stats, {'categories': 1, 'additions': 1, 'foods': 2, 'sizes': 3})
+        margarita = Food.objects.get(code='margarita')
+        self.assertEqual(sorted(margarita.sizes_and_prices.values_list('price', flat=True)),
+                         [Decimal('300.00'), Decimal('500.00')])
+        self.assertFalse(Food.objects.get(code='pepperoni').active)
+
+        import_menu(parse(MENU_CSV.splitlines(), 'csv'))
+        margarita.refresh_from_db()
+        self.assertEqual(margarita.title, "Маргарита 2.0")
+        self.assertEqual(margarita.cooking_time, 15)
+        self.assertEqual(sorted(margarita.sizes_and_prices.values_list('title', 'price')),
+                         [('L', Decimal('500.00')), ('S', Decimal('320.00')), ('XL', Decimal('700.00'))])
+        self.assertEqual(FoodCategory.objects.count(), 1)
+        self.assertEqual(list(margarita.accepted_additions.values_list('code', flat=True)), ['cheese'])
+
+    def test_import_is_batched(self):
+        def menu(foods):
+            lines = ['{"type": "category", "code": "c", "title": "C", "description": ""}']
+            lines += [json.dumps({'type': 'food', 'code': f'f{i}', 'title': 'F', 'category': 'c',
+                                  'sizes': [{'title': 'S', 'price': '1.00'}]}) for i in range(foods)]
+            return parse(lines, 'jsonl')
+
+        with CaptureQueriesContext(connection) as ctx:
+            import_menu(menu(200))
+        # Пачки ограничены только лимитом параметров SQLite, а не числом строк
+        self.assertLess(len(ctx.captured_queries), 20)
+        self.assertEqual(Food.objects.count(), 200)
+
+    def test_invalid_records_report_line(self):
+        category = '{"type": "category", "code": "c", "title": "C", "description": ""}'
+        for line, message in (('[1, 2]', "Строка 2: ожидался объект"),
+                              ('{"type": "addition", "code": "a", "title": "A", "price": "abc"}', "Строка 2: price"),
+                              ('{"type": "food", "code": "f", "title": "F", "sizes": [1]}', "Строка 2: sizes"),
+                              ('{"type": "food", "code": "f", "title": "F", "cooking_time": "x"}',
+                               "Строка 2: cooking_time"),
+                              ('{"type": "category", "code": "d"}', "Строка 2: нет title"),
+                              (json.dumps({'type': 'category', 'code': 'd', 'title': 'Т' * 65}),
+                               "Строка 2: title длиннее 64 символов"),
+                              (json.dumps({'type': 'food', 'code': 'f', 'title': 'F',
+                                           'sizes': [{'title': 'S' * 49, 'price': '1.00'}]}),
+                               "Строка 2: title длиннее 48 символов"),
+                              (json.dumps({'type': 'food', 'code': 'f' * 62, 'title': 'F',
+                                           'sizes': [{'title': 'XXL', 'price': '1.00'}]}),
+                               "Строка 2: code длиннее 64 символов")):
+            with self.assertRaisesMessage(MenuImportError, message):
+                import_menu(parse([category, line], 'jsonl'))
+        with self.assertRaisesMessage(MenuImportError, "Строка 3: price"):
+            import_menu(parse(MENU_CSV.splitlines()[:2] + ['food,f,F,,,,,,,S,25,abc,1'], 'csv'))
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="admin", is_staff=True))
+        upload = SimpleUploadedFile("menu.jsonl", b'{"type": "addition", "code": "a", "title": "A", "price": "abc"}')
+        response = client.post('/menu/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Строка 1", response.json()['file'])
+        self.assertFalse(Addition.objects.exists())
+
+    def test_repeated_size_codes_keep_last(self):
+        line = json.dumps({'type': 'food', 'code': 'f', 'title': 'F', 'sizes': [
+            {'title': 'S', 'price': '1.00'}, {'title': 'S', 'price': '2.00'}]})
+        stats = import_menu(parse([line], 'jsonl'))
+        self.assertEqual(stats['sizes'], 1)
+        self.assertEqual(list(Food.objects.get().sizes_and_prices.values_list('price', flat=True)), [Decimal('2.00')])
+
+    def test_export_round_trip_and_endpoint(self):
+        import_menu(parse(MENU_JSONL.splitlines(), 'jsonl'))
+        client = APIClient()
+        self.assertEqual(client.get('/menu/export/').status_code, 403)
+
+        client.force_authenticate(User.objects.create(username="admin", is_staff=True))
+        for file_format in ('jsonl', 'csv'):
+            response = client.get('/menu/export/', {'file_format': file_format})
+            exported = b"".join(response.streaming_content)
+            upload = SimpleUploadedFile(f"menu.{file_format}", exported)
+            response = client.post(f'/menu/import/?file_format={file_format}', {'file': upload}, format='multipart')
+            self.assertEqual(response.json(), {'categories': 1, 'additions': 1, 'foods': 2, 'sizes': 3})
+        self.assertEqual(SizeAndPrice.objects.count(), 3)
+
+
+class FoodUpdateTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+        create_menu(categories=1, foods_per_category=1)
+        self.food = Food.objects.get()
+
+    def payload(self, sizes):
+        data = self.client.get(f'/food/{self.food.id}/').json()
+        data.update(category=data['category']['id'], sizes_and_prices=sizes,
+                    accepted_additions=[item['id'] for item in data['accepted_additions']])
+        del data['image']
+        return data
+
+    def test_unchanged_sizes_keep_ids_and_orders(self):
+        small, large = self.food.sizes_and_prices.order_by('size')
+        order_line = Ordering.objects.create(food=self.food, size=large)
+        sizes = [
+            {'id': small.id, 'title': "S", 'size': 25, 'price': "320.00", 'weight': 400},
+            {'title': "XL", 'size': 40, 'price': "800.00", 'weight': 1000},
+        ]
+        response = self.client.patch(f'/food/{self.food.id}/', self.payload(sizes), format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        self.assertEqual(sorted(self.food.sizes_and_prices.values_list('title', 'price')),
+                         [('S', Decimal('320.00')), ('XL', Decimal('800.00'))])
+        self.assertTrue(self.food.sizes_and_prices.filter(id=small.id).exists())
+        # Размер L отвязан от блюда, но позиция заказа на него жива
+        self.assertTrue(Ordering.objects.filter(id=order_line.id, size=large).exists())
+
+    def test_noop_update_writes_nothing(self):
+        sizes = list(self.food.sizes_and_prices.values('id', 'title', 'size', 'price', 'weight'))
+        for size in sizes:
+            size['price'] = str(size['price'])
+        data = self.payload(sizes)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch(f'/food/{self.food.id}/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        writes = [query['sql'] for query in ctx.captured_queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes, [])
+
+
+class FoodSearchTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+        pizza = FoodCategory.objects.create(title="Пиццы", description="")
+        soups = FoodCategory.objects.create(title="Супы", description="")
+        Food.objects.create(title="Пицца Маргарита", description="Томаты и моцарелла", category=pizza)
+        Food.objects.create(title="Пепперони", description="Острая колбаса", category=pizza)
+        Food.objects.create(title="Борщ", description="Свекольный суп со сметаной", category=soups)
+        Food.objects.create(title="Томатный суп", description="", category=soups)
+
+    def search(self, q):
+        return [item['title'] for item in self.client.get('/food/search/', {'q': q}).json()]
+
+    def test_stemming_prefix_and_typos(self):
+        self.assertEqual(self.search("маргариту"), ["Пицца Маргарита"])
+        self.assertEqual(self.search("пепп"), ["Пепперони"])
+        self.assertEqual(self.search("боршь"), ["Борщ"])
+        self.assertEqual(self.search("суп томатный"), ["Томатный суп"])
+
+    def test_ranks_title_above_description_and_category(self):
+        self.assertEqual(self.search("суп"), ["Томатный суп", "Борщ"])
+        self.assertEqual(self.search("пиццы")[0], "Пицца Маргарита")
+
+    def test_limit(self):
+        self.assertEqual(len(self.client.get('/food/search/', {'q': "суп", 'limit': 1}).json()), 1)
+        for limit in ('0', '-5', 'abc'):
+            response = self.client.get('/food/search/', {'q': "суп", 'limit': limit})
+            self.assertEqual(response.status_code, 400, limit)
+
+
+class FoodFilterTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.client = APIClient()
+        self.pizza = FoodCategory.objects.create(title="Пиццы", description="")
+        self.soups = FoodCategory.objects.create(title="Супы", description="")
+        self.cheese = Addition.objects.create(title="Сыр", price=Decimal('50.00'))
+        self.margarita = Food.objects.create(title="Маргарита", category=self.pizza, cooking_time=20)
+        self.margarita.sizes_and_prices.create(title="S", size=25, price=Decimal('300.00'))
+        self.margarita.sizes_and_prices.create(title="L", size=35, price=Decimal('550.00'))
+        self.margarita.accepted_additions.add(self.cheese)
+        self.borsch = Food.objects.create(title="Борщ", category=self.soups, cooking_time=10)
+        self.borsch.sizes_and_prices.create(title="Порция", size=1, price=Decimal('250.00'))
+        self.hidden = Food.objects.create(title="Старая пицца", category=self.pizza, cooking_time=30, active=False)
+        self.hidden.sizes_and_prices.create(title="S", size=25, price=Decimal('400.00'))
+        FoodFeedback.objects.create(text="", rate=4, food=self.borsch,
+                                    created_by=User.objects.create(username='critic'))
+
+    def titles(self, **params):
+        response = self.client.get('/food/', {'paginate': 'false', **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.json()]
+
+    def test_filters(self):
+        self.assertCountEqual(self.titles(category=f"{self.pizza.id},{self.soups.id}"),
+                              ["Маргарита", "Борщ", "Старая пицца"])
+        self.assertCountEqual(self.titles(category=self.pizza.id, active='true'), ["Маргарита"])
+        self.assertCountEqual(self.titles(price_min=500, price_max=600), ["Маргарита"])
+        self.assertCountEqual(self.titles(price_max=260), ["Борщ"])
+        self.assertCountEqual(self.titles(cooking_time_min=15, cooking_time_max=30), ["Маргарита", "Старая пицца"])
+        self.assertCountEqual(self.titles(addition=self.cheese.id), ["Маргарита"])
+
+    def test_min_price_follows_sizes(self):
+        self.margarita.refresh_from_db()
+        self.assertEqual(self.margarita.min_price, Decimal('300.00'))
+        size = self.margarita.sizes_and_prices.get(title="S")
+        size.price = Decimal('600.00')
+        size.save()
+        self.margarita.refresh_from_db()
+        self.assertEqual(self.margarita.min_price, Decimal('550.00'))
+        self.margarita.sizes_and_prices.get(title="L").delete()
+        self.margarita.refresh_from_db()
+        self.assertEqual(self.margarita.min_price, Decimal('600.00'))
+
+    def test_ordering_with_cursor_pagination(self):
+        self.assertEqual(self.titles(ordering='price'), ["Борщ", "Маргарита", "Старая пицца"])
+        self.assertEqual(self.titles(ordering='-rating')[0], "Борщ")
+
+        url, titles = '/food/?ordering=-price&page_size=1', []
+        while url:
+            data = self.client.get(url).json()
+            titles += [item['title'] for item in data['results']]
+            url = data['next']
+        self.assertEqual(titles, ["Старая пицца", "Маргарита", "Борщ"])
+
+        url, titles = '/food/?ordering=rating&page_size=2', []
+        while url:
+            data = self.client.get(url).json()
+            titles += [item['title'] for item in data['results']]
+            url = data['next']
+        self.assertEqual(titles, ["Маргарита", "Старая пицца", "Борщ"])
+
+    def test_filterset_built_once(self):
+        with mock.patch.object(FoodFilterSet, 'get_form_class', autospec=True,
+                               side_effect=FoodFilterSet.get_form_class) as get_form_class:
+            data = self.client.get('/food/', {'ordering': 'price', 'page_size': 2}).json()
+        self.assertEqual([item['title'] for item in data['results']], ["Борщ", "Маргарита"])
+        self.assertEqual(get_form_class.call_count, 1)
+
+
+class FoodFilterPlanTest(TestCase):
+    """
+    У каждого фильтра и сортировки списка блюд есть индекс, по которому их
+    можно выполнить без полного скана main_food. На почти пустой тестовой
+    базе планировщик PostgreSQL всегда выберет seq scan, поэтому он здесь
+    запрещён (enable_seqscan = off): проверяется, что индексный план
+    существует, а не что планировщик выберет его на живых данных.
+    """
+
+    def plan(self, **params):
+        filterset = FoodFilterSet(params, queryset=Food.objects.all())
+        ordering = filterset.get_ordering() or FoodCursorPagination.ordering
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        return filterset.qs.order_by(*ordering)[:50].explain()
+
+    def assertIndexUsable(self, plan):
+        if connection.vendor == 'postgresql':
+            self.assertNotIn("Seq Scan on main_food ", plan)
+        else:
+            self.assertNotRegex(plan, r"SCAN main_food(?! USING)")
+
+    def test_filters_have_usable_indexes(self):
+        cases = [
+            ({'category': '1,2'}, None),
+            ({'category': '1', 'active': 'true'}, None),
+            ({'active': 'true'}, None),
+            ({'price_min': '100', 'price_max': '300'}, None),
+            ({'addition': '1'}, None),
+            ({'ordering': 'price'}, 'food_min_price_idx'),
+            ({'ordering': '-rating'}, 'food_rating_order_idx'),
+            ({'cooking_time_min': '10', 'cooking_time_max': '20'}, 'food_cooking_time_idx'),
+        ]
+        for params, index in cases:
+            with self.subTest(params=params):
+                plan = self.plan(**params)
+                self.assertIndexUsable(plan)
+                if index:
+                    self.assertIn(index, plan)
+
+
+@override_settings(CHAT_FLUSH_INTERVAL=0.01)
+class ChatWebSocketTest(TransactionTestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='customer')
+        self.courier = User.objects.create(username='courier')
+        self.chat = Chat.objects.create(order=Order.objects.create(), owner=self.owner, dialogue_with=self.courier)
+
+    def session_cookie(self, user):
+        client = APIClient()
+        client.force_login(user)
+        return f"sessionid={client.cookies['sessionid'].value}".encode()
+
+    async def connect(self, cookie, chat_id=None, origin=None):
+        headers = [(b'cookie', cookie)] + ([(b'origin', origin)] if origin else [])
+        scope = {'type': 'websocket', 'path': f'/ws/chat/{chat_id or self.chat.id}/', 'headers': headers}
+        communicator = ApplicationCommunicator(chat_application, scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        return communicator, await communicator.receive_output(timeout=1)
+
+    async def receive(self, communicator):
+        event = await communicator.receive_output(timeout=1)
+        self.assertEqual(event['type'], 'websocket.send')
+        return json.loads(event['text'])
+
+    async def test_messages_and_read_receipts(self):
+        owner_cookie = await sync_to_async(self.session_cookie)(self.owner)
+        courier_cookie = await sync_to_async(self.session_cookie)(self.courier)
+        owner, accepted = await self.connect(owner_cookie)
+        self.assertEqual(accepted['type'], 'websocket.accept')
+        courier, accepted = await self.connect(courier_cookie)
+        self.assertEqual(accepted['type'], 'websocket.accept')
+
+        for text in ("Где курьер?", "Жду у подъезда"):
+            await owner.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'message', 'message': text})})
+        received = [await self.receive(courier), await self.receive(courier)]
+        self.assertEqual([event['message'] for event in received], ["Где курьер?", "Жду у подъезда"])
+        self.assertEqual(received[0]['sender'], self.owner.id)
+        self.assertEqual([(await self.receive(owner))['id'] for _ in received], [event['id'] for event in received])
+
+        await courier.send_input({'type': 'websocket.receive',
+                                  'text': json.dumps({'type': 'read', 'up_to': received[-1]['id']})})
+        receipt = await self.receive(owner)
+        self.assertEqual((receipt['type'], receipt['user'], receipt['up_to']), ('read', self.courier.id, received[-1]['id']))
+        unread = await sync_to_async(Message.objects.filter(chat=self.chat, is_read=False).count)()
+        self.assertEqual(unread, 0)
+
+        await owner.send_input({'type': 'websocket.receive', 'text': 'not json'})
+        self.assertEqual((await self.receive(owner))['type'], 'error')
+
+        for communicator in (owner, courier):
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(timeout=1)
+        await close_chat()
+
+    async def test_outsider_is_rejected(self):
+        stranger = await sync_to_async(User.objects.create)(username='stranger')
+        cookie = await sync_to_async(self.session_cookie)(stranger)
+        communicator, event = await self.connect(cookie)
+        self.assertEqual(event, {'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        _, event = await self.connect(b'')
+        self.assertEqual(event['code'], CLOSE_FORBIDDEN)
+
+    @override_settings(ALLOWED_HOSTS=['shop.example', '.example.ru'], CORS_ALLOWED_ORIGINS=['https://app.partner.io'])
+    async def test_cross_site_origin_is_rejected(self):
+        cookie = await sync_to_async(self.session_cookie)(self.owner)
+        for origin, allowed in ((b'https://shop.example', True), (b'https://m.example.ru:8443', True),
+                                (b'https://app.partner.io', True), (b'https://evil.example', False),
+                                (b'null', False)):
+            communicator, event = await self.connect(cookie, origin=origin)
+            self.assertEqual(event['type'], 'websocket.accept' if allowed else 'websocket.close', origin)
+            if allowed:
+                await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+                await communicator.wait(timeout=1)
+        await close_chat()
+
+    def test_batch_is_one_insert_and_one_update_per_table(self):
+        async def write_batch():
+            fanout, writer = get_chat()
+            for i in range(20):
+                writer.add_message(Message(chat_id=self.chat.id, sender_id=self.owner.id, message=f"{i}"))
+            writer.mark_read(self.chat.id, self.courier.id, 10 ** 9)
+            await close_chat()
+
+        with CaptureQueriesContext(connection) as ctx:
+            async_to_sync(write_batch)()
+        statements = [' '.join(query['sql'].split()[:3]) for query in ctx.captured_queries]
+        self.assertEqual(statements.count('INSERT INTO "main_message"'), 1)
+        self.assertEqual(statements.count('UPDATE "main_message" SET'), 1)
+        self.assertEqual(statements.count('UPDATE "main_chat" SET'), 1)
+        self.assertEqual(Message.objects.filter(is_read=True).count(), 20)
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.last_message.message, "19")
+
+
+class ChatRedisFanoutTest(TestCase):
+    @override_settings(CHAT_FANOUT=settings.CHAT_FANOUT_BACKENDS['redis'])
+    def test_publish_and_deliver(self):
+        client = mock.MagicMock(aclose=mock.AsyncMock())
+        pubsub = client.pubsub.return_value
+        pubsub.subscribe, pubsub.unsubscribe, pubsub.aclose = mock.AsyncMock(), mock.AsyncMock(), mock.AsyncMock()
+        pipe = client.pipeline.return_value.__aenter__.return_value
+        pipe.publish, pipe.execute = mock.MagicMock(), mock.AsyncMock()
+        incoming = asyncio.Queue()
+        pubsub.get_message.side_effect = lambda **kwargs: incoming.get()
+
+        async def run():
+            fanout, _ = get_chat()
+            queue = asyncio.Queue()
+            await fanout.subscribe('chat.1', queue)
+            pubsub.subscribe.assert_awaited_once_with('chat:chat.1')
+            await fanout.publish([('chat.1', {'type': 'message', 'id': 1})])
+            pipe.publish.assert_called_once_with('chat:chat.1', '{"type": "message", "id": 1}')
+            # Событие приходит из подписки, а не напрямую из publish
+            self.assertTrue(queue.empty())
+            await incoming.put({'type': 'message', 'channel': b'chat:chat.1', 'data': b'{"id": 1}'})
+            self.assertEqual(await asyncio.wait_for(queue.get(), 1), {'id': 1})
+            await fanout.unsubscribe('chat.1', queue)
+            pubsub.unsubscribe.assert_awaited_once_with('chat:chat.1')
+            await close_chat()
+
+        with mock.patch('redis.asyncio.from_url', return_value=client) as from_url:
+            async_to_sync(run)()
+        from_url.assert_called_once_with(settings.CHAT_FANOUT_BACKENDS['redis']['LOCATION'])
+        client.aclose.assert_awaited_once()
+
+    def test_menu_cache_backend_imports(self):
+        # Клиент создаётся без подключения, но импортирует пакет redis
+        config = settings.MENU_CACHE_BACKENDS['redis']
+        cache = import_string(config['BACKEND'])(config['LOCATION'], {'KEY_PREFIX': config['KEY_PREFIX']})
+        self.assertEqual(cache._cache._lib.__name__, 'redis')
+
+
+class ChatInboxTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='customer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_chat(self, messages=0, unread=0):
+        courier = User.objects.create(username=f'courier{Chat.objects.count()}')
+        chat = Chat.objects.create(order=Order.objects.create(), owner=self.user, dialogue_with=courier)
+        for i in range(messages):
+            Message.objects.create(chat=chat, sender=courier, message=f"{i}", is_read=i >= unread)
+        return chat
+
+    def test_inbox_order_last_message_and_unread(self):
+        quiet = self.create_chat()
+        busy = self.create_chat(messages=3, unread=2)
+        Message.objects.create(chat=busy, sender=self.user, message="Спасибо")
+        other = Chat.objects.create(order=Order.objects.create(), owner=User.objects.create(username='a'),
+                                    dialogue_with=User.objects.create(username='b'))
+
+        data = self.client.get('/chat/').json()['results']
+        self.assertEqual([chat['id'] for chat in data], [busy.id, quiet.id])
+        self.assertNotIn(other.id, [chat['id'] for chat in data])
+        self.assertEqual(data[0]['last_message']['message'], "Спасибо")
+        self.assertEqual(data[0]['unread_count'], 2)
+        self.assertEqual((data[1]['last_message'], data[1]['unread_count']), (None, 0))
+
+        busy.refresh_from_db()
+        busy.last_message.delete()
+        busy.refresh_from_db()
+        self.assertEqual(busy.get_last_message().message, "2")
+
+    def test_inbox_queries_do_not_grow_with_chats(self):
+        for _ in range(3):
+            self.create_chat(messages=2, unread=1)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/chat/')
+        for _ in range(20):
+            self.create_chat(messages=2, unread=1)
+        with CaptureQueriesContext(connection) as large:
+            data = self.client.get('/chat/?page_size=10').json()
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(len(large.captured_queries), 1)
+        self.assertEqual(len(data['results']), 10)
+        self.assertTrue(data['next'])
+
+
+class ChatHistoryTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='customer')
+        self.courier = User.objects.create(username='courier')
+        self.chat = Chat.objects.create(order=Order.objects.create(), owner=self.owner, dialogue_with=self.courier)
+        for i in range(25):
+            message = Message.objects.create(chat=self.chat, sender=self.courier, message=f"{i}")
+            if i % 5 == 0:
+                message.attachments.add(Attachment.objects.create(file=f'attachments/{i}.jpg'))
+        self.client = APIClient()
+
+    def test_pages_backwards_with_batched_attachments(self):
+        self.client.force_authenticate(self.owner)
+        url, texts, queries = f'/chat/{self.chat.id}/messages/?page_size=10', [], []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                data = self.client.get(url).json()
+            queries.append(len(ctx.captured_queries))
+            texts += [item['message'] for item in data['results']]
+            url = data['next']
+        self.assertEqual(texts, [str(i) for i in reversed(range(25))])
+        # чат, страница сообщений, вложения страницы
+        self.assertEqual(queries, [3, 3, 3])
+        self.assertEqual(len(data['results'][-1]['attachments']), 1)
+
+    def test_history_is_for_participants_only(self):
+        self.client.force_authenticate(User.objects.create(username='stranger'))
+        self.assertEqual(self.client.get(f'/chat/{self.chat.id}/messages/').status_code, 404)
+
+    def test_ndjson_export(self):
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.get(f'/chat/{self.chat.id}/export/').status_code, 403)
+
+        self.client.force_authenticate(User.objects.create(username='support', is_staff=True))
+        response = self.client.get(f'/chat/{self.chat.id}/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['message'] for line in lines], [str(i) for i in range(25)])
+        self.assertEqual(sum(len(line['attachments']) for line in lines), 5)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDIA_MAX_AGE=600)
+class ServeMediaTest(TestCase):
+    def test_hashed_files_are_immutable(self):
+        image_hash = hashlib.sha256(b'image').hexdigest()
+        default_storage.save(f'images/food/{image_hash}.jpg', BytesIO(b'image'))
+        default_storage.save('images/food/legacy.jpg', BytesIO(b'image'))
+
+        response = self.client.get(f'/media/images/food/{image_hash}.jpg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(b''.join(response.streaming_content), b'image')
+        response = self.client.get('/media/images/food/legacy.jpg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=600')
+        cached = self.client.get('/media/images/food/legacy.jpg', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual((cached.status_code, cached['Cache-Control']), (304, 'public, max-age=600'))
+        self.assertEqual(self.client.get('/media/images/food/missing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/images/food/').status_code, 404)
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+
+
+class HealthTest(TestCase):
+    def test_health_and_db_stats(self):
+        client = APIClient()
+        data = client.get('/health/').json()
+        self.assertEqual(data['status'], 'ok')
+        self.assertGreaterEqual(data['database_ms'], 0)
+
+        self.assertEqual(client.get('/health/db/').status_code, 403)
+        client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        data = client.get('/health/db/').json()
+        self.assertEqual(data['vendor'], connection.vendor)
+        self.assertIsNone(data['pool'])
+
+
+@enforce_query_budgets
+class QueryBudgetTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        create_menu(categories=3, foods_per_category=5)
+        self.user = User.objects.create(username='customer')
+        self.client.force_login(self.user)
+
+    def test_endpoints_fit_budgets(self):
+        food = Food.objects.first()
+        size = food.sizes_and_prices.first()
+        addition = Addition.objects.get()
+        for url in ('/food/', '/food/?paginate=false', f'/food/{food.id}/', '/food/search/?q=Блюдо',
+                    '/category/', f'/category/{food.category_id}/', '/addition/', f'/addition/{addition.id}/'):
+            get_menu_cache().clear()
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+        cart = {'items': [{'food': food.id, 'size': size.id, 'additions': [{'addition': addition.id}]}]}
+        self.assertEqual(self.client.post('/order/quote/', [cart] * 3, content_type='application/json').status_code,
+                         200)
+
+        chat = Chat.objects.create(order=Order.objects.create(), owner=self.user, dialogue_with=User.objects.create())
+        Message.objects.create(chat=chat, sender=chat.dialogue_with, message="Еду")
+        for url in ('/chat/', f'/chat/{chat.id}/', f'/chat/{chat.id}/messages/'):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+    def test_exceeded_budget_fails(self):
+        with mock.patch.object(CategoryViewSet, 'query_budgets', {'list': 0}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, "CategoryViewSet.list"):
+                self.client.get('/category/')
+
+
+class MetricsTest(TestCase):
+    def test_server_timing(self):
+        create_menu(categories=1, foods_per_category=2)
+        get_menu_cache().clear()
+        timing = self.client.get('/food/')['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="4 queries", serialize;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_drf_serializers_not_patched(self):
+        # Время считают вьюсеты приложения, а не подмена BaseSerializer.data для всего процесса
+        self.assertEqual(serializers.BaseSerializer.data.fget.__module__, 'rest_framework.serializers')
+
+    def test_prometheus_endpoint(self):
+        self.client.get('/category/')
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertRegex(body, r'http_requests_total\{endpoint="foodcategory-list",method="GET",status="200"\} \d+')
+        self.assertIn('http_request_queries_bucket{endpoint="foodcategory-list",method="GET",le="1"}', body)
+        self.assertIn('http_response_size_bytes_count{endpoint="foodcategory-list",method="GET"}', body)
+
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class BenchTest(TestCase):
+    def test_seed_and_run(self):
+        call_command('seed_bench', users=5, categories=2, foods_per_category=3, orders=4, chats=2,
+                     messages_per_chat=3, discounts=3, stdout=StringIO())
+        self.assertEqual(Food.objects.count(), 6)
+        food = Food.objects.order_by('id').first()
+        self.assertEqual(food.min_price, food.sizes_and_prices.order_by('price').first().price)
+        self.assertEqual(food.rating_count, 5)
+        self.assertEqual(Chat.objects.filter(last_message__isnull=True).count(), 0)
+        with self.assertRaises(CommandError):
+            call_command('seed_bench', stdout=StringIO())
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('run_bench', iterations=2, warmup=0, output=output.name, stdout=StringIO())
+            report = json.load(output)
+        results = {result['name']: result for result in report['results']}
+        self.assertLessEqual({'food-list', 'food-detail', 'food-search', 'foodcategory-list', 'user-list',
+                              'addition-list', 'chat-list', 'chat-messages', 'order-quote',
+                              'pricing-quote-carts', 'discounts-evaluate'}, set(results))
+        self.assertEqual(results['food-list']['queries_per_request'], 6)
+        self.assertEqual(results['discounts-evaluate']['queries_per_request'], 0)
+        self.assertGreater(results['order-quote']['response_bytes'], 0)
+        self.assertGreater(results['food-list']['peak_rss_mb'], 0)
+
+
+class SchemaArtifactTest(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(SCHEMA_ARTIFACT_DIR=directory)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_missing_artifact(self):
+        self.assertEqual(self.client.get('/api/schema/').status_code, 503)
+        with override_settings(DEBUG=True):
+            response = self.client.get('/api/schema/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'openapi:', response.content)
+
+    def test_serves_precompressed_artifact(self):
+        call_command('build_schema', stdout=StringIO())
+        with mock.patch('main.schema.generate_schema', side_effect=AssertionError("генерация в запросе")):
+            plain = self.client.get('/api/schema/?format=json')
+            br = self.client.get('/api/schema/?format=json', HTTP_ACCEPT_ENCODING='gzip, br')
+            gz = self.client.get('/api/schema/', HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+            yaml = self.client.get('/api/schema/')
+
+        self.assertEqual(plain['Content-Type'], 'application/vnd.oai.openapi+json; charset=utf-8')
+        self.assertIn('/promo/', json.loads(plain.content)['paths'])
+        self.assertEqual(br['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(br.content), plain.content)
+        self.assertEqual(gz['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gz.content), yaml.content)
+        self.assertEqual(len({plain['ETag'], br['ETag'], gz['ETag'], yaml['ETag']}), 4)
+        self.assertTrue(br['Vary'].startswith('Accept, Accept-Encoding'))
+
+        response = self.client.get('/api/schema/?format=json', HTTP_ACCEPT_ENCODING='br',
+                                   HTTP_IF_NONE_MATCH=br['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Та же схема — те же байты и ETag
+        call_command('build_schema', stdout=StringIO())
+        self.assertEqual(self.client.get('/api/schema/?format=json')['ETag'], plain['ETag'])
+
+
+class FastReadTest(TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        create_menu(categories=2, foods_per_category=2)
+        user = User.objects.create(username='cook')
+        food = Food.objects.first()
+        food.image, food.image_hash = 'images/food/dish.png', 'a' * 64
+        food.description, food.rating, food.created_by = "Острое   «блюдо»", 4.5, user
+        food.save()
+        category = food.category
+        category.image, category.image_hash = 'images/food_category/soups.png', 'b' * 64
+        category.save()
+        Addition.objects.create(title="Соус", description="Без лука", price=Decimal('0.50'),
+                                image='images/food_addition/sauce.png', image_hash='c' * 64)
+        Food.objects.create(title="Без категории", category=None)
+
+    def assert_same_as_serializer(self, url, **extra):
+        fast = self.client.get(url, **extra)
+        get_menu_cache().clear()
+        with mock.patch.object(FastReadMixin, 'list', mixins.ListModelMixin.list), \
+                mock.patch.object(FastReadMixin, 'retrieve', mixins.RetrieveModelMixin.retrieve):
+            regular = self.client.get(url, **extra)
+        get_menu_cache().clear()
+        self.assertEqual(fast.status_code, 200, url)
+        self.assertEqual(fast.content, regular.content, url)
+        return fast
+
+    def test_byte_compatible(self):
+        food = Food.objects.filter(image_hash__gt='').get()
+        addition = Addition.objects.get(title="Соус")
+        for url in ('/food/', '/food/?paginate=false', '/food/?page_size=2&ordering=-price', f'/food/{food.id}/',
+                    f'/food/{Food.objects.get(category=None).id}/', '/category/', '/category/?paginate=false',
+                    f'/category/{food.category_id}/', '/addition/', f'/addition/{addition.id}/'):
+            self.assert_same_as_serializer(url)
+        self.assert_same_as_serializer('/food/', HTTP_ACCEPT='application/json; indent=2')
+        # В HTML browsable API есть ETag с версией меню, она меняется после очистки кэша
+        self.assertContains(self.client.get('/category/?format=api'), "Категория 0")
+
+        data = self.client.get(f'/food/{food.id}/').json()
+        self.assertEqual(data['image'], 'http://testserver/media/images/food/dish.png')
+        self.assertEqual(data['category']['image'], '/media/images/food_category/soups.png')
+        self.assertEqual(data['sizes_and_prices'][0]['price'], '300.00')
+
+    def test_serialization_time_is_reported(self):
+        timing = self.client.get('/food/')['Server-Timing']
+        self.assertNotIn('serialize;dur=0.0,', timing)
+
+    def test_writes_use_serializer(self):
+        category = FoodCategory.objects.first()
+        response = self.client.patch(f'/category/{category.id}/', {'title': "Супы", 'count_in': 100},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count_in'], category.food_set.count())
+        self.assertEqual(response.json()['title'], "Супы")
+
+    def test_custom_to_representation_is_rejected(self):
+        class Custom(AdditionSerializer):
+            def to_representation(self, instance):
+                return {}
+
+        with self.assertRaises(ImproperlyConfigured):
+            get_plan(Custom)
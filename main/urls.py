@@ -8,5 +8,10 @@ router.register(r'food', views.FoodViewSet)
 router.register(r'category', views.CategoryViewSet)
 router.register(r'user', views.UserViewSet)
 router.register(r'addition', views.AdditionsViewSet)
+router.register(r'order', views.OrderViewSet)
+router.register(r'promo', views.PromoViewSet, basename='promo')
+router.register(r'chat', views.ChatViewSet)
+router.register(r'menu', views.MenuTransferViewSet, basename='menu')
+router.register(r'health', views.HealthViewSet, basename='health')
 
 urlpatterns = router.urls
\ No newline at end of file
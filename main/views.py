@@ -1,10 +1,32 @@
-from drf_spectacular.utils import extend_schema_view, extend_schema
-from rest_framework import viewsets
+import io
+
+from django.db import DatabaseError
+from django.http import StreamingHttpResponse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter
+from rest_framework import viewsets, mixins
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser, FileUploadParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
-from main.models import Food, FoodCategory, User, Addition
+from main.cache import MenuCacheMixin, MenuConditionalGetMixin
+from main.chat import export_messages
+from main.fast_read import FastReadMixin
+from main.filters import FoodFilterBackend, FoodFilterSet
+from main.health import check_database, connection_stats
+from main.images import ImageUploadMixin
+from main.models import Food, FoodCategory, User, Addition, Order, Chat
+from main.menu_transfer import import_menu, export_menu, parse, MenuImportError, FORMATS
+from main.metrics import serializer_timer
+from main.pagination import FoodCursorPagination, ChatCursorPagination, MessageCursorPagination
+from main.pricing import quote_carts
+from main.promo import get_feed
+from main.search import search_food_ids
 from main.serializers import FoodCategorySerializer, UserSerializer, AdditionSerializer, \
-    FoodSerializer
+    FoodSerializer, CartSerializer, QuoteSerializer, ChatSerializer, MessageSerializer, PromoSerializer
 
 
 # Create your views here.
@@ -16,23 +38,43 @@ from main.serializers import FoodCategorySerializer, UserSerializer, AdditionSer
 @extend_schema(
     parameters=[]
 )
-class FoodViewSet(ModelViewSet):
-    queryset = Food.objects.all()
+class FoodViewSet(ImageUploadMixin, MenuConditionalGetMixin, MenuCacheMixin, FastReadMixin, ModelViewSet):
+    queryset = Food.objects.for_menu()
     serializer_class = FoodSerializer
+    pagination_class = FoodCursorPagination
+    menu_cache_prefix = 'food'
+    menu_cache_params = ('category', 'active', 'price_min', 'price_max', 'cooking_time_min', 'cooking_time_max',
+                         'addition', 'ordering', 'cursor', 'page_size', 'paginate')
+    filter_backends = [FoodFilterBackend]
+    filterset_class = FoodFilterSet
+    # Бюджеты SQL-запросов (main.metrics) с учётом двух запросов сессии и пользователя
+    query_budgets = {'list': 6, 'retrieve': 6, 'search': 7}
 
-    def get_queryset(self):
-        params = self.request.query_params
-        foods = Food.objects.all()
-        if params:
-            if params.get('category'):
-                foods = Food.objects.filter(category__id=params.get('category'))
-
-        return foods
+    @extend_schema(summary="Поиск блюд по названию, описанию и категории",
+                   parameters=[OpenApiParameter('q', str, required=True),
+                               OpenApiParameter('limit', int, description="По умолчанию 20, не больше 100")])
+    @action(detail=False)
+    def search(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            raise ValidationError({'limit': "Должно быть числом"})
+        if limit < 1:
+            raise ValidationError({'limit': "Должно быть не меньше 1"})
+        ids = search_food_ids(request.query_params.get('q', ''), limit)
+        foods = Food.objects.for_menu().in_bulk(ids)
+        serializer = self.get_serializer([foods[food_id] for food_id in ids if food_id in foods], many=True)
+        with serializer_timer():
+            data = serializer.data
+        return Response(data)
 
 
-class CategoryViewSet(ModelViewSet):
-    queryset = FoodCategory.objects.all()
+class CategoryViewSet(ImageUploadMixin, MenuConditionalGetMixin, MenuCacheMixin, FastReadMixin, ModelViewSet):
+    queryset = FoodCategory.objects.with_food_count()
     serializer_class = FoodCategorySerializer
+    menu_cache_prefix = 'category'
+    menu_cache_params = ('cursor', 'page_size', 'paginate')
+    query_budgets = {'list': 3, 'retrieve': 3}
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -40,6 +82,129 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
 
 
-class AdditionsViewSet(viewsets.ModelViewSet):
+class AdditionsViewSet(ImageUploadMixin, MenuConditionalGetMixin, FastReadMixin, viewsets.ModelViewSet):
     queryset = Addition.objects.all()
     serializer_class = AdditionSerializer
+    menu_cache_prefix = 'addition'
+    query_budgets = {'list': 3, 'retrieve': 3}
+
+
+class OrderViewSet(viewsets.GenericViewSet):
+    queryset = Order.objects.all()
+    # После изменения акций первый расчёт пересобирает DiscountEngine: ещё 5 запросов
+    query_budgets = {'quote': 13}
+
+    @extend_schema(summary="Расчёт стоимости одной или нескольких корзин без создания заказа",
+                   request=CartSerializer(many=True), responses=QuoteSerializer(many=True))
+    @action(detail=False, methods=['post'])
+    def quote(self, request):
+        many = isinstance(request.data, list)
+        serializer = CartSerializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        carts = serializer.validated_data if many else [serializer.validated_data]
+        serializer = QuoteSerializer(quote_carts(carts, user=request.user), many=True)
+        with serializer_timer():
+            quotes = serializer.data
+        return Response(quotes if many else quotes[0])
+
+
+class PromoViewSet(viewsets.ViewSet):
+    """Баннеры и акции, которые видны сейчас, см. main.promo."""
+    permission_classes = [AllowAny]
+    query_budgets = {'list': 8}
+
+    @extend_schema(summary="Активные баннеры и акции", responses=PromoSerializer)
+    def list(self, request):
+        return Response(get_feed(request))
+
+
+class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Чаты текущего пользователя, последние по активности сверху."""
+    queryset = Chat.objects.all()
+    serializer_class = ChatSerializer
+    pagination_class = ChatCursorPagination
+    permission_classes = [IsAuthenticated]
+    query_budgets = {'list': 3, 'retrieve': 3, 'messages': 5}
+
+    def get_queryset(self):
+        if self.action == 'export':
+            return super().get_queryset()
+        return super().get_queryset().inbox(self.request.user)
+
+    @extend_schema(summary="История сообщений чата, новые сверху")
+    @action(detail=True, serializer_class=MessageSerializer, pagination_class=MessageCursorPagination)
+    def messages(self, request, pk=None):
+        chat = self.get_object()
+        page = self.paginate_queryset(chat.message_set.prefetch_related('attachments'))
+        with serializer_timer():
+            data = self.get_serializer(page, many=True).data
+        return self.get_paginated_response(data)
+
+    @extend_schema(summary="Потоковая выгрузка истории чата в NDJSON для поддержки",
+                   responses={(200, 'application/x-ndjson'): OpenApiTypes.BINARY})
+    @action(detail=True, permission_classes=[IsAdminUser])
+    def export(self, request, pk=None):
+        chat = self.get_object()
+        response = StreamingHttpResponse(export_messages(chat, request), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="chat-{chat.pk}.jsonl"'
+        return response
+
+
+class MenuTransferViewSet(viewsets.ViewSet):
+    """Импорт и экспорт меню для админки, формат см. main.menu_transfer."""
+    permission_classes = [IsAdminUser]
+    content_types = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get_file_format(self, request):
+        file_format = request.query_params.get('file_format', 'jsonl')
+        if file_format not in FORMATS:
+            raise ValidationError({'file_format': f"Один из: {', '.join(FORMATS)}"})
+        return file_format
+
+    @extend_schema(summary="Загрузка меню из CSV/JSONL (поле file или тело запроса)",
+                   parameters=[OpenApiParameter('file_format', enum=FORMATS)],
+                   request={'multipart/form-data': {'type': 'object', 'properties': {
+                       'file': {'type': 'string', 'format': 'binary'}}}},
+                   responses={200: OpenApiTypes.OBJECT})
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser, FileUploadParser])
+    def import_(self, request):
+        file_format = self.get_file_format(request)
+        upload = request.data.get('file')
+        if upload is None:
+            raise ValidationError({'file': "Файл не передан"})
+        lines = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+        try:
+            stats = import_menu(parse(lines, file_format))
+        except (MenuImportError, KeyError, ValueError) as error:
+            raise ValidationError({'file': str(error)})
+        return Response(stats)
+
+    @extend_schema(summary="Потоковая выгрузка меню в CSV/JSONL",
+                   parameters=[OpenApiParameter('file_format', enum=FORMATS)],
+                   responses={(200, 'application/x-ndjson'): OpenApiTypes.BINARY,
+                              (200, 'text/csv'): OpenApiTypes.BINARY})
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        file_format = self.get_file_format(request)
+        response = StreamingHttpResponse(export_menu(file_format), content_type=self.content_types[file_format])
+        response['Content-Disposition'] = f'attachment; filename="menu.{file_format}"'
+        return response
+
+
+class HealthViewSet(viewsets.ViewSet):
+    """Проверки для балансировщика и статистика соединений с БД."""
+    permission_classes = [AllowAny]
+
+    @extend_schema(summary="Проверка доступности API и БД", responses={200: OpenApiTypes.OBJECT,
+                                                                         503: OpenApiTypes.OBJECT})
+    def list(self, request):
+        try:
+            database_ms = check_database()
+        except DatabaseError as error:
+            return Response({'status': 'error', 'database': str(error)}, status=503)
+        return Response({'status': 'ok', 'database_ms': round(database_ms, 3)})
+
+    @extend_schema(summary="Соединения с БД и пул текущего воркера", responses={200: OpenApiTypes.OBJECT})
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def db(self, request):
+        return Response(connection_stats())